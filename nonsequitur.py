@@ -1,559 +1,823 @@
 import argparse
-from bokeh import events
-from bokeh.io import output_file, save
-from bokeh.layouts import row, column
-from bokeh.models import (
-    AutocompleteInput,
-    BoxAnnotation,
-    BoxSelectTool,
-    CheckboxGroup,
-    ColumnDataSource,
-    CustomJS,
-    DataTable,
-    Dropdown,
-    HoverTool,
-    HTMLTemplateFormatter,
-    MultiSelect,
-    Range1d,
-    TableColumn,
-)
-
-from bokeh.palettes import Category20
-from bokeh.plotting import figure
+from concurrent.futures import ProcessPoolExecutor
+import re
 from nonsequitur_lib import *
 
-if __name__ == "__main__":
-    timelineplots = list()
-    xcoord_to_time_maps = list()
-    box_annotations = list()
-    trace_event_renderers = list()
-    trace_ids = list()
-    traces_src = list()
 
-    parser = argparse.ArgumentParser()
+def add_event_filter_arguments(parser):
     parser.add_argument(
-        "-i", "--input_folder", type=str, help="Input folder path", required=True
+        "-include",
+        "--include",
+        type=str,
+        nargs="+",
+        help="Only keep calls to these functions",
+        required=False,
     )
     parser.add_argument(
-        "-color",
-        "--color",
+        "-include_regex",
+        "--include_regex",
         type=str,
-        help="Path to file which contains mapping between functions and colors",
+        help="Only keep calls to functions whose name starts with a match of "
+        "this regular expression. Combined with -include, either one keeps a call",
         required=False,
     )
     parser.add_argument(
-        "-title", "--title", type=str, help="Title of the output file", required=False
+        "-exclude",
+        "--exclude",
+        type=str,
+        nargs="+",
+        help="Drop calls to these functions",
+        required=False,
+    )
+    parser.add_argument(
+        "-exclude_regex",
+        "--exclude_regex",
+        type=str,
+        help="Drop calls to functions whose name starts with a match of this "
+        "regular expression",
+        required=False,
+    )
+    parser.add_argument(
+        "-filter_depth",
+        "--filter_depth",
+        type=int,
+        help="Drop calls deeper than this callstack depth of the raw trace",
+        required=False,
+    )
+    parser.add_argument(
+        "-threads",
+        "--threads",
+        type=str,
+        help="Only process thread files whose name matches this glob pattern",
+        required=False,
     )
-    arguments = parser.parse_args()
-
-    log_directory = arguments.input_folder
-    log_directory_exists = os.path.isdir(log_directory)
-    if not log_directory_exists:
-        sys.exit("Invalid path for input folder...")
-
-    colorfile = arguments.color
 
-    title = arguments.title
-    if title == None:
-        print("No title provided, defaulting to using 'NonSequitur' as the title")
-        title = "NonSequitur"
-
-    traces = process_trace_files(log_directory)
-    execution_start_time, execution_end_time = get_execution_time_range(traces)
-    assert (
-        execution_end_time >= execution_start_time
-    ), "Expected execution end time \
-  to be greater than the execution end time"
-
-    if colorfile == None:
-        func_to_color = assign_colors_to_functions(traces)
-    else:
-        colorfile_exists = os.path.isfile(colorfile)
-        if colorfile_exists:
-            func_to_color = assign_colors_from_file(traces, colorfile)
 
-        else:
-            sys.exit("Invalid path for the color mapping file")
+def get_event_filter(arguments):
+    if arguments.filter_depth != None and arguments.filter_depth < 0:
+        sys.exit("The callstack depth filter cannot be negative")
 
-    func_to_color = dict(sorted(func_to_color.items()))
+    try:
+        return TraceEventFilter(
+            arguments.include,
+            arguments.include_regex,
+            arguments.exclude,
+            arguments.exclude_regex,
+            arguments.filter_depth,
+            arguments.threads,
+        )
+    except re.error as error:
+        sys.exit("Invalid function filter regular expression: " + str(error))
 
-    plot_x_range_start = execution_start_time
-    pixels_per_timeunit = TIMELINE_PX_WIDTH / (
-        execution_end_time - execution_start_time
-    )
 
-    for i in range(len(traces)):
-        trace_id = i + 1
-        trace_ids.append(trace_id)
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "manifest":
+        parser = argparse.ArgumentParser(prog="nonsequitur.py manifest")
+        parser.add_argument(
+            "-i", "--input_folder", type=str, help="Input folder path", required=True
+        )
+        parser.add_argument(
+            "-o",
+            "--output_file",
+            type=str,
+            help="Path the JSON manifest is written to. Defaults to "
+            + MANIFEST_FILENAME
+            + " in the input folder",
+            required=False,
+        )
+        add_event_filter_arguments(parser)
+        arguments = parser.parse_args(sys.argv[2:])
+        event_filter = get_event_filter(arguments)
+
+        log_directory = arguments.input_folder
+        log_directory_exists = os.path.isdir(log_directory)
+        if not log_directory_exists:
+            sys.exit("Invalid path for input folder...")
+
+        manifest_path = arguments.output_file
+        if manifest_path == None:
+            manifest_path = join(log_directory, MANIFEST_FILENAME)
+
+        manifest = get_trace_manifest(log_directory, event_filter)
+        write_trace_manifest(manifest, manifest_path)
+        print(format_manifest_summary(manifest))
+
+        sys.exit()
+
+    if len(sys.argv) > 1 and sys.argv[1] == "export":
+        from traceExport import export_trace_directory, EXPORT_FORMATS
+
+        parser = argparse.ArgumentParser(prog="nonsequitur.py export")
+        parser.add_argument(
+            "-i",
+            "--input_folder",
+            type=str,
+            help="Input folder path, either raw traces or the output of compress",
+            required=True,
+        )
+        parser.add_argument(
+            "-o",
+            "--output_file",
+            type=str,
+            help="Path the exported trace is written to",
+            required=True,
+        )
+        parser.add_argument(
+            "-format",
+            "--format",
+            type=str,
+            choices=EXPORT_FORMATS,
+            default=EXPORT_FORMATS[0],
+            help="Chrome Trace Event JSON or Perfetto protobuf trace",
+        )
+        parser.add_argument(
+            "-raw",
+            "--raw",
+            action="store_true",
+            help="Export the filtered raw events instead of the RegTime output",
+        )
+        parser.add_argument(
+            "-fold",
+            "--fold",
+            action="store_true",
+            help="Fold consecutive RegTime expressions with the same call tree",
+        )
+        parser.add_argument(
+            "-workers",
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of worker processes used to filter and compress large traces",
+        )
+        add_event_filter_arguments(parser)
+        arguments = parser.parse_args(sys.argv[2:])
+        event_filter = get_event_filter(arguments)
+
+        log_directory = arguments.input_folder
+        log_directory_exists = os.path.isdir(log_directory)
+        if not log_directory_exists:
+            sys.exit("Invalid path for input folder...")
+
+        if arguments.raw and is_compressed_trace_directory(log_directory):
+            sys.exit("Compressed traces do not keep the raw events to export")
+
+        if arguments.workers > 1:
+            with ProcessPoolExecutor(max_workers=arguments.workers) as executor:
+                export_trace_directory(
+                    log_directory,
+                    arguments.output_file,
+                    arguments.format,
+                    arguments.raw,
+                    executor,
+                    arguments.fold,
+                    event_filter,
+                )
+        else:
+            export_trace_directory(
+                log_directory,
+                arguments.output_file,
+                arguments.format,
+                arguments.raw,
+                fold=arguments.fold,
+                event_filter=event_filter,
+            )
 
-        trace = traces[i]
-        max_callstack_depth = trace.callstack_depth.max()
+        sys.exit()
 
-        plot_title = "Thread " + str(trace_id)
-        timelineplot = figure(
-            title=plot_title, tools=[], toolbar_location=None, width=TIMELINE_PX_WIDTH
+    if len(sys.argv) > 1 and sys.argv[1] == "compress":
+        parser = argparse.ArgumentParser(prog="nonsequitur.py compress")
+        parser.add_argument(
+            "-i", "--input_folder", type=str, help="Input folder path", required=True
         )
+        parser.add_argument(
+            "-o",
+            "--output_folder",
+            type=str,
+            help="Folder the compressed traces are written to",
+            required=True,
+        )
+        parser.add_argument(
+            "-fold",
+            "--fold",
+            action="store_true",
+            help="Fold consecutive RegTime expressions with the same call tree",
+        )
+        parser.add_argument(
+            "-workers",
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of worker processes used to filter and compress large traces",
+        )
+        add_event_filter_arguments(parser)
+        arguments = parser.parse_args(sys.argv[2:])
+        event_filter = get_event_filter(arguments)
+
+        log_directory = arguments.input_folder
+        log_directory_exists = os.path.isdir(log_directory)
+        if not log_directory_exists:
+            sys.exit("Invalid path for input folder...")
+
+        if arguments.workers > 1:
+            with ProcessPoolExecutor(max_workers=arguments.workers) as executor:
+                write_compressed_traces(
+                    log_directory,
+                    arguments.output_folder,
+                    executor,
+                    arguments.fold,
+                    event_filter,
+                )
+        else:
+            write_compressed_traces(
+                log_directory,
+                arguments.output_folder,
+                fold=arguments.fold,
+                event_filter=event_filter,
+            )
 
-        timelineplot.xgrid.visible = False
-        timelineplot.xaxis.visible = False
-        timelineplot.ygrid.visible = False
-        timelineplot.yaxis.visible = False
-
-        timelineplot.y_range = Range1d(max_callstack_depth + 3, 0)
+        sys.exit()
+
+    if len(sys.argv) > 1 and sys.argv[1] == "history":
+        from traceHistory import (
+            open_history,
+            get_latest_run_id,
+            query_runs,
+            query_trend,
+            query_regressions,
+            format_history_table,
+            DEFAULT_HISTORY_ROWS,
+        )
 
-        plot_height = max(
-            (max_callstack_depth + 2) * MIN_CALLSTACK_PX_HEIGHT, MIN_TIMELINE_PX_HEIGHT
+        parser = argparse.ArgumentParser(prog="nonsequitur.py history")
+        parser.add_argument(
+            "-db",
+            "--database",
+            type=str,
+            help="History database written by reports run with -history",
+            required=True,
+        )
+        query_group = parser.add_mutually_exclusive_group()
+        query_group.add_argument(
+            "-trend",
+            "--trend",
+            type=str,
+            help="Function whose statistics are listed for every recorded run",
+        )
+        query_group.add_argument(
+            "-regressions",
+            "--regressions",
+            action="store_true",
+            help="Rank functions by how much time they added in a run compared "
+            "to a baseline run",
         )
-        timelineplot.height = plot_height
+        parser.add_argument(
+            "-name",
+            "--name",
+            type=str,
+            help="Only consider runs of input folders with this name",
+        )
+        parser.add_argument(
+            "-run",
+            "--run",
+            type=int,
+            help="Run compared by -regressions. Defaults to the latest run",
+        )
+        parser.add_argument(
+            "-baseline_run",
+            "--baseline_run",
+            type=int,
+            help="Run compared against by -regressions. Defaults to the run "
+            "recorded before -run",
+        )
+        parser.add_argument(
+            "-last",
+            "--last",
+            type=int,
+            default=DEFAULT_HISTORY_ROWS,
+            help="Number of runs or functions listed",
+        )
+        arguments = parser.parse_args(sys.argv[2:])
 
-        select_interval_tool = BoxSelectTool(dimensions="width")
-        timelineplot.add_tools(select_interval_tool)
-        timelineplot.toolbar.active_drag = select_interval_tool
+        if not os.path.isfile(arguments.database):
+            sys.exit("Invalid path for the history database")
 
-        timelineplots.append(timelineplot)
+        connection = open_history(arguments.database)
+        if arguments.trend != None:
+            columns, rows = query_trend(
+                connection, arguments.trend, arguments.name, arguments.last
+            )
 
-        trace_event_CDS, bracket_CDS, xcoord_to_time = fill_CDS_and_time_maps(
-            trace, pixels_per_timeunit, func_to_color
-        )
+        elif arguments.regressions:
+            run_id = arguments.run
+            if run_id == None:
+                run_id = get_latest_run_id(connection, arguments.name)
 
-        traces_src.append(trace_event_CDS)
-        last_trace_event_x_position = trace_event_CDS.data["right"][-1]
-        trace_end_time = trace["end_time"][len(trace) - 1]
+            baseline_run_id = arguments.baseline_run
+            if baseline_run_id == None and run_id != None:
+                baseline_run_id = get_latest_run_id(connection, arguments.name, run_id)
 
-        if last_trace_event_x_position > execution_end_time:
-            scale_factor = float(trace_end_time - execution_start_time) / float(
-                execution_end_time - execution_start_time
-            )
-            scale_factor = max(scale_factor, 0.2)
+            if run_id == None or baseline_run_id == None:
+                sys.exit("Two recorded runs are needed to rank regressions")
 
-            plot_x_range_end = execution_start_time + (
-                (last_trace_event_x_position - execution_start_time) / scale_factor
+            print("Run {} against baseline run {}".format(run_id, baseline_run_id))
+            columns, rows = query_regressions(
+                connection, run_id, baseline_run_id, arguments.last
             )
 
         else:
-            plot_x_range_end = execution_end_time
+            columns, rows = query_runs(connection, arguments.name, arguments.last)
+
+        print(format_history_table(columns, rows))
+        connection.close()
 
-        timelineplot.x_range = Range1d(plot_x_range_start, plot_x_range_end)
+        sys.exit()
 
-        if xcoord_to_time[0]["time"] != execution_start_time:
-            xcoord_to_time.appendleft(
-                {"x": plot_x_range_start, "time": execution_start_time}
+    if len(sys.argv) > 1 and sys.argv[1] == "shard":
+        parser = argparse.ArgumentParser(prog="nonsequitur.py shard")
+        parser.add_argument(
+            "-i", "--input_folder", type=str, help="Input folder path", required=True
+        )
+        parser.add_argument(
+            "-o",
+            "--output_file",
+            type=str,
+            help="Path the shard is written to, ending in " + SHARD_EXTENSION,
+            required=True,
+        )
+        parser.add_argument(
+            "-num_shards",
+            "--num_shards",
+            type=int,
+            help="Number of shards the input folder is split into",
+            required=True,
+        )
+        parser.add_argument(
+            "-shard",
+            "--shard",
+            type=int,
+            help="Index of the shard to write, from 0 to num_shards - 1",
+            required=True,
+        )
+        parser.add_argument(
+            "-parts",
+            "--parts",
+            type=int,
+            default=1,
+            help="Number of parts every thread is split into by its top-level calls",
+        )
+        parser.add_argument(
+            "-fold",
+            "--fold",
+            action="store_true",
+            help="Fold consecutive RegTime expressions with the same call tree",
+        )
+        parser.add_argument(
+            "-workers",
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of worker processes used to filter and compress large traces",
+        )
+        add_event_filter_arguments(parser)
+        arguments = parser.parse_args(sys.argv[2:])
+        event_filter = get_event_filter(arguments)
+
+        log_directory = arguments.input_folder
+        log_directory_exists = os.path.isdir(log_directory)
+        if not log_directory_exists:
+            sys.exit("Invalid path for input folder...")
+
+        if arguments.num_shards < 1 or not 0 <= arguments.shard < arguments.num_shards:
+            sys.exit("The shard index must be between 0 and num_shards - 1")
+
+        if arguments.parts < 1:
+            sys.exit("Every thread must be split into at least one part")
+
+        if not arguments.output_file.endswith(SHARD_EXTENSION):
+            sys.exit("The shard file name must end in " + SHARD_EXTENSION)
+
+        if arguments.workers > 1:
+            with ProcessPoolExecutor(max_workers=arguments.workers) as executor:
+                write_shard(
+                    log_directory,
+                    arguments.output_file,
+                    arguments.shard,
+                    arguments.num_shards,
+                    arguments.parts,
+                    executor,
+                    arguments.fold,
+                    event_filter,
+                )
+        else:
+            write_shard(
+                log_directory,
+                arguments.output_file,
+                arguments.shard,
+                arguments.num_shards,
+                arguments.parts,
+                fold=arguments.fold,
+                event_filter=event_filter,
             )
 
-        if xcoord_to_time[-1]["time"] != execution_end_time:
-            xcoord_to_time.append({"x": plot_x_range_end, "time": execution_end_time})
+        sys.exit()
 
-        xcoord_to_time_maps.append(xcoord_to_time)
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-i",
+        "--input_folder",
+        type=str,
+        nargs="+",
+        help="Input folder paths, either raw traces, the output of compress or "
+        "a folder of shards. "
+        "One report is generated per folder",
+        required=True,
+    )
+    parser.add_argument(
+        "-baseline",
+        "--baseline",
+        type=str,
+        help="Baseline folder path. The report compares the input folder "
+        "against it, ranking functions and call paths by how much slower they got",
+        required=False,
+    )
+    parser.add_argument(
+        "-color",
+        "--color",
+        type=str,
+        help="Path to file which contains mapping between functions and colors",
+        required=False,
+    )
+    parser.add_argument(
+        "-registry",
+        "--color_registry",
+        type=str,
+        help="Path to a function to color mapping file that is extended with "
+        "the functions of every run, keeping colors stable across reports",
+        required=False,
+    )
+    parser.add_argument(
+        "-title", "--title", type=str, help="Title of the output file", required=False
+    )
+    parser.add_argument(
+        "-group",
+        "--group_identical_threads",
+        type=float,
+        nargs="?",
+        const=DEDUP_TIME_TOLERANCE,
+        help="Render threads with identical compressed timelines as one group. "
+        "The optional value is the largest difference of any timestamp or "
+        "duration from the group's first thread, as a fraction of the "
+        "execution time (default %(const)s)",
+        required=False,
+    )
+    parser.add_argument(
+        "-fold",
+        "--fold",
+        action="store_true",
+        help="Fold consecutive RegTime expressions with the same call tree",
+    )
+    parser.add_argument(
+        "-workers",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes used to filter and compress large traces",
+    )
+    parser.add_argument(
+        "-max_depth",
+        "--max_depth",
+        type=int,
+        help="Deepest callstack depth that is drawn. Calls at this depth are "
+        "drawn with their inclusive duration and their callees can be expanded "
+        "by clicking on them",
+        required=False,
+    )
+    parser.add_argument(
+        "-concurrency",
+        "--concurrency",
+        type=str,
+        nargs="+",
+        help="Functions whose number of threads inside them over time is "
+        "plotted. Defaults to the functions with the most time spent in them "
+        "that run on more than one thread",
+        required=False,
+    )
+    parser.add_argument(
+        "-sidecars",
+        "--sidecars",
+        action="store_true",
+        help="Write the timeline data of every thread to a sidecar file next to "
+        "the report, loaded when the thread is scrolled into view or selected",
+    )
+    parser.add_argument(
+        "-preview",
+        "--preview",
+        type=float,
+        help="Fraction of the top-level calls of every thread that is sampled "
+        "for a quick approximate report of raw traces, e.g. 0.05",
+        required=False,
+    )
+    parser.add_argument(
+        "-cluster",
+        "--cluster",
+        type=float,
+        nargs="?",
+        const=CLUSTER_DISTANCE_THRESHOLD,
+        help="Render one timeline per cluster of threads with similar "
+        "function-time histograms and call paths. The optional value is the "
+        "largest distance, from 0 to 1, between a thread and its cluster's "
+        "representative (default %(const)s)",
+        required=False,
+    )
+    parser.add_argument(
+        "-offline",
+        "--offline",
+        action="store_true",
+        help="Inline the minified BokehJS so the report opens without network "
+        "access, write gzip (and, with the brotli package, brotli) variants of "
+        "the report and its sidecars, and write a payload size breakdown",
+    )
+    parser.add_argument(
+        "-history",
+        "--history",
+        type=str,
+        help="SQLite database the per-run, per-thread and per-function "
+        "statistics of every report are added to",
+        required=False,
+    )
+    add_event_filter_arguments(parser)
+    arguments = parser.parse_args()
+    event_filter = get_event_filter(arguments)
 
-        trace_event_renderer = timelineplot.quad(
-            top="top",
-            bottom="bottom",
-            left="left",
-            right="right",
-            line_alpha="line_alpha",
-            fill_color="color",
-            fill_alpha="alpha",
-            line_color="black",
-            line_width=1,
-            source=trace_event_CDS,
-        )
-        trace_event_renderer.selection_glyph = None
-        trace_event_renderer.nonselection_glyph = None
+    log_directories = arguments.input_folder
+    for log_directory in log_directories:
+        log_directory_exists = os.path.isdir(log_directory)
+        if not log_directory_exists:
+            sys.exit("Invalid path for input folder...")
 
-        trace_event_renderers.append(trace_event_renderer)
+    baseline_directory = arguments.baseline
+    if baseline_directory != None:
+        baseline_directory_exists = os.path.isdir(baseline_directory)
+        if not baseline_directory_exists:
+            sys.exit("Invalid path for baseline folder...")
 
-        timelineplot.multi_line(
-            xs="xs",
-            ys="ys",
-            line_width=1,
-            line_alpha=1,
-            line_color="black",
-            source=bracket_CDS,
-        )
+        if len(log_directories) > 1:
+            sys.exit("A baseline can only be compared against one input folder")
 
-        box_annotation = BoxAnnotation(
-            left=execution_start_time, fill_alpha=0, fill_color="#009933"
-        )
-        box_annotations.append(box_annotation)
+    colorfile = arguments.color
+    color_registry = arguments.color_registry
+    if colorfile != None and color_registry != None:
+        sys.exit("Only one of the color mapping file and color registry can be used")
 
-    for i in range(len(traces)):
-        timelineplot = timelineplots[i]
-        trace_event_renderer = trace_event_renderers[i]
+    if arguments.cluster != None:
+        if arguments.cluster < 0 or arguments.cluster > 1:
+            sys.exit("The cluster distance threshold must be in [0, 1]")
 
-        xcoord_to_time = xcoord_to_time_maps[i]
-        if xcoord_to_time[0]["time"] != execution_start_time:
-            xcoord_to_time.appendleft(
-                {"x": plot_x_range_start, "time": execution_start_time}
-            )
+        if arguments.group_identical_threads != None:
+            sys.exit("Only one of -group and -cluster can be used")
 
-        if xcoord_to_time[-1]["time"] != execution_end_time:
-            xcoord_to_time.append({"x": plot_x_range_end, "time": execution_end_time})
-
-        xcoord_to_time_maps[i] = list(xcoord_to_time)
-
-        hover_callback = CustomJS(
-            args=dict(
-                plot_idx=i,
-                trace_events=trace_event_renderer.data_source,
-                box_annotations=box_annotations,
-                xcoord_to_time_maps=xcoord_to_time_maps,
-                min_annotation_width=MIN_CALLSTACK_PX_WIDTH / pixels_per_timeunit,
-            ),
-            code="""
-        function to_x_coords(t0, t1, xcoord_to_time){
-          let x0 = null;
-          let x1 = null;
-        
-          for (let i = 0; i < xcoord_to_time.length; i++){
-            if (x0 == null && t0 <= xcoord_to_time[i]['time']){
-              if (i == 0){
-                x0 = xcoord_to_time[i]['x'];
-              } else {
-                x0 = ((t0 - xcoord_to_time[i - 1]['time']) /
-                (xcoord_to_time[i]['time'] -
-                xcoord_to_time[i - 1]['time']) *
-                (xcoord_to_time[i]['x'] -
-                xcoord_to_time[i - 1]['x'])) +
-                xcoord_to_time[i - 1]['x'];
-              }
-            }
-          
-            if (x1 == null && t1 <= xcoord_to_time[i]['time']){
-              x1 = ((t1 - xcoord_to_time[i - 1]['time']) /
-              (xcoord_to_time[i]['time'] -
-              xcoord_to_time[i - 1]['time']) *
-              (xcoord_to_time[i]['x'] -
-              xcoord_to_time[i - 1]['x'])) +
-              xcoord_to_time[i - 1]['x'];
-            }
-          
-            if (x0 != null && x1 != null){
-              return [x0, x1];
-            }
-          }
-        }
-      
-        function to_time_coords(x0, x1, xcoord_to_time){
-          let t0 = null;
-          let t1 = null;
-          for (let i = 0; i < xcoord_to_time.length; i++){
-            if (t0 == null && x0 <= xcoord_to_time[i]['x']){
-              if (i == 0){
-                t0 = xcoord_to_time[i]['time'];
-              } else {
-                t0 = ((x0 - xcoord_to_time[i - 1]['x']) /
-                (xcoord_to_time[i]['x'] -
-                xcoord_to_time[i - 1]['x']) *
-                (xcoord_to_time[i]['time'] -
-                xcoord_to_time[i - 1]['time'])) +
-                xcoord_to_time[i - 1]['time']
-              }
-            }
-          
-            if (t1 == null && x1 <= xcoord_to_time[i]['x']){
-              t1 = ((x1 - xcoord_to_time[i - 1]['x']) /
-              (xcoord_to_time[i]['x'] -
-              xcoord_to_time[i - 1]['x']) *
-              (xcoord_to_time[i]['time'] -
-              xcoord_to_time[i - 1]['time'])) +
-              xcoord_to_time[i - 1]['time'];
-            }
-          
-            if (t0 != null && t1 != null){
-              return [t0, t1];
-            }
-          }
-        }
-
-        const indices = cb_data.index.indices;
-        for (let i = 0; i < indices.length; i++){
-          let interval_start_time = trace_events.data['start_time'][indices[0]];
-          let interval_end_time = trace_events.data['end_time'][indices[0]];
-          let x_coords = null;
-        
-          for (let j = 0; j < box_annotations.length; j++){
-            x_coords = to_x_coords(interval_start_time,
-            interval_end_time,
-            xcoord_to_time_maps[j]);
-            
-            let min_x_value = xcoord_to_time_maps[j][0]['x'];
-            let max_x_value =
-            xcoord_to_time_maps[j][xcoord_to_time_maps[j].length - 1]['x'];
-            let x_coord_0 = x_coords[0];
-            let x_coord_1 = x_coords[1];
-            
-            if (box_annotations[j]['fill_color'] == "#009933"){
-              if (x_coord_1 - x_coord_0 < min_annotation_width){
-                if (x_coord_0 + min_annotation_width > max_x_value){
-                  x_coord_0-=min_annotation_width;
-                  
-                } else {
-                  x_coord_1 = x_coord_0 + min_annotation_width;
-                }
-              }
-            
-              box_annotations[j]['left'] = x_coord_0;
-              box_annotations[j]['right'] = x_coord_1;
-              box_annotations[j]['fill_alpha'] = 0.1;
-              box_annotations[j]['line_alpha'] = 0;
-            }
-          }
-        }
-      """,
-        )
-
-        hover_tooltip = HoverTool(
-            tooltips=[("Function", "@function"), ("Duration", "@duration")],
-            renderers=[trace_event_renderer],
-            callback=hover_callback,
-        )
-        timelineplot.add_tools(hover_tooltip)
-
-        timelineplot.add_layout(box_annotations[i])
-
-        tap_callback = CustomJS(
-            args=dict(box_annotations=box_annotations),
-            code="""
-              for (let i = 0; i < box_annotations.length; i++){
-                if (box_annotations[i]['fill_color'] == "#009933") {
-                  box_annotations[i]['fill_color'] = "#E0AC28";  
-                  box_annotations[i]['fill_alpha'] = 0.3;            
-                }
-              }
-        """,
-        )
-
-        timelineplot.js_on_event(events.Tap, tap_callback)
-
-        doubletap_callback = CustomJS(
-            args=dict(box_annotations=box_annotations),
-            code="""
-              for (let i = 0; i < box_annotations.length; i++){
-                box_annotations[i]['fill_color'] = "#009933";
-                box_annotations[i]['fill_alpha'] = 0;
-              }
-        """,
-        )
-
-        timelineplot.js_on_event(events.DoubleTap, doubletap_callback)
-
-    timelineplots_layout = column(timelineplots, sizing_mode="scale_width")
-
-    func_names = list(func_to_color.keys())
-    color_values = list()
-    opacity_values = list()
-    for color_and_opacity in list(func_to_color.values()):
-        color = color_and_opacity[0]
-        opacity = color_and_opacity[1]
-        color_values.append(color)
-        opacity_values.append(opacity)
-
-    trace_select_values = list()
-    thread_select_options = list()
-    for i in range(len(traces)):
-        trace_id = i + 1
-        trace_select_values.append(str(i))
-        thread_select_options.append((str(i), str(trace_id)))
-
-    thread_select = MultiSelect(
-        value=trace_select_values,
-        title="Thread ID",
-        height=150,
-        options=thread_select_options,
-    )
+    if arguments.group_identical_threads != None and (
+        arguments.group_identical_threads < 0 or arguments.group_identical_threads > 1
+    ):
+        sys.exit("The group time tolerance must be in [0, 1]")
+
+    if arguments.max_depth != None and arguments.max_depth < 0:
+        sys.exit("The maximum callstack depth cannot be negative")
 
-    legend_data = {"func": func_names, "color": color_values, "opacity": opacity_values}
-    legend_src = ColumnDataSource(legend_data)
-    template = """                
-            <div style="background:<%= color %>; opacity:<%= opacity %>;">
-                &ensp;
-            </div>
-    """
-    formatter = HTMLTemplateFormatter(template=template)
-    columns = [
-        TableColumn(field="func", title="Function"),
-        TableColumn(field="color", title="Color", formatter=formatter),
+    preview = arguments.preview
+    if preview != None:
+        if preview <= 0 or preview > 1:
+            sys.exit("The preview sample rate must be in (0, 1]")
+
+        if baseline_directory != None:
+            sys.exit("A preview cannot be compared against a baseline")
+
+    title = arguments.title
+    titles = list()
+    if len(log_directories) == 1:
+        if title == None:
+            print("No title provided, defaulting to using 'NonSequitur' as the title")
+            title = "NonSequitur"
+
+        titles.append(title)
+
+    else:
+        for log_directory in log_directories:
+            run_name = os.path.basename(os.path.normpath(log_directory))
+            if title == None:
+                titles.append(run_name)
+            else:
+                titles.append(title + "_" + run_name)
+
+    run_directories = list(log_directories)
+    if baseline_directory != None:
+        run_directories.append(baseline_directory)
+
+    raw_log_directories = [
+        log_directory
+        for log_directory in run_directories
+        if not is_compressed_trace_directory(log_directory)
+        and not is_shard_directory(log_directory)
     ]
-    legend = DataTable(
-        source=legend_src, columns=columns, height=150, sizing_mode="stretch_width"
-    )
 
-    highlight_funcs = CustomJS(
-        args=dict(
-            legend_src=legend_src,
-            func_to_color=func_to_color,
-            thread_select=thread_select,
-            traces_src=traces_src,
-        ),
-        code="""
-           const funcs_to_highlight = [];
-           const threads_being_displayed = thread_select.value;
-           
-           for (const i of cb_obj.indices) {
-             const func_to_highlight = legend_src.data['func'][i].toString();
-             funcs_to_highlight.push(func_to_highlight);
-           }
-          
-           if (funcs_to_highlight.length > 0){
-             for (let i = 0; i < threads_being_displayed.length; i++){
-               let thread = threads_being_displayed[i];
-               const funcs_in_thread = traces_src[thread].data['function'];
-               for (let j = 0; j < funcs_in_thread.length; j++){
-                 let func = funcs_in_thread[j];
-                 if (funcs_to_highlight.indexOf(func) != -1){
-                   let alpha = func_to_color[func][1];
-                   traces_src[thread].data['alpha'][j] = alpha;
-                   traces_src[thread].data['line_alpha'][j] = 1;   
-              
-                 } else {
-                   traces_src[thread].data['alpha'][j] = 0.2;
-                   traces_src[thread].data['line_alpha'][j] = 0;
-                 }
-               }
-             
-               traces_src[thread].change.emit();
-             }
-           } else {
-               for (let i = 0; i < traces_src.length; i++){
-                 const funcs_in_thread = traces_src[i].data['function'];
-                 for (let j = 0; j < funcs_in_thread.length; j++){
-                   let func = funcs_in_thread[j];
-                   let alpha = func_to_color[func][1];
-                   traces_src[i].data['alpha'][j] = alpha;
-                   traces_src[i].data['line_alpha'][j] = 0;
-                 }
-                 traces_src[i].change.emit();
-               }
-           }
-    """,
+    # The manifest pass only reads the head and tail of every file, so the
+    # capture size is reported and the time range of each run is known
+    # before the traces are filtered and compressed.
+    manifests = dict()
+    for log_directory in raw_log_directories:
+        manifests[log_directory] = get_trace_manifest(log_directory, event_filter)
+        print(format_manifest_summary(manifests[log_directory]))
+
+    # The workers are kept for the rendering, which lays out the threads of
+    # every report in parallel as well.
+    executor = None
+    if arguments.workers > 1:
+        executor = ProcessPoolExecutor(max_workers=arguments.workers)
+
+    raw_traces, raw_trace_stats = process_trace_directories(
+        raw_log_directories, executor, arguments.fold, event_filter, preview
     )
-    legend_src.selected.js_on_change("indices", highlight_funcs)
 
-    func_names = list(func_to_color.keys())
-    function_search = AutocompleteInput(
-        title="Enter a function name:",
-        completions=func_names,
-        sizing_mode="stretch_width",
-    )
+    traces_in_runs = list()
+    trace_stats_in_runs = list()
+    for log_directory in run_directories:
+        if is_shard_directory(log_directory):
+            traces, trace_stats, manifests[log_directory] = load_shard_directory(
+                log_directory, event_filter
+            )
+        elif is_compressed_trace_directory(log_directory):
+            traces, trace_stats = load_compressed_trace_directory(
+                log_directory, event_filter
+            )
+        else:
+            traces = raw_traces.pop(0)
+            trace_stats = raw_trace_stats.pop(0)
+
+        traces_in_runs.append(traces)
+        trace_stats_in_runs.append(trace_stats)
+
+        if len(traces) == 0:
+            sys.exit("No trace events left in " + log_directory + " after filtering")
+
+    # The statistics come from the filter and RegTime passes that just ran,
+    # so recording them never reopens the traces.
+    if arguments.history != None:
+        from traceHistory import record_runs
+
+        run_ids = record_runs(
+            arguments.history,
+            [
+                (
+                    os.path.basename(os.path.normpath(log_directory)),
+                    title,
+                    log_directory,
+                    traces,
+                    trace_stats,
+                    manifests.get(log_directory),
+                )
+                for log_directory, title, traces, trace_stats in zip(
+                    log_directories, titles, traces_in_runs, trace_stats_in_runs
+                )
+            ],
+        )
+        print(
+            "Recorded run "
+            + ", ".join(str(run_id) for run_id in run_ids)
+            + " in "
+            + arguments.history
+        )
 
-    thread_select.js_on_change(
-        "value",
-        CustomJS(
-            args=dict(
-                plots=timelineplots,
-                layout=timelineplots_layout,
-                function_search=function_search,
-                traces_src=traces_src,
-                func_to_color=func_to_color,
-                legend_src=legend_src,
-            ),
-            code="""
-           const children = [];
-           const function_names = [];
-           const color_values = [];
-           const opacity_values = [];
-           const highlighted_funcs = [];
-           const indices_of_highlighted_funcs = [];
-           
-           for (const i of legend_src.selected.indices) {
-             const highlighted_func = legend_src.data['func'][i];
-             highlighted_funcs.push(highlighted_func);
-           }
-           
-           legend_src.selected.indices = [];
-           
-           for (const i of this.value) {
-             children.push(plots[i]);
-           }
-           
-           layout.children = children;
-         
-           for (let i = 0; i < this.value.length; i++){
-             const selected_thread = this.value[i];
-             const functions_in_thread = traces_src[selected_thread].data['function'];
-             
-             for (let j = 0; j < functions_in_thread.length; j++){
-               let func = functions_in_thread[j];
-               if (function_names.includes(func) == false){
-                 function_names.push(func);
-               }
-             }
-           }
-           
-           function_names.sort();
-           for (let i = 0; i < function_names.length; i++){
-             let func = function_names[i];
-             let color = func_to_color[func][0];
-             let opacity = func_to_color[func][1];
-             color_values.push(color);
-             opacity_values.push(opacity);
-           }
-           
-           for (const highlighted_func of highlighted_funcs){
-             const index = function_names.indexOf(highlighted_func);
-             if (index != -1){
-               indices_of_highlighted_funcs.push(index);
-             }
-           }
-           
-           debugger;
-           
-           legend_src.data['func'] = function_names;
-           legend_src.data['color'] = color_values;
-           legend_src.data['opacity'] = opacity_values;
-           legend_src.change.emit();
-           legend_src.selected.indices = indices_of_highlighted_funcs;
-           
-           function_search.value = '';
-
-    """,
-        ),
-    )
+    header = None
+    if baseline_directory != None:
+        traces_in_runs.pop()
+        baseline_trace_stats = trace_stats_in_runs.pop()
 
-    function_search.js_on_change(
-        "value",
-        CustomJS(
-            args=dict(
-                func_to_color=func_to_color,
-                thread_select=thread_select,
-                traces_src=traces_src,
-                legend_src=legend_src,
-            ),
-            code="""
-      let selected_func = this.value;
-
-      const threads_to_display = [];
-      
-      if (selected_func != ''){
-        for (let i = 0; i < traces_src.length; i++){
-          const trace = traces_src[i];
-          for (let j = 0; j < trace.data['function'].length; j++){
-
-            const thread_id = i.toString();
-            if (trace.data['function'][j] == selected_func && \
-            threads_to_display.includes(thread_id) == false){
-              threads_to_display.push(thread_id);
-            }              
-            
-          }
-          
-        }
-        thread_select.value = threads_to_display;
-        this.value = selected_func;
-      }
- 
-    """,
-        ),
-    )
+        function_deltas = get_function_deltas(
+            baseline_trace_stats, trace_stats_in_runs[0]
+        )
+        call_path_deltas = get_call_path_deltas(
+            baseline_trace_stats, trace_stats_in_runs[0]
+        )
 
-    output_file(title + ".html")
+    all_traces = [trace for traces in traces_in_runs for trace in traces]
+
+    if baseline_directory != None:
+        func_to_color = assign_colors_from_deltas(function_deltas)
+    elif color_registry != None:
+        func_to_color = assign_colors_from_registry(all_traces, color_registry)
+    elif colorfile == None:
+        # Shards carry the function occurrences counted where they were
+        # written, so the colors are ranked without scanning the merged traces.
+        function_occurrences_in_traces = [
+            stats["function_occurrences"]
+            for trace_stats in trace_stats_in_runs
+            for stats in trace_stats
+            if "function_occurrences" in stats
+        ]
+        if len(function_occurrences_in_traces) != len(all_traces):
+            function_occurrences_in_traces = None
+
+        func_to_color = assign_colors_to_functions(
+            all_traces, function_occurrences_in_traces
+        )
+    else:
+        colorfile_exists = os.path.isfile(colorfile)
+        if colorfile_exists:
+            func_to_color = assign_colors_from_file(all_traces, colorfile)
 
-    widget_layout = row(
-        thread_select,
-        column(function_search, legend, sizing_mode="stretch_width"),
-        sizing_mode="scale_width",
-    )
-    save(
-        column(widget_layout, timelineplots_layout, sizing_mode="scale_width"),
-        title=title,
+        else:
+            sys.exit("Invalid path for the color mapping file")
+
+    from nonsequitur_render import (
+        render_timelines,
+        create_regression_tables,
+        create_preview_banner,
     )
+
+    if baseline_directory != None:
+        header = create_regression_tables(function_deltas, call_path_deltas)
+
+    for log_directory, traces, trace_stats, title in zip(
+        log_directories, traces_in_runs, trace_stats_in_runs, titles
+    ):
+        functions_in_run = get_functions_in_traces(traces)
+        func_to_color_in_run = dict(
+            sorted(
+                (func, color)
+                for func, color in func_to_color.items()
+                if func in functions_in_run
+            )
+        )
+
+        # Threads are clustered on their statistics before the depth cap, so
+        # the clusters do not depend on how much of the stacks is drawn.
+        trace_groups = None
+        if arguments.cluster != None:
+            trace_groups = cluster_similar_traces(
+                traces, trace_stats, arguments.cluster
+            )
+            print(
+                "Clustered {} threads into {} timelines".format(
+                    len(traces), len(trace_groups)
+                )
+            )
+
+        folded_subtrees = None
+        if arguments.max_depth != None:
+            traces, folded_subtrees = cap_trace_depths(traces, arguments.max_depth)
+
+        concurrency = None
+        call_intervals_in_threads = [
+            stats["call_intervals"]
+            for stats in trace_stats
+            if "call_intervals" in stats
+        ]
+        if len(call_intervals_in_threads) == len(traces):
+            concurrency_functions = arguments.concurrency
+            if concurrency_functions == None:
+                concurrency_functions = select_concurrency_functions(
+                    call_intervals_in_threads
+                )
+
+            concurrency = get_concurrency(
+                call_intervals_in_threads, concurrency_functions
+            )
+
+        # A preview of a raw run is written next to the full report instead
+        # of replacing it and is labeled as approximate above the timelines.
+        run_header = header
+        estimated_totals = None
+        previews = [stats["preview"] for stats in trace_stats if "preview" in stats]
+        if len(previews) > 0:
+            run_header = create_preview_banner(previews)
+            estimated_totals = [stats["estimated_totals"] for stats in trace_stats]
+            title = title + "_preview"
+
+        execution_time_range = None
+        manifest = manifests.get(log_directory)
+        if manifest != None and manifest["execution_start_time"] != None:
+            execution_time_range = (
+                manifest["execution_start_time"],
+                manifest["execution_end_time"],
+            )
+
+        render_timelines(
+            traces,
+            func_to_color_in_run,
+            title,
+            arguments.group_identical_threads,
+            run_header,
+            get_outlier_table(trace_stats),
+            folded_subtrees,
+            execution_time_range,
+            arguments.sidecars,
+            [stats.get("activity") for stats in trace_stats],
+            concurrency,
+            executor,
+            estimated_totals,
+            trace_groups,
+            arguments.offline,
+        )
+
+    if executor != None:
+        executor.shutdown()
@@ -1,16 +1,47 @@
-from bokeh.models import ColumnDataSource
-from bokeh.palettes import Category20
 from collections import deque
-from regtime_alg import *
+from config import (
+    ENTER_EVENTTYPE,
+    EXECUTE_EVENTTYPE,
+    EXIT_EVENTTYPE,
+    AGGREGATION_LEFTBOUND,
+    AGGREGATION_RIGHTBOUND,
+)
+import hashlib
+import json
 import math
-import numpy as np
 from operator import itemgetter
 import os
 from os.path import dirname, join
-import pandas as pd
-import subprocess
+import pickle
+from regtime_alg import (
+    regtime,
+    fold_repeated_exprs,
+    cap_callstack_depth,
+    CHUNK_SIZE_IN_EVENTS,
+)
 import sys
-from traceFilter import filter_trace_file
+import tempfile
+from traceFilter import (
+    filter_trace_file,
+    filter_thread_lines,
+    filter_interleaved_trace_file,
+    merge_filtered_batches,
+    apply_event_filter,
+    get_function_durations,
+    get_depth_index,
+    get_preview_strata,
+    read_top_level_calls,
+    add_slowest_invocation,
+    CHUNK_SIZE_IN_BYTES,
+)
+from traceProcessing import (
+    get_file_size,
+    is_interleaved_trace_file,
+    get_interleaved_thread_ids,
+    get_tracefile_summary,
+    TraceEventFilter,
+    CallPathTrie,
+)
 from tqdm import tqdm
 
 TIMELINE_PX_WIDTH = 1300
@@ -20,31 +51,1230 @@ MIN_TIMELINE_PX_HEIGHT = 70
 PIXELS_BTW_EVENTS = 2
 SPACE_BTW_CALLSTACK_DEPTHS = 0.15
 DEFAULT_FUNC_COLOR = "#bab0ac"
+DEDUP_TIME_TOLERANCE = 0.001
+CLUSTER_DISTANCE_THRESHOLD = 0.1
+MINHASH_PERMUTATIONS = 64
+MINHASH_PRIME = (1 << 31) - 1
+CALL_PATH_SEPARATOR = ";"
+LATENCY_PERCENTILES = [50, 90, 99]
+MAX_OUTLIER_TABLE_ROWS = 100
+COMPRESSED_TRACE_EXTENSION = ".regtime.pkl"
+SHARD_EXTENSION = ".shard.pkl"
+SHARD_FORMAT = "nonsequitur-shard"
+SHARD_FORMAT_VERSION = 1
+MANIFEST_FILENAME = "manifest.json"
+ACTIVITY_BINS = 1024
+HEATMAP_BINS = 256
+MAX_HEATMAP_THREAD_LABELS = 40
+CONCURRENCY_FUNCTIONS = 5
+
+
+def get_tracefilenames_in_directory(dir, event_filter=None):
+    tracefile_names = [
+        tracefile_name
+        for tracefile_name in os.listdir(dir)
+        if tracefile_name != MANIFEST_FILENAME
+    ]
+    if event_filter != None:
+        selected_tracefile_names = list()
+        for tracefile_name in tracefile_names:
+            thread_name = tracefile_name
+            if thread_name.endswith(COMPRESSED_TRACE_EXTENSION):
+                thread_name = thread_name[: -len(COMPRESSED_TRACE_EXTENSION)]
+
+            # The threads of an interleaved file are matched by their own
+            # names when the file is read.
+            if event_filter.keeps_tracefile(thread_name) or (
+                thread_name == tracefile_name
+                and is_interleaved_trace_file(join(dir, tracefile_name))
+            ):
+                selected_tracefile_names.append(tracefile_name)
+
+        tracefile_names = selected_tracefile_names
 
-
-def get_tracefilenames_in_directory(dir):
-    tracefile_names = os.listdir(dir)
     return sorted(tracefile_names)
 
 
-def process_trace_files(dir):
+def get_call_path_statistics(filtered_trace, call_paths):
+    call_path_counts = [0] * len(call_paths)
+    call_path_durations = [0] * len(call_paths)
+
+    for event in filtered_trace:
+        if event["event_type"] != EXIT_EVENTTYPE:
+            call_path_counts[event["call_path"]] += 1
+            call_path_durations[event["call_path"]] += event["duration"]
+
+    # Call paths are numbered in the order they first appear in the trace.
+    call_path_to_stats = dict()
+    for call_path in range(len(call_paths)):
+        if call_path_counts[call_path] > 0:
+            call_path_to_stats[
+                CALL_PATH_SEPARATOR.join(call_paths.get_functions(call_path))
+            ] = [
+                call_paths.functions[call_path],
+                call_path_counts[call_path],
+                call_path_durations[call_path],
+            ]
+
+    call_path_statistics = {
+        "call_path": list(),
+        "function": list(),
+        "count": list(),
+        "duration": list(),
+    }
+    for call_path, (function, count, duration) in call_path_to_stats.items():
+        call_path_statistics["call_path"].append(call_path)
+        call_path_statistics["function"].append(function)
+        call_path_statistics["count"].append(count)
+        call_path_statistics["duration"].append(duration)
+
+    return call_path_statistics
+
+
+def get_latency_percentiles(filtered_trace):
+    import numpy as np
+
+    func_to_durations = dict()
+
+    for event in filtered_trace:
+        if event["event_type"] != EXIT_EVENTTYPE:
+            func_to_durations.setdefault(event["function"], list()).append(
+                event["duration"]
+            )
+
+    latency_percentiles = {"function": list(), "count": list()}
+    for percentile in LATENCY_PERCENTILES:
+        latency_percentiles["p" + str(percentile)] = list()
+
+    for function, durations in func_to_durations.items():
+        latency_percentiles["function"].append(function)
+        latency_percentiles["count"].append(len(durations))
+
+        percentile_durations = np.percentile(durations, LATENCY_PERCENTILES)
+        for percentile, duration in zip(LATENCY_PERCENTILES, percentile_durations):
+            latency_percentiles["p" + str(percentile)].append(float(duration))
+
+    return latency_percentiles
+
+
+def get_slowest_invocation_table(slowest_invocations):
+    slowest_invocation_table = {
+        "function": list(),
+        "duration": list(),
+        "start_time": list(),
+        "end_time": list(),
+        "callstack_depth": list(),
+    }
+
+    for function, invocations in slowest_invocations.items():
+        for duration, start_time, end_time, callstack_depth in invocations:
+            slowest_invocation_table["function"].append(function)
+            slowest_invocation_table["duration"].append(duration)
+            slowest_invocation_table["start_time"].append(start_time)
+            slowest_invocation_table["end_time"].append(end_time)
+            slowest_invocation_table["callstack_depth"].append(callstack_depth)
+
+    return slowest_invocation_table
+
+
+def get_thread_activity(filtered_trace):
+    import numpy as np
+
+    call_start_times = list()
+    busy_start_times = list()
+    busy_end_times = list()
+
+    for event in filtered_trace:
+        if event["event_type"] == EXIT_EVENTTYPE:
+            continue
+
+        call_start_times.append(event["start_time"])
+        if event["callstack_depth"] == 0:
+            busy_start_times.append(event["start_time"])
+            busy_end_times.append(event["start_time"] + event["duration"])
+
+    start_time = busy_start_times[0]
+    end_time = max(busy_end_times[-1], start_time + 1)
+    bin_edges = np.linspace(start_time, end_time, ACTIVITY_BINS + 1)
+
+    # Calls at depth 0 do not overlap, so the busy time up to a bin edge is
+    # the length of the calls that ended before it plus the part of the call
+    # that is running at the edge.
+    busy_start_times = np.array(busy_start_times, dtype=np.float64)
+    busy_end_times = np.array(busy_end_times, dtype=np.float64)
+    busy_time_before = np.concatenate(
+        ([0], np.cumsum(busy_end_times - busy_start_times))
+    )
+
+    calls_before_edge = np.searchsorted(busy_start_times, bin_edges, "right")
+    last_call = np.maximum(calls_before_edge - 1, 0)
+    busy_time_at_edge = busy_time_before[last_call] + np.clip(
+        bin_edges - busy_start_times[last_call],
+        0,
+        busy_end_times[last_call] - busy_start_times[last_call],
+    )
+
+    call_counts, _ = np.histogram(np.array(call_start_times), bins=bin_edges)
+
+    return {
+        "start_time": start_time,
+        "end_time": end_time,
+        "busy_time": np.diff(busy_time_at_edge),
+        "calls": call_counts,
+    }
+
+
+def get_thread_call_intervals(filtered_trace):
+    import numpy as np
+
+    function_to_code = dict()
+    functions = list()
+    start_times = list()
+    end_times = list()
+    callstack_depths = list()
+
+    for event in filtered_trace:
+        if event["event_type"] == EXIT_EVENTTYPE:
+            continue
+
+        function_code = function_to_code.get(event["function"])
+        if function_code == None:
+            function_code = len(function_to_code)
+            function_to_code[event["function"]] = function_code
+
+        functions.append(function_code)
+        start_times.append(event["start_time"])
+        end_times.append(event["start_time"] + event["duration"])
+        callstack_depths.append(event["callstack_depth"])
+
+    return {
+        "function_names": list(function_to_code),
+        "function": np.array(functions, dtype=np.int32),
+        "start_time": np.array(start_times, dtype=np.int64),
+        "end_time": np.array(end_times, dtype=np.int64),
+        "callstack_depth": np.array(callstack_depths, dtype=np.int32),
+    }
+
+
+def select_concurrency_functions(call_intervals_in_threads):
+    import numpy as np
+
+    total_durations = dict()
+    num_of_threads = dict()
+    for call_intervals in call_intervals_in_threads:
+        durations = np.bincount(
+            call_intervals["function"],
+            call_intervals["end_time"] - call_intervals["start_time"],
+            len(call_intervals["function_names"]),
+        )
+        for function, duration in zip(call_intervals["function_names"], durations):
+            total_durations[function] = total_durations.get(function, 0) + duration
+            num_of_threads[function] = num_of_threads.get(function, 0) + 1
+
+    shared_functions = [
+        function for function in total_durations if num_of_threads[function] > 1
+    ]
+    shared_functions.sort(key=lambda function: total_durations[function], reverse=True)
+
+    return shared_functions[:CONCURRENCY_FUNCTIONS]
+
+
+def get_concurrency(call_intervals_in_threads, functions):
+    import numpy as np
+
+    boundary_functions = list()
+    boundary_times = list()
+    boundary_deltas = list()
+
+    for call_intervals in call_intervals_in_threads:
+        for function_code, function in enumerate(call_intervals["function_names"]):
+            if function not in functions:
+                continue
+
+            is_function = call_intervals["function"] == function_code
+            start_times = call_intervals["start_time"][is_function]
+            end_times = call_intervals["end_time"][is_function]
+
+            # A thread is counted once while it is inside the function, so
+            # recursive calls that end before an enclosing call are dropped.
+            order = np.argsort(start_times, kind="stable")
+            start_times = start_times[order]
+            end_times = end_times[order]
+            enclosing_end_times = np.maximum.accumulate(end_times)
+            is_outermost = np.ones(len(start_times), dtype=bool)
+            is_outermost[1:] = end_times[1:] > enclosing_end_times[:-1]
+
+            num_of_calls = np.count_nonzero(is_outermost)
+            boundary_functions.append(
+                np.full(2 * num_of_calls, functions.index(function))
+            )
+            boundary_times.append(start_times[is_outermost])
+            boundary_times.append(end_times[is_outermost])
+            boundary_deltas.append(np.ones(num_of_calls, dtype=np.int64))
+            boundary_deltas.append(-np.ones(num_of_calls, dtype=np.int64))
+
+    concurrency = dict()
+    if len(boundary_times) == 0:
+        return concurrency
+
+    boundary_functions = np.concatenate(boundary_functions)
+    boundary_times = np.concatenate(boundary_times)
+    boundary_deltas = np.concatenate(boundary_deltas)
+
+    # One sort orders the boundaries by function and time, with exits before
+    # entries at the same time. Every function's deltas sum up to zero, so a
+    # single cumulative sum gives the step function of every function.
+    order = np.lexsort((boundary_deltas, boundary_times, boundary_functions))
+    boundary_functions = boundary_functions[order]
+    boundary_times = boundary_times[order]
+    threads_inside = np.cumsum(boundary_deltas[order])
+
+    function_starts = np.searchsorted(boundary_functions, np.arange(len(functions)))
+    function_ends = np.append(function_starts[1:], len(boundary_functions))
+    for i in range(len(functions)):
+        if function_starts[i] < function_ends[i]:
+            concurrency[functions[i]] = (
+                boundary_times[function_starts[i] : function_ends[i]],
+                threads_inside[function_starts[i] : function_ends[i]],
+            )
+
+    return concurrency
+
+
+def get_peak_concurrency_in_bins(times, threads_inside, bin_edges):
+    import numpy as np
+
+    # The step function holds threads_inside[i] from times[i] until the next
+    # boundary. The peak in a bin is the maximum over the steps that start in
+    # it and the step that is running at its left edge.
+    running_step = np.searchsorted(times, bin_edges[:-1], "right") - 1
+    peaks = np.where(running_step >= 0, threads_inside[np.maximum(running_step, 0)], 0)
+
+    step_bins = np.searchsorted(bin_edges, times, "right") - 1
+    in_range = (step_bins >= 0) & (step_bins < len(peaks))
+    np.maximum.at(peaks, step_bins[in_range], threads_inside[in_range])
+
+    return peaks
+
+
+def get_activity_heatmap(activities, execution_start_time, execution_end_time):
+    import numpy as np
+
+    busy_fraction = np.zeros((len(activities), HEATMAP_BINS))
+    calls = np.zeros((len(activities), HEATMAP_BINS))
+    heatmap_bin_duration = (execution_end_time - execution_start_time) / HEATMAP_BINS
+
+    # Every fine bin of a thread is added to the heatmap bin that contains
+    # its center.
+    for i in range(len(activities)):
+        activity = activities[i]
+        num_of_bins = len(activity["busy_time"])
+        bin_duration = (activity["end_time"] - activity["start_time"]) / num_of_bins
+        bin_centers = activity["start_time"] + (np.arange(num_of_bins) + 0.5) * (
+            bin_duration
+        )
+        heatmap_bins = np.clip(
+            ((bin_centers - execution_start_time) / heatmap_bin_duration).astype(int),
+            0,
+            HEATMAP_BINS - 1,
+        )
+
+        busy_fraction[i] = (
+            np.bincount(heatmap_bins, activity["busy_time"], HEATMAP_BINS)
+            / heatmap_bin_duration
+        )
+        calls[i] = np.bincount(heatmap_bins, activity["calls"], HEATMAP_BINS)
+
+    return np.clip(busy_fraction, 0, 1).astype(np.float32), calls.astype(np.float32)
+
+
+def compress_filtered_trace(
+    trace, slowest_invocations, call_paths, executor=None, fold=False
+):
+    trace_stats = {
+        "call_path_stats": get_call_path_statistics(trace, call_paths),
+        "call_paths": call_paths.get_columns(),
+        "latency_percentiles": get_latency_percentiles(trace),
+        "filtered_events": len(trace),
+        "slowest_invocations": get_slowest_invocation_table(slowest_invocations),
+    }
+    if len(trace) > 0:
+        trace_stats["activity"] = get_thread_activity(trace)
+        trace_stats["call_intervals"] = get_thread_call_intervals(trace)
+
+    add_regtime_exprs = len(trace) > TIMELINE_PX_WIDTH / MIN_CALLSTACK_PX_WIDTH
+    if add_regtime_exprs:
+        trace = regtime(trace, executor)
+
+        if fold:
+            trace = fold_repeated_exprs(trace)
+
+    return trace, trace_stats
+
+
+def compress_trace_file(tracefile_path, executor=None, fold=False, event_filter=None):
+    trace, slowest_invocations, call_paths = filter_trace_file(
+        tracefile_path, executor, event_filter
+    )
+    return compress_filtered_trace(
+        trace, slowest_invocations, call_paths, executor, fold
+    )
+
+
+def compress_thread_lines(lines, fold=False, event_filter=None):
+    trace, slowest_invocations, call_paths = filter_thread_lines(lines, event_filter)
+    return compress_filtered_trace(trace, slowest_invocations, call_paths, None, fold)
+
+
+def get_estimated_function_totals(function_totals_in_strata, num_of_strata):
+    import numpy as np
+
+    # Every stratum is a cluster of whole top-level calls, so a function's
+    # total is estimated from the mean over the sampled strata and its error
+    # is the standard error of that estimate with the finite population
+    # correction, which is zero when every stratum was sampled.
+    num_of_samples = len(function_totals_in_strata)
+    functions = sorted(
+        set(function for totals in function_totals_in_strata for function in totals)
+    )
+
+    estimated_totals = {"function": list(), "total": list(), "error": list()}
+    for function in functions:
+        totals = np.array(
+            [totals.get(function, 0) for totals in function_totals_in_strata],
+            dtype=np.float64,
+        )
+
+        error = 0.0
+        if num_of_samples > 1 and num_of_samples < num_of_strata:
+            error = num_of_strata * math.sqrt(
+                (1 - num_of_samples / num_of_strata)
+                * totals.var(ddof=1)
+                / num_of_samples
+            )
+
+        estimated_totals["function"].append(function)
+        estimated_totals["total"].append(float(num_of_strata * totals.mean()))
+        estimated_totals["error"].append(error)
+
+    return estimated_totals
+
+
+def add_preview_statistics(trace_stats, function_totals_in_strata, num_of_strata):
+    trace_stats["estimated_totals"] = get_estimated_function_totals(
+        function_totals_in_strata, num_of_strata
+    )
+    trace_stats["preview"] = {
+        "sampled_strata": len(function_totals_in_strata),
+        "strata": num_of_strata,
+    }
+
+
+def compress_trace_preview(tracefile_path, sample_rate, fold=False, event_filter=None):
+    depth_index = get_depth_index(tracefile_path)
+    num_of_strata, strata = get_preview_strata(depth_index[2], sample_rate)
+    lines_in_strata = [
+        read_top_level_calls(tracefile_path, depth_index, start_offset, end_offset)
+        for start_offset, end_offset in strata
+    ]
+
+    function_totals_in_strata = [
+        get_function_durations(apply_event_filter(lines, event_filter))[0]
+        for lines in lines_in_strata
+    ]
+
+    trace, trace_stats = compress_thread_lines(
+        [line for lines in lines_in_strata for line in lines], fold, event_filter
+    )
+    add_preview_statistics(trace_stats, function_totals_in_strata, num_of_strata)
+
+    return trace, trace_stats
+
+
+def compress_filtered_batches(batch_results, executor=None, fold=False):
+    trace, slowest_invocations, call_paths = merge_filtered_batches(batch_results)
+    return compress_filtered_trace(
+        trace, slowest_invocations, call_paths, executor, fold
+    )
+
+
+def compress_batch_groups(batch_groups, executor=None, fold=False):
+    compressed_traces = list()
+    index_to_future = dict()
+
+    # As in compress_trace_files, threads that fit in one chunk of events are
+    # compressed whole on the pool, while larger threads are compressed here
+    # and split into chunks that share the same pool.
+    if executor != None:
+        for i in range(len(batch_groups)):
+            num_of_events = sum(
+                len(batch_result[0]) for batch_result in batch_groups[i]
+            )
+            if num_of_events <= CHUNK_SIZE_IN_EVENTS:
+                index_to_future[i] = executor.submit(
+                    compress_filtered_batches, batch_groups[i], None, fold
+                )
+
+    for i in tqdm(range(len(batch_groups))):
+        if i in index_to_future:
+            compressed_trace = index_to_future[i].result()
+        else:
+            compressed_trace = compress_filtered_batches(
+                batch_groups[i], executor, fold
+            )
+
+        compressed_traces.append(compressed_trace)
+
+    return compressed_traces
+
+
+def compress_interleaved_trace_file(
+    tracefile_path, executor=None, fold=False, event_filter=None, preview=None
+):
+    # A preview samples strata of the whole file, so every thread is sampled
+    # at the same points in time.
+    strata = None
+    if preview != None:
+        num_of_strata, strata = get_preview_strata(
+            get_file_size(tracefile_path), preview
+        )
+
+    thread_batches = filter_interleaved_trace_file(
+        tracefile_path, executor, event_filter, strata
+    )
+    compressed_traces = compress_batch_groups(
+        [
+            [batch_result for stratum, batch_result in batches]
+            for batches in thread_batches.values()
+        ],
+        executor,
+        fold,
+    )
+
+    if preview != None:
+        for batches, (trace, trace_stats) in zip(
+            thread_batches.values(), compressed_traces
+        ):
+            function_totals_in_strata = [dict() for stratum in strata]
+            for stratum, batch_result in batches:
+                function_totals = function_totals_in_strata[stratum]
+                for function, duration in batch_result[1].items():
+                    function_totals[function] = (
+                        function_totals.get(function, 0) + duration
+                    )
+
+            add_preview_statistics(
+                trace_stats, function_totals_in_strata, num_of_strata
+            )
+
+    tracefile_name = os.path.basename(tracefile_path)
+    return [
+        (tracefile_name + "." + thread_id, compressed_trace)
+        for thread_id, compressed_trace in zip(thread_batches, compressed_traces)
+    ]
+
+
+def get_trace_sources(dir, event_filter=None):
+    # Every source is a file with its own thread, or an interleaved file whose
+    # threads are read from it together.
+    return [
+        (tracefile_path, is_interleaved_trace_file(tracefile_path))
+        for tracefile_path in [
+            dir + "/" + tracefile_name
+            for tracefile_name in get_tracefilenames_in_directory(dir, event_filter)
+        ]
+    ]
+
+
+def compress_trace_files(
+    trace_sources, executor=None, fold=False, event_filter=None, preview=None
+):
+    compressed_traces = list()
+    index_to_future = dict()
+
+    # A preview only reads the sampled strata of every thread, so each
+    # thread is sampled and compressed whole.
+    if preview != None:
+        if executor == None:
+            return [
+                compress_trace_preview(trace_source, preview, fold, event_filter)
+                for trace_source in tqdm(trace_sources)
+            ]
+
+        futures = [
+            executor.submit(
+                compress_trace_preview, trace_source, preview, fold, event_filter
+            )
+            for trace_source in trace_sources
+        ]
+        return [future.result() for future in tqdm(futures)]
+
+    # Files that fit in one chunk are compressed whole on the pool, while
+    # larger files are split into chunks that share the same pool.
+    if executor != None:
+        for i in range(len(trace_sources)):
+            trace_source = trace_sources[i]
+            if get_file_size(trace_source) <= CHUNK_SIZE_IN_BYTES:
+                index_to_future[i] = executor.submit(
+                    compress_trace_file, trace_source, None, fold, event_filter
+                )
+
+    for i in tqdm(range(len(trace_sources))):
+        if i in index_to_future:
+            compressed_trace = index_to_future[i].result()
+        else:
+            compressed_trace = compress_trace_file(
+                trace_sources[i], executor, fold, event_filter
+            )
+
+        compressed_traces.append(compressed_trace)
+
+    return compressed_traces
+
+
+def compress_trace_sources(
+    trace_sources, executor=None, fold=False, event_filter=None, preview=None
+):
+    # Returns the (thread name, compressed trace) pairs of every source. The
+    # files with their own thread share the pool as before, and every
+    # interleaved file is then read once for all of its threads.
+    tracefile_paths = [
+        tracefile_path
+        for tracefile_path, interleaved in trace_sources
+        if not interleaved
+    ]
+    compressed_traces = deque(
+        compress_trace_files(tracefile_paths, executor, fold, event_filter, preview)
+    )
+
+    compressed_traces_in_sources = list()
+    for tracefile_path, interleaved in trace_sources:
+        if interleaved:
+            compressed_traces_in_sources.append(
+                compress_interleaved_trace_file(
+                    tracefile_path, executor, fold, event_filter, preview
+                )
+            )
+        else:
+            compressed_traces_in_sources.append(
+                [
+                    (
+                        os.path.basename(tracefile_path),
+                        compressed_traces.popleft(),
+                    )
+                ]
+            )
+
+    return compressed_traces_in_sources
+
+
+def process_trace_directories(
+    dirs, executor=None, fold=False, event_filter=None, preview=None
+):
+    import pandas as pd
+
+    trace_sources = list()
+    num_of_sources_in_dirs = list()
+
+    for dir in dirs:
+        trace_sources_in_dir = get_trace_sources(dir, event_filter)
+        trace_sources.extend(trace_sources_in_dir)
+        num_of_sources_in_dirs.append(len(trace_sources_in_dir))
+
+    compressed_traces_in_sources = compress_trace_sources(
+        trace_sources, executor, fold, event_filter, preview
+    )
+
+    traces_in_dirs = list()
+    trace_stats_in_dirs = list()
+    for num_of_sources in num_of_sources_in_dirs:
+        traces = list()
+        trace_stats = list()
+        for compressed_traces in compressed_traces_in_sources[:num_of_sources]:
+            for thread_name, (trace, stats) in compressed_traces:
+                # Threads without any events left after filtering are not rendered
+                if len(trace) == 0:
+                    continue
+
+                traces.append(pd.DataFrame(trace))
+                trace_stats.append(stats)
+
+        del compressed_traces_in_sources[:num_of_sources]
+        traces_in_dirs.append(traces)
+        trace_stats_in_dirs.append(trace_stats)
+
+    return traces_in_dirs, trace_stats_in_dirs
+
+
+def process_trace_files(dir, executor=None, fold=False, event_filter=None):
+    traces_in_dirs, trace_stats_in_dirs = process_trace_directories(
+        [dir], executor, fold, event_filter
+    )
+    return traces_in_dirs[0]
+
+
+def write_compressed_traces(
+    dir, output_dir, executor=None, fold=False, event_filter=None
+):
+    os.makedirs(output_dir, exist_ok=True)
+
+    compressed_traces_in_sources = compress_trace_sources(
+        get_trace_sources(dir, event_filter), executor, fold, event_filter
+    )
+
+    for tracefile_name, (trace, trace_stats) in [
+        compressed_trace
+        for compressed_traces in compressed_traces_in_sources
+        for compressed_trace in compressed_traces
+    ]:
+        if len(trace) == 0:
+            continue
+
+        compressed_trace = {
+            "tracefile_name": tracefile_name,
+            "trace": trace,
+            "trace_stats": trace_stats,
+        }
+        compressed_trace_path = join(
+            output_dir, tracefile_name + COMPRESSED_TRACE_EXTENSION
+        )
+        with open(compressed_trace_path, "wb") as f:
+            pickle.dump(compressed_trace, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def compress_trace_part(
+    tracefile_path, part, num_of_parts, executor=None, fold=False, event_filter=None
+):
+    if num_of_parts == 1:
+        return compress_trace_file(tracefile_path, executor, fold, event_filter)
+
+    # A part holds the top-level calls whose first line falls in its share of
+    # the thread's bytes, so the parts of a thread are consecutive time
+    # ranges that together hold every call once.
+    depth_index = get_depth_index(tracefile_path)
+    size_in_bytes = depth_index[2]
+    lines = read_top_level_calls(
+        tracefile_path,
+        depth_index,
+        round(part * size_in_bytes / num_of_parts),
+        round((part + 1) * size_in_bytes / num_of_parts),
+    )
+
+    return compress_thread_lines(lines, fold, event_filter)
+
+
+def write_shard(
+    dir,
+    output_path,
+    shard,
+    num_of_shards,
+    num_of_parts=1,
+    executor=None,
+    fold=False,
+    event_filter=None,
+):
+    # The threads of interleaved files are listed with a read of their last
+    # column, so every machine numbers the threads the same way.
+    thread_names = list()
+    thread_sources = list()
+    for tracefile_path, interleaved in get_trace_sources(dir, event_filter):
+        tracefile_name = os.path.basename(tracefile_path)
+        if interleaved:
+            for thread_id in get_interleaved_thread_ids(tracefile_path, event_filter):
+                thread_names.append(tracefile_name + "." + thread_id)
+                thread_sources.append((tracefile_path, thread_id))
+        else:
+            thread_names.append(tracefile_name)
+            thread_sources.append((tracefile_path, None))
+
+    # Every thread is split into the same number of parts and the parts are
+    # dealt out to the shards in turn, so any machine can compute its share
+    # from the folder listing and the thread IDs alone.
+    units = [
+        (thread, part)
+        for thread in range(len(thread_sources))
+        for part in range(num_of_parts)
+    ][shard::num_of_shards]
+    compressed_units = dict()
+
+    # As in compress_trace_files, parts and files that fit in one chunk are
+    # compressed whole on the pool, while larger files are split into chunks
+    # that share the same pool.
+    index_to_future = dict()
+    if executor != None:
+        for i in range(len(units)):
+            thread, part = units[i]
+            tracefile_path, thread_id = thread_sources[thread]
+            if thread_id == None and (
+                num_of_parts > 1 or get_file_size(tracefile_path) <= CHUNK_SIZE_IN_BYTES
+            ):
+                index_to_future[i] = executor.submit(
+                    compress_trace_part,
+                    tracefile_path,
+                    part,
+                    num_of_parts,
+                    None,
+                    fold,
+                    event_filter,
+                )
+
+    for i in tqdm(range(len(units))):
+        thread, part = units[i]
+        tracefile_path, thread_id = thread_sources[thread]
+        if i in index_to_future:
+            compressed_units[i] = index_to_future[i].result()
+        elif thread_id == None:
+            compressed_units[i] = compress_trace_part(
+                tracefile_path, part, num_of_parts, executor, fold, event_filter
+            )
+
+    # The units of an interleaved file are read from it together. A part of
+    # one of its threads holds the top-level calls whose first line falls in
+    # the part's share of the file's bytes.
+    interleaved_units = dict()
+    for i in range(len(units)):
+        thread, part = units[i]
+        tracefile_path, thread_id = thread_sources[thread]
+        if thread_id != None:
+            interleaved_units.setdefault(tracefile_path, dict())[i] = (thread_id, part)
+
+    for tracefile_path, units_in_file in interleaved_units.items():
+        strata = None
+        if num_of_parts > 1:
+            size_in_bytes = get_file_size(tracefile_path)
+            strata = [
+                (
+                    round(part * size_in_bytes / num_of_parts),
+                    round((part + 1) * size_in_bytes / num_of_parts),
+                )
+                for part in range(num_of_parts)
+            ]
+
+        thread_batches = filter_interleaved_trace_file(
+            tracefile_path,
+            executor,
+            event_filter,
+            strata,
+            set(units_in_file.values()),
+        )
+        compressed_traces = compress_batch_groups(
+            [
+                [
+                    batch_result
+                    for stratum, batch_result in thread_batches.get(thread_id, ())
+                    if stratum == part
+                ]
+                for thread_id, part in units_in_file.values()
+            ],
+            executor,
+            fold,
+        )
+        compressed_units.update(zip(units_in_file, compressed_traces))
+
+    parts = list()
+    for i in range(len(units)):
+        thread, part = units[i]
+        trace, trace_stats = compressed_units[i]
+        if len(trace) == 0:
+            continue
+
+        parts.append(
+            {
+                "thread": thread,
+                "thread_name": thread_names[thread],
+                "part": part,
+                "trace": trace,
+                "trace_stats": trace_stats,
+                "function_occurrences": get_function_occurrences(trace),
+            }
+        )
+
+    shard_output = {
+        "format": SHARD_FORMAT,
+        "version": SHARD_FORMAT_VERSION,
+        "input_folder": dir,
+        "shard": shard,
+        "num_of_shards": num_of_shards,
+        "num_of_parts": num_of_parts,
+        "fold": fold,
+        "manifest": get_trace_manifest(dir, event_filter),
+        "parts": parts,
+    }
+
+    with open(output_path, "wb") as f:
+        pickle.dump(shard_output, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def read_shard(shard_path):
+    with open(shard_path, "rb") as f:
+        shard_output = pickle.load(f)
+
+    assert (
+        isinstance(shard_output, dict) and shard_output.get("format") == SHARD_FORMAT
+    ), (shard_path + " is not a shard file")
+    assert shard_output["version"] <= SHARD_FORMAT_VERSION, (
+        shard_path + " was written by a newer version"
+    )
+
+    return shard_output
+
+
+def is_shard_directory(dir):
+    tracefile_names = get_tracefilenames_in_directory(dir)
+
+    return len(tracefile_names) > 0 and all(
+        tracefile_name.endswith(SHARD_EXTENSION) for tracefile_name in tracefile_names
+    )
+
+
+def merge_latency_percentiles(latency_percentiles_in_parts):
+    import numpy as np
+
+    # Percentiles cannot be combined exactly, so a split thread reports the
+    # mean of its parts' percentiles weighted by their number of calls.
+    function_to_counts = dict()
+    function_to_percentiles = dict()
+    for latency_percentiles in latency_percentiles_in_parts:
+        for i in range(len(latency_percentiles["function"])):
+            function = latency_percentiles["function"][i]
+            function_to_counts.setdefault(function, list()).append(
+                latency_percentiles["count"][i]
+            )
+            function_to_percentiles.setdefault(function, list()).append(
+                [
+                    latency_percentiles["p" + str(percentile)][i]
+                    for percentile in LATENCY_PERCENTILES
+                ]
+            )
+
+    merged_percentiles = {"function": list(), "count": list()}
+    for percentile in LATENCY_PERCENTILES:
+        merged_percentiles["p" + str(percentile)] = list()
+
+    for function, counts in function_to_counts.items():
+        merged_percentiles["function"].append(function)
+        merged_percentiles["count"].append(sum(counts))
+
+        percentile_durations = np.average(
+            function_to_percentiles[function], axis=0, weights=counts
+        )
+        for percentile, duration in zip(LATENCY_PERCENTILES, percentile_durations):
+            merged_percentiles["p" + str(percentile)].append(float(duration))
+
+    return merged_percentiles
+
+
+def merge_thread_activities(activities):
+    import numpy as np
+
+    # Every part was binned over its own time range, so its bins are added
+    # to the bin of the merged range that contains their center.
+    start_time = min(activity["start_time"] for activity in activities)
+    end_time = max(activity["end_time"] for activity in activities)
+    bin_duration = (end_time - start_time) / ACTIVITY_BINS
+    busy_time = np.zeros(ACTIVITY_BINS)
+    calls = np.zeros(ACTIVITY_BINS, dtype=np.int64)
+
+    for activity in activities:
+        num_of_bins = len(activity["busy_time"])
+        part_bin_duration = (activity["end_time"] - activity["start_time"]) / (
+            num_of_bins
+        )
+        bin_centers = activity["start_time"] + (np.arange(num_of_bins) + 0.5) * (
+            part_bin_duration
+        )
+        bins = np.clip(
+            ((bin_centers - start_time) / bin_duration).astype(int),
+            0,
+            ACTIVITY_BINS - 1,
+        )
+        busy_time += np.bincount(bins, activity["busy_time"], ACTIVITY_BINS)
+        calls += np.bincount(bins, activity["calls"], ACTIVITY_BINS).astype(np.int64)
+
+    return {
+        "start_time": start_time,
+        "end_time": end_time,
+        "busy_time": busy_time,
+        "calls": calls,
+    }
+
+
+def merge_call_intervals(call_intervals_in_parts):
+    import numpy as np
+
+    function_names = list()
+    function_to_code = dict()
+    functions = list()
+    for call_intervals in call_intervals_in_parts:
+        for function in call_intervals["function_names"]:
+            if function not in function_to_code:
+                function_to_code[function] = len(function_names)
+                function_names.append(function)
+
+        part_function_codes = np.array(
+            [
+                function_to_code[function]
+                for function in call_intervals["function_names"]
+            ],
+            dtype=np.int32,
+        )
+        functions.append(part_function_codes[call_intervals["function"]])
+
+    merged_call_intervals = {
+        "function_names": function_names,
+        "function": np.concatenate(functions),
+    }
+    for column in ["start_time", "end_time", "callstack_depth"]:
+        merged_call_intervals[column] = np.concatenate(
+            [call_intervals[column] for call_intervals in call_intervals_in_parts]
+        )
+
+    return merged_call_intervals
+
+
+def merge_trace_stats(trace_stats_in_parts):
+    if len(trace_stats_in_parts) == 1:
+        return trace_stats_in_parts[0]
+
+    call_path_to_stats = dict()
+    for trace_stats in trace_stats_in_parts:
+        call_path_stats = trace_stats["call_path_stats"]
+        for call_path, function, count, duration in zip(
+            call_path_stats["call_path"],
+            call_path_stats["function"],
+            call_path_stats["count"],
+            call_path_stats["duration"],
+        ):
+            merged_stats = call_path_to_stats.setdefault(call_path, [function, 0, 0])
+            merged_stats[1] += count
+            merged_stats[2] += duration
+
+    call_path_statistics = {
+        "call_path": list(),
+        "function": list(),
+        "count": list(),
+        "duration": list(),
+    }
+    for call_path, (function, count, duration) in call_path_to_stats.items():
+        call_path_statistics["call_path"].append(call_path)
+        call_path_statistics["function"].append(function)
+        call_path_statistics["count"].append(count)
+        call_path_statistics["duration"].append(duration)
+
+    slowest_invocations = dict()
+    for trace_stats in trace_stats_in_parts:
+        slowest_invocation_table = trace_stats["slowest_invocations"]
+        for i in range(len(slowest_invocation_table["function"])):
+            add_slowest_invocation(
+                slowest_invocations,
+                slowest_invocation_table["function"][i],
+                (
+                    slowest_invocation_table["duration"][i],
+                    slowest_invocation_table["start_time"][i],
+                    slowest_invocation_table["end_time"][i],
+                    slowest_invocation_table["callstack_depth"][i],
+                ),
+            )
+
+    for function in slowest_invocations:
+        slowest_invocations[function].sort(reverse=True)
+
+    merged_trace_stats = {
+        "call_path_stats": call_path_statistics,
+        "latency_percentiles": merge_latency_percentiles(
+            [trace_stats["latency_percentiles"] for trace_stats in trace_stats_in_parts]
+        ),
+        "slowest_invocations": get_slowest_invocation_table(slowest_invocations),
+        "activity": merge_thread_activities(
+            [trace_stats["activity"] for trace_stats in trace_stats_in_parts]
+        ),
+        "call_intervals": merge_call_intervals(
+            [trace_stats["call_intervals"] for trace_stats in trace_stats_in_parts]
+        ),
+    }
+
+    # Shards written by older versions did not count the filtered events.
+    if all("filtered_events" in trace_stats for trace_stats in trace_stats_in_parts):
+        merged_trace_stats["filtered_events"] = sum(
+            trace_stats["filtered_events"] for trace_stats in trace_stats_in_parts
+        )
+
+    return merged_trace_stats
+
+
+def merge_shards(shard_outputs, event_filter=None):
+    import pandas as pd
+
+    thread_to_parts = dict()
+    for shard_output in shard_outputs:
+        for part in shard_output["parts"]:
+            if event_filter == None or event_filter.keeps_tracefile(
+                part["thread_name"]
+            ):
+                thread_to_parts.setdefault(part["thread"], list()).append(part)
+
     traces = list()
+    trace_stats = list()
+    for thread in sorted(thread_to_parts):
+        parts = sorted(thread_to_parts[thread], key=itemgetter("part"))
+
+        # Every part numbered its call paths on its own, so the parts' tries
+        # are merged into one and their events are renumbered.
+        call_paths = CallPathTrie()
+        for part in parts:
+            call_path_map = call_paths.merge(
+                CallPathTrie.from_columns(part["trace_stats"]["call_paths"])
+            )
+            for event in part["trace"]:
+                event["call_path"] = call_path_map[event["call_path"]]
+
+        # Parts are consecutive time ranges of the thread, so their
+        # compressed traces are concatenated and their statistics combined.
+        traces.append(
+            pd.DataFrame([event for part in parts for event in part["trace"]])
+        )
+
+        function_occurrences = dict()
+        for part in parts:
+            for function, num_of_occurrences in part["function_occurrences"].items():
+                function_occurrences[function] = (
+                    function_occurrences.get(function, 0) + num_of_occurrences
+                )
+
+        merged_trace_stats = merge_trace_stats([part["trace_stats"] for part in parts])
+        trace_stats.append(
+            dict(
+                merged_trace_stats,
+                call_paths=call_paths.get_columns(),
+                function_occurrences=function_occurrences,
+            )
+        )
+
+    return traces, trace_stats
 
+
+def load_shard_directory(dir, event_filter=None):
+    shard_outputs = [
+        read_shard(join(dir, shard_name))
+        for shard_name in get_tracefilenames_in_directory(dir)
+    ]
+
+    shard_numbers = set(shard_output["shard"] for shard_output in shard_outputs)
+    num_of_shards = shard_outputs[0]["num_of_shards"]
+    if len(shard_numbers) != num_of_shards:
+        print(
+            "Warning: "
+            + dir
+            + " holds {} of {} shards".format(len(shard_numbers), num_of_shards)
+        )
+
+    traces, trace_stats = merge_shards(shard_outputs, event_filter)
+
+    # Every shard carries the manifest of the whole input folder.
+    return traces, trace_stats, shard_outputs[0]["manifest"]
+
+
+def is_compressed_trace_directory(dir):
     tracefile_names = get_tracefilenames_in_directory(dir)
 
-    for tracefile_name in tqdm(tracefile_names):
-        tracefile_path = dir + "/" + tracefile_name
-        trace = filter_trace_file(tracefile_path)
+    return len(tracefile_names) > 0 and all(
+        tracefile_name.endswith(COMPRESSED_TRACE_EXTENSION)
+        for tracefile_name in tracefile_names
+    )
+
+
+def read_compressed_traces(dir, event_filter=None):
+    compressed_traces = list()
 
-        add_regtime_exprs = len(trace) > TIMELINE_PX_WIDTH / MIN_CALLSTACK_PX_WIDTH
-        if add_regtime_exprs:
-            trace = regtime(trace)
+    tracefile_names = get_tracefilenames_in_directory(dir, event_filter)
 
-        traces.append(pd.DataFrame(trace))
+    for tracefile_name in tracefile_names:
+        with open(join(dir, tracefile_name), "rb") as f:
+            compressed_traces.append(pickle.load(f))
 
+    return compressed_traces
+
+
+def load_compressed_trace_events(dir):
+    return [
+        compressed_trace["trace"] for compressed_trace in read_compressed_traces(dir)
+    ]
+
+
+def load_compressed_trace_directory(dir, event_filter=None):
+    import pandas as pd
+
+    traces = list()
+    trace_stats = list()
+
+    for compressed_trace in read_compressed_traces(dir, event_filter):
+        traces.append(pd.DataFrame(compressed_trace["trace"]))
+        trace_stats.append(compressed_trace.get("trace_stats", dict()))
+
+    return traces, trace_stats
+
+
+def load_compressed_traces(dir):
+    traces, trace_stats = load_compressed_trace_directory(dir)
     return traces
 
 
+def get_trace_manifest(dir, event_filter=None):
+    manifest = {
+        "directory": dir,
+        "execution_start_time": None,
+        "execution_end_time": None,
+        "size_in_bytes": 0,
+        "estimated_events": 0,
+        "tracefiles": list(),
+    }
+
+    for tracefile_name in get_tracefilenames_in_directory(dir, event_filter):
+        tracefile_summary = get_tracefile_summary(join(dir, tracefile_name))
+        tracefile_summary["name"] = tracefile_name
+        manifest["tracefiles"].append(tracefile_summary)
+
+        manifest["size_in_bytes"] += tracefile_summary["size_in_bytes"]
+        manifest["estimated_events"] += tracefile_summary["estimated_events"]
+
+        if tracefile_summary["first_time"] == None:
+            continue
+
+        if manifest["execution_start_time"] == None:
+            manifest["execution_start_time"] = tracefile_summary["first_time"]
+            manifest["execution_end_time"] = tracefile_summary["last_time"]
+        else:
+            manifest["execution_start_time"] = min(
+                manifest["execution_start_time"], tracefile_summary["first_time"]
+            )
+            manifest["execution_end_time"] = max(
+                manifest["execution_end_time"], tracefile_summary["last_time"]
+            )
+
+    return manifest
+
+
+def write_trace_manifest(manifest, manifest_path):
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def read_trace_manifest(manifest_path):
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def format_manifest_summary(manifest):
+    return "{}: {} trace files, {:.1f} MB, ~{:,} events, {} to {}".format(
+        manifest["directory"],
+        len(manifest["tracefiles"]),
+        manifest["size_in_bytes"] / (1 << 20),
+        manifest["estimated_events"],
+        manifest["execution_start_time"],
+        manifest["execution_end_time"],
+    )
+
+
 def get_execution_time_range(traces):
     execution_start_time = None
     execution_end_time = None
@@ -66,9 +1296,194 @@ def get_execution_time_range(traces):
     return execution_start_time, execution_end_time
 
 
-def assign_colors_from_file(traces, colorfile):
+def get_trace_structure_fingerprint(trace):
+    import pandas as pd
+
+    event_hashes = pd.util.hash_pandas_object(
+        trace[["event_type", "function", "callstack_depth", "parens"]], index=False
+    )
+    return hashlib.sha1(event_hashes.values.tobytes()).hexdigest()
+
+
+def get_max_time_difference(trace, other_trace):
+    import numpy as np
+
+    return max(
+        float(
+            np.abs(
+                trace[column].to_numpy(dtype=np.float64)
+                - other_trace[column].to_numpy(dtype=np.float64)
+            ).max(initial=0)
+        )
+        for column in ["start_time", "end_time", "duration"]
+    )
+
+
+def get_trace_group_time_deviation(traces, trace_group):
+    # Only the group's first thread is drawn, so the largest difference of
+    # any member's timestamps from it tells how far the drawing may be off.
+    return max(
+        get_max_time_difference(traces[trace_group[0]], traces[i]) for i in trace_group
+    )
+
+
+def group_identical_traces(
+    traces, execution_start_time, execution_end_time, tolerance=DEDUP_TIME_TOLERANCE
+):
+    structure_to_groups = dict()
+    trace_groups = list()
+
+    time_tolerance = max(tolerance * (execution_end_time - execution_start_time), 1)
+
+    # Threads are bucketed by the hash of their event structure alone, and
+    # within a bucket a thread joins the first group whose first thread has
+    # every timestamp and duration within the tolerance of its own.
+    for i in range(len(traces)):
+        groups_with_structure = structure_to_groups.setdefault(
+            get_trace_structure_fingerprint(traces[i]), list()
+        )
+
+        matching_group = None
+        for group in groups_with_structure:
+            time_difference = get_max_time_difference(
+                traces[trace_groups[group][0]], traces[i]
+            )
+            if time_difference <= time_tolerance:
+                matching_group = group
+                break
+
+        if matching_group == None:
+            groups_with_structure.append(len(trace_groups))
+            trace_groups.append([i])
+
+        else:
+            trace_groups[matching_group].append(i)
+
+    return trace_groups
+
+
+def get_thread_call_profiles(traces, trace_stats):
+    import pandas as pd
+
+    # The call path statistics already hold every thread's time per call
+    # path, so the traces are only walked for folders compressed without them.
+    call_profiles = list()
+    for trace, stats in zip(traces, trace_stats):
+        if "call_path_stats" in stats:
+            call_profiles.append(pd.DataFrame(stats["call_path_stats"]))
+            continue
+
+        calls = trace[trace.event_type != EXIT_EVENTTYPE]
+        call_profiles.append(
+            pd.DataFrame(
+                {
+                    "call_path": calls.function
+                    + CALL_PATH_SEPARATOR
+                    + calls.callstack_depth.astype(str),
+                    "function": calls.function,
+                    "duration": calls.duration,
+                }
+            )
+        )
+
+    return call_profiles
+
+
+def get_thread_signatures(
+    traces, trace_stats, num_of_permutations=MINHASH_PERMUTATIONS
+):
+    import numpy as np
+    import pandas as pd
+
+    call_profiles = get_thread_call_profiles(traces, trace_stats)
+    thread_index = np.repeat(
+        np.arange(len(call_profiles)),
+        [len(call_profile) for call_profile in call_profiles],
+    )
+    call_profile = pd.concat(call_profiles, ignore_index=True)
+
+    # The function-time histogram holds the fraction of a thread's call time
+    # spent in every function.
+    function_codes, functions = pd.factorize(call_profile.function)
+    function_times = np.bincount(
+        thread_index * len(functions) + function_codes,
+        weights=call_profile.duration.to_numpy(dtype=np.float64),
+        minlength=len(call_profiles) * len(functions),
+    ).reshape(len(call_profiles), len(functions))
+    thread_times = function_times.sum(axis=1, keepdims=True)
+    function_time_fractions = function_times / np.where(
+        thread_times > 0, thread_times, 1
+    )
+
+    # The MinHash of a thread's set of call paths keeps, for every random
+    # hash function, the smallest hash over the set. Two threads agree on a
+    # hash function with a probability equal to the Jaccard similarity of
+    # their sets. Hashes, multipliers and increments are below 2^31, so
+    # every product plus its increment stays below 2^62 and fits in 64 bits.
+    call_path_hashes = pd.util.hash_array(call_profile.call_path.to_numpy()) & (
+        np.uint64(MINHASH_PRIME)
+    )
+    rng = np.random.default_rng(0)
+    multipliers = rng.integers(1, MINHASH_PRIME, num_of_permutations, np.uint64)
+    increments = rng.integers(0, MINHASH_PRIME, num_of_permutations, np.uint64)
+    permuted_hashes = (
+        multipliers[:, None] * call_path_hashes[None, :] + increments[:, None]
+    ) % np.uint64(MINHASH_PRIME)
+
+    minhashes = np.full(
+        (len(call_profiles), num_of_permutations), np.iinfo(np.uint64).max
+    )
+    np.minimum.at(minhashes.T, (slice(None), thread_index), permuted_hashes)
+
+    return function_time_fractions, minhashes
+
+
+def cluster_similar_traces(
+    traces, trace_stats, distance_threshold=CLUSTER_DISTANCE_THRESHOLD
+):
+    import numpy as np
+
+    function_time_fractions, minhashes = get_thread_signatures(traces, trace_stats)
+
+    # Threads join the cluster whose representative is nearest, if it is
+    # within the threshold on both signatures: the total variation distance of
+    # the function-time histograms and one minus the estimated Jaccard
+    # similarity of the call paths. The distance to a representative is the
+    # larger of the two. Every thread is compared against the representatives
+    # only, so the work grows with the number of thread roles.
+    trace_groups = list()
+    representatives = list()
+    for i in range(len(traces)):
+        if len(representatives) > 0:
+            histogram_distances = 0.5 * np.abs(
+                function_time_fractions[representatives] - function_time_fractions[i]
+            ).sum(axis=1)
+            call_path_distances = 1 - (minhashes[representatives] == minhashes[i]).mean(
+                axis=1
+            )
+            distances = np.maximum(histogram_distances, call_path_distances)
+
+            nearest = int(np.argmin(distances))
+            if distances[nearest] <= distance_threshold:
+                trace_groups[nearest].append(i)
+                continue
+
+        representatives.append(i)
+        trace_groups.append([i])
+
+    return trace_groups
+
+
+def get_trace_group_label(trace_group):
+    thread_ids = ", ".join(str(i + 1) for i in trace_group)
+    if len(trace_group) == 1:
+        return thread_ids
+
+    return thread_ids + " (" + str(len(trace_group)) + " threads)"
+
+
+def read_color_file(colorfile):
     func_to_color_from_file = dict()
-    func_to_color = dict()
 
     with open(colorfile, "r") as f:
         for line in f:
@@ -80,6 +1495,13 @@ def assign_colors_from_file(traces, colorfile):
 
             func_to_color_from_file[function] = (color, alpha)
 
+    return func_to_color_from_file
+
+
+def assign_colors_from_file(traces, colorfile):
+    func_to_color_from_file = read_color_file(colorfile)
+    func_to_color = dict()
+
     for trace in traces:
         unique_func_names_in_trace = trace.function.unique().tolist()
 
@@ -92,6 +1514,8 @@ def assign_colors_from_file(traces, colorfile):
 
 
 def define_color_palette():
+    from bokeh.palettes import Category20
+
     color_palette = list()
     for color in Category20[20]:
         color_palette.append((color, 1))
@@ -102,22 +1526,33 @@ def define_color_palette():
     return color_palette
 
 
-def assign_colors_to_functions(traces):
-    func_to_color = dict()
+def get_function_occurrences(trace):
+    # Functions are listed in the order they first appear in the trace, which
+    # breaks ties between functions with the same ranking.
+    if not hasattr(trace, "function"):
+        function_occurrences = dict()
+        for event in trace:
+            function_occurrences.setdefault(event["function"], 0)
+            if event["event_type"] != EXIT_EVENTTYPE:
+                function_occurrences[event["function"]] += 1
+
+        return function_occurrences
+
+    calls = trace.function[trace.event_type != EXIT_EVENTTYPE].value_counts()
+
+    return {
+        func_name: int(calls.get(func_name, 0))
+        for func_name in trace.function.unique().tolist()
+    }
+
+
+def rank_function_occurrences(function_occurrences_in_traces):
     func_to_num_of_occurrences = dict()
     func_to_num_of_threads = dict()
     func_to_ranking = dict()
 
-    for trace in traces:
-        unique_func_names_in_trace = trace.function.unique().tolist()
-
-        for func_name in unique_func_names_in_trace:
-            event_is_func = trace.function == func_name
-            event_type_not_exit = trace.event_type != EXIT_EVENTTYPE
-
-            num_of_occurrences = trace[
-                event_is_func & event_type_not_exit
-            ].function.count()
+    for function_occurrences in function_occurrences_in_traces:
+        for func_name, num_of_occurrences in function_occurrences.items():
             func_to_num_of_occurrences[func_name] = (
                 func_to_num_of_occurrences.get(func_name, 0) + num_of_occurrences
             )
@@ -134,6 +1569,23 @@ def assign_colors_to_functions(traces):
         func_to_ranking.items(), key=itemgetter(1), reverse=True
     )
 
+    return sorted_func_rankings
+
+
+def rank_functions(traces):
+    return rank_function_occurrences(
+        [get_function_occurrences(trace) for trace in traces]
+    )
+
+
+def assign_colors_to_functions(traces, function_occurrences_in_traces=None):
+    func_to_color = dict()
+
+    if function_occurrences_in_traces != None:
+        sorted_func_rankings = rank_function_occurrences(function_occurrences_in_traces)
+    else:
+        sorted_func_rankings = rank_functions(traces)
+
     color_palette = define_color_palette()
     i = 0
     for func, ranking in sorted_func_rankings:
@@ -148,7 +1600,290 @@ def assign_colors_to_functions(traces):
     return func_to_color
 
 
-def fill_CDS_and_time_maps(trace, pixels_per_timeunit, func_to_color):
+def format_duration(duration):
+    duration_in_range_of_secs = duration / 1000000000 >= 1
+    duration_in_range_of_ms = duration / 1000000 >= 1
+
+    if duration_in_range_of_secs:
+        return str(round(duration / 1000000000, 2)) + " seconds"
+
+    elif duration_in_range_of_ms:
+        return str(round(duration / 1000000, 2)) + " milliseconds"
+
+    return str(round(duration)) + " nanoseconds"
+
+
+def format_repeat_durations(trace_event):
+    mean_duration = trace_event["duration"] / trace_event["repeats"]
+
+    return (
+        format_duration(trace_event["min_duration"])
+        + " / "
+        + format_duration(mean_duration)
+        + " / "
+        + format_duration(trace_event["max_duration"])
+    )
+
+
+def format_estimated_totals(estimated_totals):
+    return {
+        function: format_duration(total) + " \u00b1 " + format_duration(error)
+        for function, total, error in zip(
+            estimated_totals["function"],
+            estimated_totals["total"],
+            estimated_totals["error"],
+        )
+    }
+
+
+def assign_colors_from_registry(traces, registry_file):
+    import fcntl
+
+    # Reports of concurrent runs may share a registry, so it is read and
+    # updated under a lock on a file next to it, and the update replaces the
+    # registry in one rename.
+    with open(registry_file + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        registry = ""
+        func_to_color_in_registry = dict()
+        if os.path.isfile(registry_file):
+            with open(registry_file, "r") as f:
+                registry = f.read()
+
+            func_to_color_in_registry = read_color_file(registry_file)
+
+        func_to_color = dict()
+        new_func_to_color = dict()
+
+        used_colors = set(func_to_color_in_registry.values())
+        unused_colors = [
+            color for color in define_color_palette() if color not in used_colors
+        ]
+
+        # Once the palette runs out, functions are drawn in the default color
+        # but not registered, so they get a color when one is freed up.
+        for func, ranking in rank_functions(traces):
+            if func in func_to_color_in_registry:
+                func_to_color[func] = func_to_color_in_registry[func]
+
+            elif len(unused_colors) > 0:
+                new_func_to_color[func] = unused_colors.pop(0)
+
+            else:
+                func_to_color[func] = (DEFAULT_FUNC_COLOR, 1)
+
+        if len(new_func_to_color) > 0:
+            if len(registry) > 0 and not registry.endswith("\n"):
+                registry += "\n"
+
+            for func, (color, alpha) in new_func_to_color.items():
+                registry += func + " " + color + " " + str(alpha) + "\n"
+
+            registry_fd, registry_path = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(registry_file))
+            )
+            with os.fdopen(registry_fd, "w") as f:
+                f.write(registry)
+
+            os.replace(registry_path, registry_file)
+
+    func_to_color.update(new_func_to_color)
+    return func_to_color
+
+
+def get_call_path_table(trace_stats):
+    import pandas as pd
+
+    call_path_tables = [
+        pd.DataFrame(stats["call_path_stats"])
+        for stats in trace_stats
+        if "call_path_stats" in stats
+    ]
+    if len(call_path_tables) == 0:
+        return pd.DataFrame(columns=["call_path", "function", "count", "duration"])
+
+    call_path_table = pd.concat(call_path_tables, ignore_index=True)
+    return call_path_table.groupby(["call_path", "function"], as_index=False)[
+        ["count", "duration"]
+    ].sum()
+
+
+def join_run_statistics(baseline_table, table, keys):
+    deltas = baseline_table.merge(
+        table, on=keys, how="outer", suffixes=("_baseline", "")
+    )
+
+    for column in ["count", "duration", "count_baseline", "duration_baseline"]:
+        deltas[column] = deltas[column].fillna(0)
+
+    deltas["count_delta"] = deltas["count"] - deltas["count_baseline"]
+    deltas["duration_delta"] = deltas["duration"] - deltas["duration_baseline"]
+    deltas["duration_delta_pct"] = (
+        100
+        * deltas["duration_delta"]
+        / deltas["duration_baseline"].where(deltas["duration_baseline"] > 0)
+    )
+
+    return deltas.sort_values("duration_delta", ascending=False, ignore_index=True)
+
+
+def get_call_path_deltas(baseline_trace_stats, trace_stats):
+    return join_run_statistics(
+        get_call_path_table(baseline_trace_stats),
+        get_call_path_table(trace_stats),
+        ["call_path", "function"],
+    )
+
+
+def get_function_deltas(baseline_trace_stats, trace_stats):
+    baseline_function_table = (
+        get_call_path_table(baseline_trace_stats)
+        .groupby("function", as_index=False)[["count", "duration"]]
+        .sum()
+    )
+    function_table = (
+        get_call_path_table(trace_stats)
+        .groupby("function", as_index=False)[["count", "duration"]]
+        .sum()
+    )
+
+    return join_run_statistics(baseline_function_table, function_table, ["function"])
+
+
+def assign_colors_from_deltas(function_deltas):
+    from bokeh.palettes import RdBu11
+
+    func_to_color = dict()
+
+    # RdBu11 runs from blue to red, so slower functions are tinted red and
+    # faster functions blue, in proportion to their relative change.
+    max_durations = function_deltas[["duration", "duration_baseline"]].max(axis=1)
+    relative_deltas = function_deltas["duration_delta"] / max_durations.where(
+        max_durations > 0, 1
+    )
+    palette_indices = ((1 + relative_deltas) / 2 * (len(RdBu11) - 1)).round()
+
+    for func, palette_index in zip(function_deltas["function"], palette_indices):
+        func_to_color[func] = (RdBu11[int(palette_index)], 1)
+
+    return func_to_color
+
+
+def get_outlier_table(trace_stats):
+    import pandas as pd
+
+    outlier_tables = list()
+
+    for i in range(len(trace_stats)):
+        stats = trace_stats[i]
+        if "slowest_invocations" not in stats:
+            continue
+
+        outliers = pd.DataFrame(stats["slowest_invocations"])
+        outliers["thread"] = i + 1
+
+        latency_percentiles = pd.DataFrame(stats["latency_percentiles"])
+        outliers = outliers.merge(latency_percentiles, on="function", how="left")
+        outlier_tables.append(outliers)
+
+    if len(outlier_tables) == 0:
+        return None
+
+    outlier_table = pd.concat(outlier_tables, ignore_index=True)
+    return outlier_table.nlargest(MAX_OUTLIER_TABLE_ROWS, "duration").reset_index(
+        drop=True
+    )
+
+
+def get_functions_in_traces(traces):
+    functions_in_traces = set()
+
+    for trace in traces:
+        functions_in_traces.update(trace.function.unique().tolist())
+
+    return functions_in_traces
+
+
+def cap_trace_depths(traces, max_depth):
+    import pandas as pd
+
+    capped_traces = list()
+    folded_subtrees_in_traces = list()
+    for trace in traces:
+        capped_trace, folded_subtrees = cap_callstack_depth(
+            trace.to_dict("records"), max_depth
+        )
+        capped_traces.append(pd.DataFrame(capped_trace))
+        folded_subtrees_in_traces.append(folded_subtrees)
+
+    return capped_traces, folded_subtrees_in_traces
+
+
+def get_folded_subtree_rows(folded_subtrees):
+    subtree_rows = {"subtree": [], "function": [], "depth": [], "duration": []}
+
+    for subtree_index, folded_subtree in enumerate(folded_subtrees):
+        if len(folded_subtree) == 0:
+            continue
+
+        min_callstack_depth = folded_subtree[0]["callstack_depth"]
+        for trace_event in folded_subtree:
+            if trace_event["event_type"] == EXIT_EVENTTYPE:
+                continue
+
+            indent = trace_event["callstack_depth"] - min_callstack_depth
+            subtree_rows["subtree"].append(subtree_index)
+            subtree_rows["function"].append("\u2003" * indent + trace_event["function"])
+            subtree_rows["depth"].append(trace_event["callstack_depth"])
+            subtree_rows["duration"].append(format_duration(trace_event["duration"]))
+
+    return subtree_rows
+
+
+def get_range_stat_columns(trace_event_columns, durations):
+    import numpy as np
+
+    # The rectangles of a function at one callstack depth are disjoint, or
+    # share the time span of the RegTime expression they belong to, so once
+    # they are grouped by function and depth their start and end times and
+    # their x coordinates are all sorted. The time a function spends inside
+    # a selected interval is then two binary searches and a difference of
+    # prefix sums per group, with only the rectangles cut by the interval
+    # edges scaled by their overlap.
+    functions = np.array(trace_event_columns["function"], dtype=object)
+    function_names, function_codes = np.unique(functions, return_inverse=True)
+    order = np.lexsort(
+        (
+            trace_event_columns["left"],
+            trace_event_columns["start_time"],
+            trace_event_columns["top"],
+            function_codes,
+        )
+    )
+
+    group_keys = np.stack((function_codes[order], trace_event_columns["top"][order]))
+    is_group_start = np.ones(len(order), dtype=bool)
+    is_group_start[1:] = np.any(group_keys[:, 1:] != group_keys[:, :-1], axis=0)
+    group_starts = np.flatnonzero(is_group_start)
+
+    range_stat_columns = dict(
+        order=order.astype(np.int32),
+        cum_duration=np.cumsum(np.array(durations, dtype=np.float64)[order]),
+        cum_count=np.cumsum(trace_event_columns["repeats"][order]).astype(np.float64),
+    )
+    range_group_columns = dict(
+        function=function_names[function_codes[order[group_starts]]].tolist(),
+        group_start=group_starts.astype(np.int32),
+        group_end=np.append(group_starts[1:], len(order)).astype(np.int32),
+    )
+
+    return range_stat_columns, range_group_columns
+
+
+def get_timeline_columns(trace, pixels_per_timeunit, func_to_color):
+    import numpy as np
+
     top_attributes = list()
     bottom_attributes = list()
     left_attributes = list()
@@ -156,10 +1891,13 @@ def fill_CDS_and_time_maps(trace, pixels_per_timeunit, func_to_color):
     color_attributes = list()
     function_names = list()
     duration_attributes = list()
+    durations = list()
     alpha_attributes = list()
     line_alpha_attributes = list()
     start_times = list()
     end_times = list()
+    repeats_attributes = list()
+    repeat_duration_attributes = list()
     ###
 
     bracket_x_attributes = list()
@@ -173,6 +1911,10 @@ def fill_CDS_and_time_maps(trace, pixels_per_timeunit, func_to_color):
 
     xcoord_to_time = deque()
 
+    has_folded_exprs = "repeats" in trace
+    has_folded_subtrees = "subtree" in trace
+    subtree_attributes = list()
+
     found_regtime_expr_start = False
 
     for index, trace_event in trace.iterrows():
@@ -199,9 +1941,9 @@ def fill_CDS_and_time_maps(trace, pixels_per_timeunit, func_to_color):
 
             left_attr = min_leftattr_at_callstack_depth[callstack_depth]
 
-            min_leftattr_at_callstack_depth[
-                callstack_depth + 1
-            ] = min_leftattr_at_callstack_depth[callstack_depth]
+            min_leftattr_at_callstack_depth[callstack_depth + 1] = (
+                min_leftattr_at_callstack_depth[callstack_depth]
+            )
 
             start_time_at_callstack_depth[callstack_depth] = trace_event["start_time"]
 
@@ -235,21 +1977,13 @@ def fill_CDS_and_time_maps(trace, pixels_per_timeunit, func_to_color):
                 function_name, (DEFAULT_FUNC_COLOR, 1)
             )
 
-            duration_in_range_of_secs = trace_event["duration"] / 1000000000 >= 1
-            duration_in_range_of_ms = trace_event["duration"] / 1000000 >= 1
+            duration_attr = format_duration(trace_event["duration"])
 
-            if duration_in_range_of_secs:
-                duration_attr = (
-                    str(round(trace_event["duration"] / 1000000000, 2)) + " seconds"
-                )
-
-            elif duration_in_range_of_ms:
-                duration_attr = (
-                    str(round(trace_event["duration"] / 1000000, 2)) + " milliseconds"
-                )
-
-            else:
-                duration_attr = str(trace_event["duration"]) + " nanoseconds"
+            repeats_attr = 1
+            repeat_duration_attr = ""
+            if has_folded_exprs and trace_event["repeats"] > 1:
+                repeats_attr = trace_event["repeats"]
+                repeat_duration_attr = format_repeat_durations(trace_event)
 
             if trace_event["event_type"] == EXIT_EVENTTYPE:
                 start_time = start_time_at_callstack_depth[callstack_depth]
@@ -259,6 +1993,10 @@ def fill_CDS_and_time_maps(trace, pixels_per_timeunit, func_to_color):
 
             end_time = trace_event["end_time"]
 
+            subtree_attr = -1
+            if has_folded_subtrees:
+                subtree_attr = trace_event["subtree"]
+
             top_attributes.append(top_attr)
             bottom_attributes.append(bottom_attr)
             left_attributes.append(left_attr)
@@ -266,10 +2004,14 @@ def fill_CDS_and_time_maps(trace, pixels_per_timeunit, func_to_color):
             color_attributes.append(color_attr)
             function_names.append(function_name)
             duration_attributes.append(duration_attr)
+            durations.append(trace_event["duration"])
             alpha_attributes.append(alpha_attr)
             start_times.append(start_time)
-            line_alpha_attributes.append(0)
+            line_alpha_attributes.append(1 if subtree_attr >= 0 else 0)
             end_times.append(end_time)
+            repeats_attributes.append(repeats_attr)
+            repeat_duration_attributes.append(repeat_duration_attr)
+            subtree_attributes.append(subtree_attr)
 
             min_leftattr_at_callstack_depth[callstack_depth] = right_attr + (
                 PIXELS_BTW_EVENTS / pixels_per_timeunit
@@ -348,24 +2090,49 @@ def fill_CDS_and_time_maps(trace, pixels_per_timeunit, func_to_color):
                     {"x": right_attr, "time": trace_event["end_time"]}
                 )
 
-    trace_event_CDS = ColumnDataSource(
-        data=dict(
-            top=top_attributes,
-            bottom=bottom_attributes,
-            left=left_attributes,
-            right=right_attributes,
-            color=color_attributes,
-            function=function_names,
-            duration=duration_attributes,
-            alpha=alpha_attributes,
-            line_alpha=line_alpha_attributes,
-            start_time=start_times,
-            end_time=end_times,
-        )
+    # Numeric columns are returned as arrays, which Bokeh serializes as binary
+    # buffers instead of one JSON number per rectangle.
+    trace_event_columns = dict(
+        top=np.array(top_attributes, dtype=np.int32),
+        bottom=np.array(bottom_attributes, dtype=np.float64),
+        left=np.array(left_attributes, dtype=np.float64),
+        right=np.array(right_attributes, dtype=np.float64),
+        color=color_attributes,
+        function=function_names,
+        duration=duration_attributes,
+        alpha=np.array(alpha_attributes, dtype=np.float64),
+        line_alpha=np.array(line_alpha_attributes, dtype=np.int32),
+        start_time=np.array(start_times, dtype=np.float64),
+        end_time=np.array(end_times, dtype=np.float64),
+        repeats=np.array(repeats_attributes, dtype=np.int32),
+        repeat_durations=repeat_duration_attributes,
+        subtree=np.array(subtree_attributes, dtype=np.int32),
     )
 
-    bracket_CDS = ColumnDataSource(
-        data=dict(xs=bracket_x_attributes, ys=bracket_y_attributes)
+    bracket_columns = dict(xs=bracket_x_attributes, ys=bracket_y_attributes)
+
+    range_stat_columns, range_group_columns = get_range_stat_columns(
+        trace_event_columns, durations
     )
 
-    return trace_event_CDS, bracket_CDS, xcoord_to_time
+    return (
+        trace_event_columns,
+        bracket_columns,
+        xcoord_to_time,
+        range_stat_columns,
+        range_group_columns,
+    )
+
+
+def fill_CDS_and_time_maps(trace, pixels_per_timeunit, func_to_color):
+    from bokeh.models import ColumnDataSource
+
+    trace_event_columns, bracket_columns, xcoord_to_time = get_timeline_columns(
+        trace, pixels_per_timeunit, func_to_color
+    )[:3]
+
+    return (
+        ColumnDataSource(data=trace_event_columns),
+        ColumnDataSource(data=bracket_columns),
+        xcoord_to_time,
+    )
@@ -0,0 +1,1766 @@
+from bokeh import events
+from bokeh.core.json_encoder import serialize_json
+from bokeh.core.serialization import Serializer
+from bokeh.core.templates import get_env
+from bokeh.document import Document
+from bokeh.embed import file_html, json_item
+from bokeh.embed.bundle import bundle_for_objs_and_resources
+from bokeh.layouts import row, column
+from bokeh.models import (
+    AutocompleteInput,
+    BoxAnnotation,
+    BoxSelectTool,
+    CDSView,
+    CheckboxGroup,
+    ColumnDataSource,
+    CustomJS,
+    DataTable,
+    Div,
+    Dropdown,
+    HoverTool,
+    FixedTicker,
+    HTMLTemplateFormatter,
+    IndexFilter,
+    LinearColorMapper,
+    MultiSelect,
+    NumberFormatter,
+    RadioButtonGroup,
+    Range1d,
+    TableColumn,
+)
+
+from bokeh.palettes import Category20, Viridis256
+from bokeh.plotting import figure
+from bokeh.resources import CDN, INLINE
+import base64
+import gzip
+from itertools import repeat
+import json
+from nonsequitur_lib import *
+import numpy as np
+import struct
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+THREAD_SOURCE_NAMES = [
+    "trace_events",
+    "brackets",
+    "xcoord_to_time",
+    "range_stats",
+    "range_groups",
+    "subtree_rows",
+]
+
+# Every timeline is a document of its own, so the callbacks cannot hold its
+# models as arguments. The page registers them once they are embedded, and
+# the callbacks look them up here.
+THREAD_MODELS_JS = """
+        const threads = window.nonsequitur_threads;
+        const plots = threads.plots;
+        const box_annotations = threads.box_annotations;
+        const traces_src = threads.traces_src;
+        const xcoord_to_time_maps = threads.xcoord_to_time_maps;
+        const range_stats = threads.range_stats;
+        const range_groups = threads.range_groups;
+        const subtree_srcs = threads.subtree_srcs;
+"""
+
+THREAD_EMBED_JS = """
+        (function(source_names){
+          const threads = {plots: [], box_annotations: [], sources: [],
+          traces_src: [], xcoord_to_time_maps: [], range_stats: [],
+          range_groups: [], subtree_srcs: []};
+          window.nonsequitur_threads = threads;
+
+          const items = JSON.parse(
+            document.getElementById('nonsequitur-thread-items').textContent);
+          const embedded = items.map((item, j) =>
+            Bokeh.embed.embed_item(item, 'nonsequitur-thread-' + j).then((views) => {
+              // Model IDs are only unique within a document, since the
+              // timelines are built in different processes.
+              const plot = views.get_by_id(item.root_id).model;
+              const doc = plot.document;
+              const sources = {};
+              for (const name of source_names){
+                const source = doc.get_model_by_name(name);
+                if (source != null){
+                  sources[name] = source;
+                }
+              }
+              return [plot, doc.get_model_by_name('box_annotation'), sources];
+            }));
+
+          // The timelines are registered together, in order, so the
+          // callbacks never see a thread whose neighbours are missing.
+          threads.ready = Promise.all(embedded).then((timelines) => {
+            for (const [plot, box_annotation, sources] of timelines){
+              threads.plots.push(plot);
+              threads.box_annotations.push(box_annotation);
+              threads.sources.push(sources);
+              threads.traces_src.push(sources['trace_events']);
+              threads.xcoord_to_time_maps.push(sources['xcoord_to_time']);
+              threads.range_stats.push(sources['range_stats']);
+              threads.range_groups.push(sources['range_groups']);
+              threads.subtree_srcs.push(sources['subtree_rows']);
+            }
+          });
+        })"""
+
+THREAD_PAGE_TEMPLATE = """
+{% extends base %}
+{% block contents %}
+{{ super() }}
+<div id="nonsequitur-threads">
+{% for i in range(num_of_threads) %}
+  <div id="nonsequitur-thread-{{ i }}"></div>
+{% endfor %}
+</div>
+<script type="application/json" id="nonsequitur-thread-items">
+{{ thread_items }}
+</script>
+<script type="text/javascript">
+{{ thread_embed_js }}({{ source_names }});
+</script>
+{% endblock %}
+"""
+
+TIME_MAP_JS = """
+        function to_x_coords(t0, t1, xcoord_to_time){
+          let x0 = null;
+          let x1 = null;
+        
+          for (let i = 0; i < xcoord_to_time['x'].length; i++){
+            if (x0 == null && t0 <= xcoord_to_time['time'][i]){
+              if (i == 0){
+                x0 = xcoord_to_time['x'][i];
+              } else {
+                x0 = ((t0 - xcoord_to_time['time'][i - 1]) /
+                (xcoord_to_time['time'][i] -
+                xcoord_to_time['time'][i - 1]) *
+                (xcoord_to_time['x'][i] -
+                xcoord_to_time['x'][i - 1])) +
+                xcoord_to_time['x'][i - 1];
+              }
+            }
+          
+            if (x1 == null && t1 <= xcoord_to_time['time'][i]){
+              x1 = ((t1 - xcoord_to_time['time'][i - 1]) /
+              (xcoord_to_time['time'][i] -
+              xcoord_to_time['time'][i - 1]) *
+              (xcoord_to_time['x'][i] -
+              xcoord_to_time['x'][i - 1])) +
+              xcoord_to_time['x'][i - 1];
+            }
+          
+            if (x0 != null && x1 != null){
+              return [x0, x1];
+            }
+          }
+        }
+      
+        function to_time_coords(x0, x1, xcoord_to_time){
+          let t0 = null;
+          let t1 = null;
+          for (let i = 0; i < xcoord_to_time['x'].length; i++){
+            if (t0 == null && x0 <= xcoord_to_time['x'][i]){
+              if (i == 0){
+                t0 = xcoord_to_time['time'][i];
+              } else {
+                t0 = ((x0 - xcoord_to_time['x'][i - 1]) /
+                (xcoord_to_time['x'][i] -
+                xcoord_to_time['x'][i - 1]) *
+                (xcoord_to_time['time'][i] -
+                xcoord_to_time['time'][i - 1])) +
+                xcoord_to_time['time'][i - 1]
+              }
+            }
+          
+            if (t1 == null && x1 <= xcoord_to_time['x'][i]){
+              t1 = ((x1 - xcoord_to_time['x'][i - 1]) /
+              (xcoord_to_time['x'][i] -
+              xcoord_to_time['x'][i - 1]) *
+              (xcoord_to_time['time'][i] -
+              xcoord_to_time['time'][i - 1])) +
+              xcoord_to_time['time'][i - 1];
+            }
+          
+            if (t0 != null && t1 != null){
+              return [t0, t1];
+            }
+          }
+        }
+"""
+
+
+PIN_INTERVAL_JS = """
+        function pin_interval(interval_start_time, interval_end_time){
+          for (let j = 0; j < box_annotations.length; j++){
+            const xcoord_to_time = xcoord_to_time_maps[j].data;
+            if (xcoord_to_time['x'].length == 0){
+              continue;
+            }
+
+            const x_coords = to_x_coords(interval_start_time,
+            interval_end_time,
+            xcoord_to_time);
+
+            let max_x_value =
+            xcoord_to_time['x'][xcoord_to_time['x'].length - 1];
+            let x_coord_0 = x_coords[0];
+            let x_coord_1 = x_coords[1];
+
+            if (x_coord_1 - x_coord_0 < min_annotation_width){
+              if (x_coord_0 + min_annotation_width > max_x_value){
+                x_coord_0-=min_annotation_width;
+
+              } else {
+                x_coord_1 = x_coord_0 + min_annotation_width;
+              }
+            }
+
+            box_annotations[j]['left'] = x_coord_0;
+            box_annotations[j]['right'] = x_coord_1;
+            box_annotations[j]['fill_color'] = "#E0AC28";
+            box_annotations[j]['fill_alpha'] = 0.3;
+            box_annotations[j]['line_alpha'] = 0;
+          }
+        }
+"""
+
+RANGE_STATS_JS = """
+        function add_time_in_range(trace_events, range_stats, range_groups,
+        lo_column, hi_column, a, b, weight, totals){
+          const lo = trace_events[lo_column];
+          const hi = trace_events[hi_column];
+          const order = range_stats['order'];
+          const cum_duration = range_stats['cum_duration'];
+          const cum_count = range_stats['cum_count'];
+          const prefix = (values, k) => (k > 0 ? values[k - 1] : 0);
+
+          for (let g = 0; g < range_groups['function'].length; g++){
+            const group_end = range_groups['group_end'][g];
+
+            // First rectangle of the group that ends after the interval
+            // starts, and first one that starts after the interval ends.
+            let i = range_groups['group_start'][g];
+            let i_end = group_end;
+            while (i < i_end){
+              const k = (i + i_end) >> 1;
+              if (hi[order[k]] > a){ i_end = k; } else { i = k + 1; }
+            }
+
+            let j = i;
+            let j_end = group_end;
+            while (j < j_end){
+              const k = (j + j_end) >> 1;
+              if (lo[order[k]] >= b){ j_end = k; } else { j = k + 1; }
+            }
+
+            if (i >= j){
+              continue;
+            }
+
+            let duration = prefix(cum_duration, j) - prefix(cum_duration, i);
+            const count = prefix(cum_count, j) - prefix(cum_count, i);
+
+            const cut = (k) => {
+              const width = hi[order[k]] - lo[order[k]];
+              if (width <= 0){
+                return 0;
+              }
+              const overlap = Math.min(hi[order[k]], b) - Math.max(lo[order[k]], a);
+              return (cum_duration[k] - prefix(cum_duration, k)) *
+              (1 - overlap / width);
+            };
+
+            let k = i;
+            for (; k < j && lo[order[k]] < a; k++){
+              duration -= cut(k);
+            }
+            for (let m = j - 1; m >= k && hi[order[m]] > b; m--){
+              duration -= cut(m);
+            }
+
+            const func = range_groups['function'][g];
+            if (!(func in totals)){
+              totals[func] = [0, 0];
+            }
+            totals[func][0] += weight * duration;
+            totals[func][1] += weight * count;
+          }
+        }
+
+        function update_range_table(){
+          const selection = range_selection.data;
+          if (selection['thread'].length == 0){
+            return;
+          }
+
+          const thread = selection['thread'][0];
+          const xcoord_to_time = xcoord_to_time_maps[thread].data;
+          if (xcoord_to_time['x'].length == 0){
+            return;
+          }
+
+          const min_x = xcoord_to_time['x'][0];
+          const max_x = xcoord_to_time['x'][xcoord_to_time['x'].length - 1];
+          const x0 = Math.max(selection['x0'][0], min_x);
+          const x1 = Math.min(selection['x1'][0], max_x);
+          const time_coords = to_time_coords(x0, x1, xcoord_to_time);
+          const t0 = time_coords[0];
+          const t1 = time_coords[1];
+
+          // Threads whose sidecar has not arrived are requested, and the
+          // table is computed again, at most every 200 ms, as they arrive.
+          const totals = {};
+          let threads_in_range = 0;
+          let pending_threads = 0;
+          for (let u = 0; u < traces_src.length; u++){
+            if (range_scope.active == 0 && u != thread){
+              continue;
+            }
+            if (traces_src[u].data['left'].length == 0){
+              if (window.nonsequitur_load_thread != null){
+                window.nonsequitur_load_thread(u);
+                pending_threads += 1;
+              }
+              continue;
+            }
+
+            // The selected timeline is answered in its own x coordinates, so
+            // the result matches the rectangles under the selection; other
+            // timelines are answered in time, as their x coordinates differ.
+            if (u == thread){
+              add_time_in_range(traces_src[u].data, range_stats[u].data,
+              range_groups[u].data, 'left', 'right', x0, x1, 1, totals);
+            } else {
+              add_time_in_range(traces_src[u].data, range_stats[u].data,
+              range_groups[u].data, 'start_time', 'end_time', t0, t1,
+              thread_weights[u], totals);
+            }
+            threads_in_range += (u == thread) ? 1 : thread_weights[u];
+          }
+
+          const ns_per_ms = 1000000;
+          const interval = Math.max(t1 - t0, 1);
+          const rows = Object.entries(totals).sort((p, q) => q[1][0] - p[1][0]);
+          range_table_src.data = {
+            function: rows.map((row) => row[0]),
+            duration: rows.map((row) => row[1][0] / ns_per_ms),
+            count: rows.map((row) => row[1][1]),
+            share: rows.map((row) =>
+            100 * row[1][0] / (interval * threads_in_range)),
+          };
+
+          let scope = 'thread ' + thread_labels[thread];
+          if (range_scope.active == 1){
+            scope = threads_in_range + ' threads';
+          }
+          if (pending_threads > 0){
+            const loaded_threads = traces_src.length - pending_threads;
+            scope += ' (partial: ' + loaded_threads + ' of ' +
+            traces_src.length + ' timelines loaded, updating as the rest ' +
+            'arrive)';
+            window.nonsequitur_thread_loaded = () => {
+              clearTimeout(window.nonsequitur_range_timer);
+              window.nonsequitur_range_timer = setTimeout(update_range_table, 200);
+            };
+          }
+          range_summary.text = 'Selected ' + (interval / ns_per_ms).toFixed(3) +
+          ' ms on ' + scope;
+        }
+"""
+
+SIDECAR_JS = """
+        function decode_sidecar(payload){
+          const bytes = Uint8Array.from(atob(payload), (c) => c.charCodeAt(0));
+          const buffer = bytes.buffer;
+          const header_length = new DataView(buffer).getUint32(0, true);
+          const header = JSON.parse(
+            new TextDecoder().decode(bytes.subarray(4, 4 + header_length)));
+          const data_start = Math.ceil((4 + header_length) / 8) * 8;
+
+          const sources = {};
+          for (const column of header){
+            if (!(column.source in sources)){
+              sources[column.source] = {};
+            }
+
+            let values = null;
+            if (column.kind == 'float64'){
+              values = new Float64Array(buffer, data_start + column.offset,
+              column.length);
+            } else if (column.kind == 'string'){
+              const codes = new Int32Array(buffer, data_start + column.offset,
+              column.length);
+              values = Array.from(codes, (code) => column.strings[code]);
+            } else {
+              const offsets = new Int32Array(buffer,
+              data_start + column.offsets_offset, column.length + 1);
+              const flat_values = new Float64Array(buffer,
+              data_start + column.offset, offsets[column.length]);
+              values = [];
+              for (let i = 0; i < column.length; i++){
+                values.push(flat_values.subarray(offsets[i], offsets[i + 1]));
+              }
+            }
+            sources[column.source][column.name] = values;
+          }
+          return sources;
+        }
+"""
+
+
+def encode_sidecar(sources):
+    # Numeric columns are stored as float64 arrays, string columns as int32
+    # codes into a string table in the header and list columns (the bracket
+    # lines) as flattened float64 values with int32 offsets. Block offsets
+    # are relative to the first 8 byte boundary after the header.
+    header = list()
+    blocks = list()
+    offset = 0
+
+    def add_block(block):
+        nonlocal offset
+        block_offset = offset
+        block += bytes(-len(block) % 8)
+        blocks.append(block)
+        offset += len(block)
+        return block_offset
+
+    for source_name, data in sources.items():
+        for column_name, values in data.items():
+            values = list(values)
+            column = {"source": source_name, "name": column_name}
+            column["length"] = len(values)
+
+            if len(values) > 0 and isinstance(values[0], str):
+                strings = sorted(set(values))
+                string_to_code = {string: code for code, string in enumerate(strings)}
+                codes = np.array([string_to_code[v] for v in values], dtype="<i4")
+                column["kind"] = "string"
+                column["strings"] = strings
+                column["offset"] = add_block(codes.tobytes())
+
+            elif len(values) > 0 and isinstance(values[0], (list, tuple)):
+                offsets = np.cumsum([0] + [len(v) for v in values], dtype="<i4")
+                flat_values = np.array(
+                    [x for v in values for x in v], dtype="<f8"
+                ).reshape(-1)
+                column["kind"] = "ragged"
+                column["offsets_offset"] = add_block(offsets.tobytes())
+                column["offset"] = add_block(flat_values.tobytes())
+
+            else:
+                column["kind"] = "float64"
+                column["offset"] = add_block(
+                    np.asarray(values, dtype="<f8").reshape(-1).tobytes()
+                )
+
+            header.append(column)
+
+    encoded_header = json.dumps(header).encode()
+    payload = struct.pack("<I", len(encoded_header)) + encoded_header
+    payload += bytes(-len(payload) % 8)
+    return payload + b"".join(blocks)
+
+
+def write_sidecar(sidecar_path, thread_index, sources):
+    payload = base64.b64encode(encode_sidecar(sources)).decode()
+
+    # The payload is wrapped in a script so that it also loads from a
+    # file:// URL, where fetching local files is blocked by browsers.
+    loader = "window.nonsequitur_sidecars[" + str(thread_index) + "]"
+    with open(sidecar_path, "w") as f:
+        f.write(loader + '("' + payload + '");\n')
+
+
+def get_sidecar_paths(title, num_of_threads):
+    sidecar_dir = title + "_data"
+    os.makedirs(sidecar_dir, exist_ok=True)
+
+    return [
+        join(sidecar_dir, "thread_" + str(i) + ".js") for i in range(num_of_threads)
+    ]
+
+
+def write_precompressed_variants(path):
+    with open(path, "rb") as f:
+        data = f.read()
+
+    # A static file server that serves precompressed files picks the variant
+    # the browser accepts. The gzip header carries no timestamp, so the same
+    # report always compresses to the same bytes.
+    file_sizes = {"bytes": len(data)}
+    compressed_data = gzip.compress(data, compresslevel=9, mtime=0)
+    with open(path + ".gz", "wb") as f:
+        f.write(compressed_data)
+    file_sizes["gzip"] = len(compressed_data)
+
+    if brotli != None:
+        compressed_data = brotli.compress(data)
+        with open(path + ".br", "wb") as f:
+            f.write(compressed_data)
+        file_sizes["brotli"] = len(compressed_data)
+
+    return file_sizes
+
+
+def get_source_payload_size(source):
+    # Sources are measured as they are embedded in the page, with NumPy
+    # columns as base64 buffers.
+    encoded_data = Serializer(deferred=False).encode(dict(source.data))
+    return len(json.dumps(encoded_data, separators=(",", ":")))
+
+
+def get_thread_payload_sizes(sources):
+    payload_sizes = {
+        name: get_source_payload_size(source) for name, source in sources.items()
+    }
+    payload_sizes["total"] = sum(payload_sizes.values())
+    return payload_sizes
+
+
+def get_bokehjs_size(report):
+    # Only the BokehJS bundles that the report's models need are inlined.
+    bundle = bundle_for_objs_and_resources([report], INLINE)
+    return sum(len(js) for js in bundle.js_raw)
+
+
+def write_payload_breakdown(
+    title, bokehjs_size, thread_payload_sizes, sidecar_files=None, executor=None
+):
+    html_sizes = write_precompressed_variants(title + ".html")
+    thread_data_size = sum(sizes["total"] for sizes in thread_payload_sizes)
+
+    if sidecar_files != None:
+        if executor != None:
+            sidecar_sizes = list(
+                executor.map(write_precompressed_variants, sidecar_files)
+            )
+        else:
+            sidecar_sizes = [
+                write_precompressed_variants(sidecar_file)
+                for sidecar_file in sidecar_files
+            ]
+
+        for sizes, file_sizes in zip(thread_payload_sizes, sidecar_sizes):
+            sizes["sidecar"] = file_sizes
+
+    # The thread data is only part of the page when it is not in sidecars.
+    page_thread_data_size = thread_data_size if sidecar_files == None else 0
+    payload_breakdown = {
+        "html": html_sizes,
+        "components": {
+            "bokehjs": bokehjs_size,
+            "thread_data": thread_data_size,
+            "layout_widgets_and_callbacks": html_sizes["bytes"]
+            - bokehjs_size
+            - page_thread_data_size,
+        },
+        "threads": sorted(
+            thread_payload_sizes, key=lambda sizes: sizes["total"], reverse=True
+        ),
+    }
+
+    with open(title + "_sizes.json", "w") as f:
+        json.dump(payload_breakdown, f, indent=2)
+
+    print(
+        "{}.html: {:.1f} MB, {:.1f} MB gzipped. BokehJS {:.1f} MB, thread data "
+        "{:.1f} MB{}".format(
+            title,
+            html_sizes["bytes"] / (1 << 20),
+            html_sizes["gzip"] / (1 << 20),
+            bokehjs_size / (1 << 20),
+            thread_data_size / (1 << 20),
+            " in sidecars" if sidecar_files != None else "",
+        )
+    )
+
+
+def create_sidecar_loader(sidecar_paths):
+    return CustomJS(
+        args=dict(sidecar_paths=sidecar_paths),
+        code=SIDECAR_JS + """
+        const threads = window.nonsequitur_threads;
+        window.nonsequitur_sidecars = {};
+        const requested = new Set();
+
+        function load_thread(j){
+          if (requested.has(j) || j >= threads.sources.length){
+            return;
+          }
+          requested.add(j);
+
+          window.nonsequitur_sidecars[j] = function(payload){
+            const sources = decode_sidecar(payload);
+            for (const name in sources){
+              threads.sources[j][name].data = sources[name];
+            }
+            if (window.nonsequitur_thread_loaded != null){
+              window.nonsequitur_thread_loaded(j);
+            }
+          };
+
+          const script = document.createElement('script');
+          script.src = sidecar_paths[j];
+          document.head.appendChild(script);
+        }
+        window.nonsequitur_load_thread = load_thread;
+
+        const observer = new IntersectionObserver((entries) => {
+          for (const entry of entries){
+            if (entry.isIntersecting){
+              load_thread(Number(entry.target.dataset.nonsequiturThread));
+            }
+          }
+        });
+
+        threads.ready.then(() => {
+          for (let j = 0; j < threads.plots.length; j++){
+            const view = Bokeh.index.find_one(threads.plots[j]);
+            if (view != null){
+              view.el.dataset.nonsequiturThread = j;
+              observer.observe(view.el);
+            } else {
+              load_thread(j);
+            }
+          }
+        });
+    """,
+    )
+
+
+def create_regression_table(deltas, key_column, key_title):
+    ns_per_ms = 1000000
+    regression_src = ColumnDataSource(
+        dict(
+            key=deltas[key_column].tolist(),
+            baseline_duration=(deltas["duration_baseline"] / ns_per_ms).tolist(),
+            duration=(deltas["duration"] / ns_per_ms).tolist(),
+            duration_delta=(deltas["duration_delta"] / ns_per_ms).tolist(),
+            duration_delta_pct=deltas["duration_delta_pct"].tolist(),
+            baseline_count=deltas["count_baseline"].tolist(),
+            count=deltas["count"].tolist(),
+            count_delta=deltas["count_delta"].tolist(),
+        )
+    )
+
+    ms_formatter = NumberFormatter(format="0,0.000")
+    pct_formatter = NumberFormatter(format="+0,0.0")
+    count_formatter = NumberFormatter(format="0,0")
+    columns = [
+        TableColumn(field="key", title=key_title),
+        TableColumn(
+            field="baseline_duration", title="Baseline (ms)", formatter=ms_formatter
+        ),
+        TableColumn(field="duration", title="Run (ms)", formatter=ms_formatter),
+        TableColumn(field="duration_delta", title="Delta (ms)", formatter=ms_formatter),
+        TableColumn(
+            field="duration_delta_pct", title="Delta %", formatter=pct_formatter
+        ),
+        TableColumn(
+            field="baseline_count", title="Baseline calls", formatter=count_formatter
+        ),
+        TableColumn(field="count", title="Run calls", formatter=count_formatter),
+        TableColumn(
+            field="count_delta", title="Calls delta", formatter=count_formatter
+        ),
+    ]
+
+    return DataTable(
+        source=regression_src, columns=columns, height=200, sizing_mode="stretch_width"
+    )
+
+
+def create_regression_tables(function_deltas, call_path_deltas):
+    return column(
+        create_regression_table(function_deltas, "function", "Function"),
+        create_regression_table(call_path_deltas, "call_path", "Call path"),
+        sizing_mode="stretch_width",
+    )
+
+
+def create_preview_banner(previews):
+    sampled_strata = sum(preview["sampled_strata"] for preview in previews)
+    strata = sum(preview["strata"] for preview in previews)
+
+    return Div(
+        text="<b>Approximate preview.</b> "
+        + str(sampled_strata)
+        + " of "
+        + str(strata)
+        + " strata of top-level calls were sampled across the threads ("
+        + str(round(100 * sampled_strata / strata, 1))
+        + "%). Function totals in the tooltips are scaled estimates \u00b1 one "
+        + "standard error. Gaps in the timelines are calls that were not sampled.",
+        sizing_mode="stretch_width",
+    )
+
+
+def create_outlier_table(outliers, trace_groups, min_annotation_width):
+    ns_per_ms = 1000000
+    outliers_src = ColumnDataSource(
+        dict(
+            thread=outliers["thread"].tolist(),
+            function=outliers["function"].tolist(),
+            duration=(outliers["duration"] / ns_per_ms).tolist(),
+            p50=(outliers["p50"] / ns_per_ms).tolist(),
+            p99=(outliers["p99"] / ns_per_ms).tolist(),
+            callstack_depth=outliers["callstack_depth"].tolist(),
+            start_time=outliers["start_time"].tolist(),
+            end_time=outliers["end_time"].tolist(),
+        )
+    )
+
+    ms_formatter = NumberFormatter(format="0,0.000")
+    columns = [TableColumn(field="thread", title="Thread")]
+
+    # Outliers are listed per thread, and the threads of a group are drawn on
+    # the group's timeline, so each row also names the timeline it is on.
+    if any(len(trace_group) > 1 for trace_group in trace_groups):
+        thread_to_timeline = dict()
+        for trace_group in trace_groups:
+            for i in trace_group:
+                thread_to_timeline[i + 1] = get_trace_group_label(trace_group)
+
+        outliers_src.data["timeline"] = [
+            thread_to_timeline[thread] for thread in outliers["thread"]
+        ]
+        columns.append(TableColumn(field="timeline", title="Timeline"))
+
+    columns += [
+        TableColumn(field="function", title="Function"),
+        TableColumn(field="duration", title="Duration (ms)", formatter=ms_formatter),
+        TableColumn(field="p50", title="Thread p50 (ms)", formatter=ms_formatter),
+        TableColumn(field="p99", title="Thread p99 (ms)", formatter=ms_formatter),
+        TableColumn(field="callstack_depth", title="Depth"),
+    ]
+    outlier_table = DataTable(
+        source=outliers_src, columns=columns, height=150, sizing_mode="stretch_width"
+    )
+
+    outliers_src.selected.js_on_change(
+        "indices",
+        CustomJS(
+            args=dict(
+                outliers_src=outliers_src,
+                min_annotation_width=min_annotation_width,
+            ),
+            code=TIME_MAP_JS + THREAD_MODELS_JS + PIN_INTERVAL_JS + """
+        const indices = outliers_src.selected.indices;
+        if (indices.length == 0){
+          return;
+        }
+
+        const interval_start_time = outliers_src.data['start_time'][indices[0]];
+        const interval_end_time = outliers_src.data['end_time'][indices[0]];
+
+        pin_interval(interval_start_time, interval_end_time);
+    """,
+        ),
+    )
+
+    return outlier_table
+
+
+def create_activity_heatmap(
+    activities,
+    thread_labels,
+    time_range,
+    thread_select,
+    min_annotation_width,
+):
+    execution_start_time = time_range.start
+    execution_end_time = time_range.end
+    busy_fraction, calls = get_activity_heatmap(
+        activities, execution_start_time, execution_end_time
+    )
+    num_of_threads = len(activities)
+
+    heatmap = figure(
+        title="Thread activity (fraction of time inside traced calls)",
+        tools=[],
+        toolbar_location=None,
+        width=TIMELINE_PX_WIDTH,
+        height=max(MIN_TIMELINE_PX_HEIGHT, min(num_of_threads * 8, 400)) + 30,
+    )
+    heatmap.x_range = time_range
+    heatmap.y_range = Range1d(num_of_threads, 0)
+    heatmap.xaxis.visible = False
+    heatmap.xgrid.visible = False
+    heatmap.ygrid.visible = False
+
+    if num_of_threads <= MAX_HEATMAP_THREAD_LABELS:
+        heatmap.yaxis.ticker = FixedTicker(
+            ticks=[i + 0.5 for i in range(num_of_threads)]
+        )
+        heatmap.yaxis.major_label_overrides = {
+            i + 0.5: thread_labels[i] for i in range(num_of_threads)
+        }
+    else:
+        heatmap.yaxis.visible = False
+
+    heatmap_src = ColumnDataSource(dict(image=[busy_fraction], calls=[calls]))
+    heatmap.image(
+        image="image",
+        x=execution_start_time,
+        y=0,
+        dw=execution_end_time - execution_start_time,
+        dh=num_of_threads,
+        color_mapper=LinearColorMapper(palette=Viridis256, low=0, high=1),
+        source=heatmap_src,
+    )
+    heatmap.add_tools(
+        HoverTool(tooltips=[("Busy", "@image{0.0%}"), ("Calls", "@calls{0,0}")])
+    )
+
+    heatmap.js_on_event(
+        events.Tap,
+        CustomJS(
+            args=dict(
+                thread_select=thread_select,
+                min_annotation_width=min_annotation_width,
+                num_of_threads=num_of_threads,
+                execution_start_time=execution_start_time,
+                bin_duration=(execution_end_time - execution_start_time) / HEATMAP_BINS,
+            ),
+            code=TIME_MAP_JS + THREAD_MODELS_JS + PIN_INTERVAL_JS + """
+        const j = Math.floor(cb_obj.y);
+        const heatmap_bin = Math.floor(
+          (cb_obj.x - execution_start_time) / bin_duration);
+        if (j < 0 || j >= num_of_threads || heatmap_bin < 0){
+          return;
+        }
+
+        thread_select.value = [j.toString()];
+
+        const interval_start_time = execution_start_time +
+        heatmap_bin * bin_duration;
+        pin_interval(interval_start_time, interval_start_time + bin_duration);
+    """,
+        ),
+    )
+
+    return heatmap
+
+
+def create_concurrency_panel(
+    concurrency,
+    func_to_color,
+    time_range,
+    min_annotation_width,
+):
+    bin_edges = np.linspace(time_range.start, time_range.end, TIMELINE_PX_WIDTH + 1)
+
+    panel = figure(
+        title="Threads inside function (peak per pixel)",
+        tools=[],
+        toolbar_location=None,
+        width=TIMELINE_PX_WIDTH,
+        height=200,
+    )
+    panel.x_range = time_range
+    panel.xaxis.visible = False
+    panel.xgrid.visible = False
+
+    step_data = dict(x=bin_edges[:-1])
+    functions = list(concurrency)
+    for i in range(len(functions)):
+        times, threads_inside = concurrency[functions[i]]
+        step_data["threads_" + str(i)] = get_peak_concurrency_in_bins(
+            times, threads_inside, bin_edges
+        ).astype(np.int32)
+
+    step_src = ColumnDataSource(step_data)
+    for i in range(len(functions)):
+        color, alpha = func_to_color.get(functions[i], (DEFAULT_FUNC_COLOR, 1))
+        step_renderer = panel.step(
+            x="x",
+            y="threads_" + str(i),
+            mode="after",
+            line_color=color,
+            line_width=2,
+            legend_label=functions[i],
+            source=step_src,
+        )
+        panel.add_tools(
+            HoverTool(
+                tooltips=[
+                    ("Function", functions[i]),
+                    ("Threads", "@threads_" + str(i)),
+                ],
+                renderers=[step_renderer],
+                mode="vline",
+            )
+        )
+
+    panel.legend.location = "top_left"
+    panel.legend.click_policy = "hide"
+
+    # Selecting a time range on the panel pins it on the timelines, whose x
+    # coordinates are compressed and so cannot share the panel's x range.
+    select_interval_tool = BoxSelectTool(dimensions="width", renderers=[])
+    panel.add_tools(select_interval_tool)
+    panel.toolbar.active_drag = select_interval_tool
+    panel.js_on_event(
+        events.SelectionGeometry,
+        CustomJS(
+            args=dict(min_annotation_width=min_annotation_width),
+            code=TIME_MAP_JS + THREAD_MODELS_JS + PIN_INTERVAL_JS + """
+        if (cb_obj.final){
+          pin_interval(cb_obj.geometry.x0, cb_obj.geometry.x1);
+        }
+    """,
+        ),
+    )
+
+    return panel
+
+
+def create_interval_handlers(min_annotation_width):
+    # The timelines live in their own documents and call these handlers, which
+    # reach the other timelines through the page's registry of thread models.
+    return CustomJS(
+        args=dict(min_annotation_width=min_annotation_width),
+        code=TIME_MAP_JS + THREAD_MODELS_JS + """
+        window.nonsequitur_show_interval = function(cb_data){
+          const trace_events = cb_data.renderer.data_source;
+          const indices = cb_data.index.indices;
+          for (let i = 0; i < indices.length; i++){
+            let interval_start_time = trace_events.data['start_time'][indices[0]];
+            let interval_end_time = trace_events.data['end_time'][indices[0]];
+            let x_coords = null;
+        
+            for (let j = 0; j < box_annotations.length; j++){
+              const xcoord_to_time = xcoord_to_time_maps[j].data;
+              if (xcoord_to_time['x'].length == 0){
+                continue;
+              }
+
+              x_coords = to_x_coords(interval_start_time,
+              interval_end_time,
+              xcoord_to_time);
+            
+              let min_x_value = xcoord_to_time['x'][0];
+              let max_x_value =
+              xcoord_to_time['x'][xcoord_to_time['x'].length - 1];
+              let x_coord_0 = x_coords[0];
+              let x_coord_1 = x_coords[1];
+            
+              if (box_annotations[j]['fill_color'] == "#009933"){
+                if (x_coord_1 - x_coord_0 < min_annotation_width){
+                  if (x_coord_0 + min_annotation_width > max_x_value){
+                    x_coord_0-=min_annotation_width;
+                  
+                  } else {
+                    x_coord_1 = x_coord_0 + min_annotation_width;
+                  }
+                }
+            
+                box_annotations[j]['left'] = x_coord_0;
+                box_annotations[j]['right'] = x_coord_1;
+                box_annotations[j]['fill_alpha'] = 0.1;
+                box_annotations[j]['line_alpha'] = 0;
+              }
+            }
+          }
+        };
+
+        window.nonsequitur_pin_interval = function(){
+          for (let i = 0; i < box_annotations.length; i++){
+            if (box_annotations[i]['fill_color'] == "#009933") {
+              box_annotations[i]['fill_color'] = "#E0AC28";
+              box_annotations[i]['fill_alpha'] = 0.3;
+            }
+          }
+        };
+
+        window.nonsequitur_unpin_interval = function(){
+          for (let i = 0; i < box_annotations.length; i++){
+            box_annotations[i]['fill_color'] = "#009933";
+            box_annotations[i]['fill_alpha'] = 0;
+          }
+        };
+    """,
+    )
+
+
+def create_range_stats_panel(thread_labels, thread_weights):
+    range_selection = ColumnDataSource(dict(thread=[], x0=[], x1=[]))
+    range_table_src = ColumnDataSource(
+        dict(function=[], duration=[], count=[], share=[])
+    )
+    range_scope = RadioButtonGroup(labels=["Selected thread", "All threads"], active=0)
+    range_summary = Div(text="Drag over a timeline to select an interval")
+
+    range_args = dict(
+        thread_labels=thread_labels,
+        thread_weights=thread_weights,
+        range_selection=range_selection,
+        range_table_src=range_table_src,
+        range_scope=range_scope,
+        range_summary=range_summary,
+    )
+
+    range_scope.js_on_change(
+        "active",
+        CustomJS(
+            args=range_args,
+            code=TIME_MAP_JS + THREAD_MODELS_JS + RANGE_STATS_JS + """
+        update_range_table();
+    """,
+        ),
+    )
+
+    # The timelines live in their own documents, so their selections reach
+    # this document's models through a handler installed when it is ready.
+    install_select_range = CustomJS(
+        args=range_args,
+        code=TIME_MAP_JS + THREAD_MODELS_JS + RANGE_STATS_JS + """
+        window.nonsequitur_select_range = function(thread, geometry){
+          if (thread >= traces_src.length){
+            return;
+          }
+
+          range_selection.data = {
+            thread: [thread],
+            x0: [geometry.x0],
+            x1: [geometry.x1],
+          };
+          update_range_table();
+        };
+    """,
+    )
+
+    columns = [
+        TableColumn(field="function", title="Function"),
+        TableColumn(
+            field="duration",
+            title="Time in interval (ms)",
+            formatter=NumberFormatter(format="0,0.000"),
+        ),
+        TableColumn(
+            field="count", title="Calls", formatter=NumberFormatter(format="0,0")
+        ),
+        TableColumn(
+            field="share",
+            title="% of interval",
+            formatter=NumberFormatter(format="0.0"),
+        ),
+    ]
+    range_table = DataTable(
+        source=range_table_src, columns=columns, height=200, sizing_mode="stretch_width"
+    )
+
+    return (
+        column(
+            row(range_scope, range_summary),
+            range_table,
+            sizing_mode="stretch_width",
+        ),
+        install_select_range,
+    )
+
+
+def create_subtree_table():
+    expanded_subtree_src = ColumnDataSource(dict(function=[], depth=[], duration=[]))
+
+    columns = [
+        TableColumn(field="function", title="Folded calls"),
+        TableColumn(field="depth", title="Depth"),
+        TableColumn(field="duration", title="Duration"),
+    ]
+    subtree_table = DataTable(
+        source=expanded_subtree_src,
+        columns=columns,
+        height=150,
+        sizing_mode="stretch_width",
+    )
+
+    install_expand_subtree = CustomJS(
+        args=dict(expanded_subtree_src=expanded_subtree_src),
+        code=THREAD_MODELS_JS + """
+        window.nonsequitur_expand_subtree = function(j, x, y){
+          if (j >= traces_src.length){
+            return;
+          }
+
+          const trace_events = traces_src[j].data;
+          let subtree = -1;
+          for (let i = 0; i < trace_events['subtree'].length; i++){
+            if (trace_events['subtree'][i] >= 0 &&
+            trace_events['left'][i] <= x &&
+            x <= trace_events['right'][i] &&
+            trace_events['top'][i] <= y &&
+            y <= trace_events['bottom'][i]){
+              subtree = trace_events['subtree'][i];
+              break;
+            }
+          }
+
+          if (subtree < 0){
+            return;
+          }
+
+          const subtree_rows = subtree_srcs[j].data;
+          const expanded_subtree = {function: [], depth: [], duration: []};
+          for (let i = 0; i < subtree_rows['subtree'].length; i++){
+            if (subtree_rows['subtree'][i] == subtree){
+              expanded_subtree['function'].push(subtree_rows['function'][i]);
+              expanded_subtree['depth'].push(subtree_rows['depth'][i]);
+              expanded_subtree['duration'].push(subtree_rows['duration'][i]);
+            }
+          }
+          expanded_subtree_src.data = expanded_subtree;
+        };
+    """,
+    )
+
+    return subtree_table, install_expand_subtree
+
+
+def render_thread_timeline(
+    thread_index,
+    trace,
+    plot_title,
+    func_to_color,
+    execution_start_time,
+    execution_end_time,
+    hover_tooltips,
+    estimated_totals=None,
+    folded_subtrees=None,
+    sidecar_path=None,
+    offline=False,
+):
+    pixels_per_timeunit = TIMELINE_PX_WIDTH / (
+        execution_end_time - execution_start_time
+    )
+    plot_x_range_start = execution_start_time
+    max_callstack_depth = trace.callstack_depth.max()
+
+    timelineplot = figure(
+        title=plot_title, tools=[], toolbar_location=None, width=TIMELINE_PX_WIDTH
+    )
+
+    timelineplot.xgrid.visible = False
+    timelineplot.xaxis.visible = False
+    timelineplot.ygrid.visible = False
+    timelineplot.yaxis.visible = False
+
+    timelineplot.y_range = Range1d(max_callstack_depth + 3, 0)
+
+    plot_height = max(
+        (max_callstack_depth + 2) * MIN_CALLSTACK_PX_HEIGHT, MIN_TIMELINE_PX_HEIGHT
+    )
+    timelineplot.height = plot_height
+
+    select_interval_tool = BoxSelectTool(dimensions="width")
+    timelineplot.add_tools(select_interval_tool)
+    timelineplot.toolbar.active_drag = select_interval_tool
+
+    (
+        trace_event_columns,
+        bracket_columns,
+        xcoord_to_time,
+        range_stat_columns,
+        range_group_columns,
+    ) = get_timeline_columns(trace, pixels_per_timeunit, func_to_color)
+    if estimated_totals != None:
+        estimated_total_of_function = format_estimated_totals(estimated_totals)
+        trace_event_columns["estimated_total"] = [
+            estimated_total_of_function.get(function, "")
+            for function in trace_event_columns["function"]
+        ]
+
+    # The sources are found by name once the timeline is embedded, since
+    # each timeline is a document of its own.
+    trace_event_CDS = ColumnDataSource(data=trace_event_columns, name="trace_events")
+    bracket_CDS = ColumnDataSource(data=bracket_columns, name="brackets")
+    sources = {
+        "trace_events": trace_event_CDS,
+        "brackets": bracket_CDS,
+        "range_stats": ColumnDataSource(data=range_stat_columns, name="range_stats"),
+        "range_groups": ColumnDataSource(data=range_group_columns, name="range_groups"),
+    }
+    if folded_subtrees != None:
+        sources["subtree_rows"] = ColumnDataSource(
+            get_folded_subtree_rows(folded_subtrees), name="subtree_rows"
+        )
+
+    last_trace_event_x_position = trace_event_CDS.data["right"][-1]
+    trace_end_time = trace["end_time"][len(trace) - 1]
+
+    if last_trace_event_x_position > execution_end_time:
+        scale_factor = float(trace_end_time - execution_start_time) / float(
+            execution_end_time - execution_start_time
+        )
+        scale_factor = max(scale_factor, 0.2)
+
+        plot_x_range_end = execution_start_time + (
+            (last_trace_event_x_position - execution_start_time) / scale_factor
+        )
+
+    else:
+        plot_x_range_end = execution_end_time
+
+    timelineplot.x_range = Range1d(plot_x_range_start, plot_x_range_end)
+
+    if xcoord_to_time[0]["time"] != execution_start_time:
+        xcoord_to_time.appendleft(
+            {"x": plot_x_range_start, "time": execution_start_time}
+        )
+
+    if xcoord_to_time[-1]["time"] != execution_end_time:
+        xcoord_to_time.append({"x": plot_x_range_end, "time": execution_end_time})
+
+    sources["xcoord_to_time"] = ColumnDataSource(
+        data=dict(
+            x=[point["x"] for point in xcoord_to_time],
+            time=[point["time"] for point in xcoord_to_time],
+        ),
+        name="xcoord_to_time",
+    )
+
+    trace_event_renderer = timelineplot.quad(
+        top="top",
+        bottom="bottom",
+        left="left",
+        right="right",
+        line_alpha="line_alpha",
+        fill_color="color",
+        fill_alpha="alpha",
+        line_color="black",
+        line_width=1,
+        source=trace_event_CDS,
+    )
+    trace_event_renderer.selection_glyph = None
+    trace_event_renderer.nonselection_glyph = None
+
+    timelineplot.multi_line(
+        xs="xs",
+        ys="ys",
+        line_width=1,
+        line_alpha=1,
+        line_color="black",
+        source=bracket_CDS,
+    )
+
+    box_annotation = BoxAnnotation(
+        left=execution_start_time,
+        fill_alpha=0,
+        fill_color="#009933",
+        name="box_annotation",
+    )
+
+    # The handlers are installed by the page, so that every timeline does
+    # not carry its own copy of their code.
+    hover_callback = CustomJS(code="""
+        window.nonsequitur_show_interval(cb_data);
+    """)
+    tap_callback = CustomJS(code="""
+        window.nonsequitur_pin_interval();
+    """)
+    doubletap_callback = CustomJS(code="""
+        window.nonsequitur_unpin_interval();
+    """)
+
+    hover_tooltip = HoverTool(
+        tooltips=hover_tooltips,
+        renderers=[trace_event_renderer],
+        callback=hover_callback,
+    )
+    timelineplot.add_tools(hover_tooltip)
+
+    timelineplot.add_layout(box_annotation)
+
+    timelineplot.js_on_event(events.Tap, tap_callback)
+    timelineplot.js_on_event(events.DoubleTap, doubletap_callback)
+    timelineplot.js_on_event(
+        events.SelectionGeometry,
+        CustomJS(
+            args=dict(thread=thread_index),
+            code="""
+        window.nonsequitur_select_range(thread, cb_obj.geometry);
+    """,
+        ),
+    )
+    if folded_subtrees != None:
+        timelineplot.js_on_event(
+            events.Tap,
+            CustomJS(
+                args=dict(thread=thread_index),
+                code="""
+        window.nonsequitur_expand_subtree(thread, cb_obj.x, cb_obj.y);
+    """,
+            ),
+        )
+
+    # Only the models the plot references are serialized with it, and the
+    # time map and the statistics sources are only read by the callbacks.
+    timelineplot.tags = list(sources.values())
+
+    timeline = {"functions": sorted(set(trace_event_columns["function"]))}
+    if offline:
+        timeline["payload_sizes"] = get_thread_payload_sizes(sources)
+
+    # A sidecar holds the columns and the page starts with empty ones.
+    if sidecar_path != None:
+        write_sidecar(
+            sidecar_path,
+            thread_index,
+            {name: dict(source.data) for name, source in sources.items()},
+        )
+        for source in sources.values():
+            source.data = {column: [] for column in source.data}
+
+    # The item is placed in a script element of the page, which must not
+    # contain "</script>", so "<" is escaped as JSON allows.
+    timeline["item"] = serialize_json(json_item(timelineplot)).replace("<", "\\u003c")
+    return timeline
+
+
+def render_timelines(
+    traces,
+    func_to_color,
+    title,
+    group_time_tolerance=None,
+    header=None,
+    outliers=None,
+    folded_subtrees=None,
+    execution_time_range=None,
+    sidecars=False,
+    activities=None,
+    concurrency=None,
+    executor=None,
+    estimated_totals=None,
+    trace_groups=None,
+    offline=False,
+):
+    execution_start_time, execution_end_time = get_execution_time_range(traces)
+    if execution_time_range != None:
+        execution_start_time = min(execution_start_time, execution_time_range[0])
+        execution_end_time = max(execution_end_time, execution_time_range[1])
+    assert (
+        execution_end_time >= execution_start_time
+    ), "Expected execution end time \
+  to be greater than the execution end time"
+
+    # Each group is drawn as one timeline of its first thread.
+    group_time_deviations = None
+    if trace_groups == None and group_time_tolerance != None:
+        trace_groups = group_identical_traces(
+            traces, execution_start_time, execution_end_time, group_time_tolerance
+        )
+        group_time_deviations = [
+            get_trace_group_time_deviation(traces, trace_group)
+            for trace_group in trace_groups
+        ]
+    elif trace_groups == None:
+        trace_groups = [[i] for i in range(len(traces))]
+
+    show_repeats = any("repeats" in trace for trace in traces)
+
+    time_range = Range1d(execution_start_time, execution_end_time)
+    pixels_per_timeunit = TIMELINE_PX_WIDTH / (
+        execution_end_time - execution_start_time
+    )
+    min_annotation_width = MIN_CALLSTACK_PX_WIDTH / pixels_per_timeunit
+    thread_labels = [get_trace_group_label(trace_group) for trace_group in trace_groups]
+
+    plot_titles = list()
+    for i in range(len(trace_groups)):
+        trace_group = trace_groups[i]
+        if len(trace_group) == 1:
+            plot_title = "Thread " + thread_labels[i]
+        else:
+            plot_title = "Threads " + thread_labels[i]
+
+        # Grouped threads may differ from the drawn one within the tolerance.
+        if group_time_deviations != None and len(trace_group) > 1:
+            plot_title += ", timestamps differ by up to " + format_duration(
+                group_time_deviations[i]
+            )
+        plot_titles.append(plot_title)
+
+    hover_tooltips = [("Function", "@function"), ("Duration", "@duration")]
+    if folded_subtrees != None:
+        hover_tooltips.append(("Folded subtree", "@subtree"))
+    if estimated_totals != None:
+        hover_tooltips.append(("Estimated total", "@estimated_total"))
+    if show_repeats:
+        hover_tooltips.append(("Repeats", "@repeats"))
+        hover_tooltips.append(("Min / mean / max", "@repeat_durations"))
+
+    sidecar_files = None
+    sidecar_paths = None
+    if sidecars:
+        sidecar_files = get_sidecar_paths(title, len(trace_groups))
+        sidecar_paths = [
+            os.path.basename(os.path.dirname(sidecar_file))
+            + "/"
+            + os.path.basename(sidecar_file)
+            for sidecar_file in sidecar_files
+        ]
+
+    # Every timeline is built and serialized on the workers as a standalone
+    # document of its own, with its data and its callbacks, so only the
+    # shared panels are built here. The page embeds the timelines next to
+    # them and registers their models for the shared callbacks.
+    timeline_args = (
+        range(len(trace_groups)),
+        [traces[trace_group[0]] for trace_group in trace_groups],
+        plot_titles,
+        repeat(func_to_color),
+        repeat(execution_start_time),
+        repeat(execution_end_time),
+        repeat(hover_tooltips),
+        [
+            None if estimated_totals == None else estimated_totals[trace_group[0]]
+            for trace_group in trace_groups
+        ],
+        [
+            None if folded_subtrees == None else folded_subtrees[trace_group[0]]
+            for trace_group in trace_groups
+        ],
+        repeat(None) if sidecar_files == None else sidecar_files,
+        repeat(offline),
+    )
+    if executor != None:
+        timelines = list(executor.map(render_thread_timeline, *timeline_args))
+    else:
+        timelines = list(map(render_thread_timeline, *timeline_args))
+
+    range_stats_panel, install_select_range = create_range_stats_panel(
+        thread_labels, [len(trace_group) for trace_group in trace_groups]
+    )
+
+    subtree_table = None
+    if folded_subtrees != None:
+        subtree_table, install_expand_subtree = create_subtree_table()
+
+    concurrency_panel = None
+    if concurrency != None and len(concurrency) > 0:
+        concurrency_panel = create_concurrency_panel(
+            concurrency, func_to_color, time_range, min_annotation_width
+        )
+
+    outlier_table = None
+    if outliers is not None and len(outliers) > 0:
+        outlier_table = create_outlier_table(
+            outliers, trace_groups, min_annotation_width
+        )
+
+    func_names = list(func_to_color.keys())
+    color_values = list()
+    opacity_values = list()
+    for color_and_opacity in list(func_to_color.values()):
+        color = color_and_opacity[0]
+        opacity = color_and_opacity[1]
+        color_values.append(color)
+        opacity_values.append(opacity)
+
+    trace_select_values = list()
+    thread_select_options = list()
+    for i in range(len(trace_groups)):
+        trace_select_values.append(str(i))
+        thread_select_options.append((str(i), thread_labels[i]))
+
+    thread_select = MultiSelect(
+        value=trace_select_values,
+        title="Thread ID",
+        height=150,
+        options=thread_select_options,
+    )
+
+    heatmap = None
+    if activities != None and all(activity != None for activity in activities):
+        heatmap = create_activity_heatmap(
+            [activities[trace_group[0]] for trace_group in trace_groups],
+            thread_labels,
+            time_range,
+            thread_select,
+            min_annotation_width,
+        )
+
+    # The legend source holds the color and opacity of every function, and
+    # the callbacks look them up there. The legend only shows the functions of
+    # the displayed threads through its view.
+    legend_data = {"func": func_names, "color": color_values, "opacity": opacity_values}
+    legend_src = ColumnDataSource(legend_data)
+    legend_filter = IndexFilter()
+    template = """                
+            <div style="background:<%= color %>; opacity:<%= opacity %>;">
+                &ensp;
+            </div>
+    """
+    formatter = HTMLTemplateFormatter(template=template)
+    columns = [
+        TableColumn(field="func", title="Function"),
+        TableColumn(field="color", title="Color", formatter=formatter),
+    ]
+    legend = DataTable(
+        source=legend_src,
+        view=CDSView(filter=legend_filter),
+        columns=columns,
+        height=150,
+        sizing_mode="stretch_width",
+    )
+
+    highlight_funcs = CustomJS(
+        args=dict(
+            legend_src=legend_src,
+            thread_select=thread_select,
+        ),
+        code=THREAD_MODELS_JS + """
+           const funcs_to_highlight = [];
+           const threads_being_displayed = thread_select.value;
+           const legend_indices = new Map();
+           for (let i = 0; i < legend_src.data['func'].length; i++){
+             legend_indices.set(legend_src.data['func'][i], i);
+           }
+           
+           // The outlines the timeline was drawn with (the folded subtrees)
+           // are copied before the first highlight and restored from the copy.
+           // Loading a sidecar replaces the columns, so it is copied again.
+           function get_base_line_alpha(source){
+             const line_alpha = source.data['line_alpha'];
+             const base_line_alpha = source.data['base_line_alpha'];
+             if (base_line_alpha == undefined ||
+             base_line_alpha.length != line_alpha.length){
+               source.data['base_line_alpha'] = Array.from(line_alpha);
+             }
+             return source.data['base_line_alpha'];
+           }
+           
+           for (const i of cb_obj.indices) {
+             const func_to_highlight = legend_src.data['func'][i].toString();
+             funcs_to_highlight.push(func_to_highlight);
+           }
+          
+           if (funcs_to_highlight.length > 0){
+             for (let i = 0; i < threads_being_displayed.length; i++){
+               let thread = threads_being_displayed[i];
+               if (thread >= traces_src.length){
+                 continue;
+               }
+               const funcs_in_thread = traces_src[thread].data['function'];
+               const base_line_alpha = get_base_line_alpha(traces_src[thread]);
+               for (let j = 0; j < funcs_in_thread.length; j++){
+                 let func = funcs_in_thread[j];
+                 if (funcs_to_highlight.indexOf(func) != -1){
+                   let alpha = legend_src.data['opacity'][legend_indices.get(func)];
+                   traces_src[thread].data['alpha'][j] = alpha;
+                   traces_src[thread].data['line_alpha'][j] = 1;   
+              
+                 } else {
+                   traces_src[thread].data['alpha'][j] = 0.2;
+                   traces_src[thread].data['line_alpha'][j] = base_line_alpha[j];
+                 }
+               }
+             
+               traces_src[thread].change.emit();
+             }
+           } else {
+               for (let i = 0; i < traces_src.length; i++){
+                 const funcs_in_thread = traces_src[i].data['function'];
+                 const base_line_alpha = get_base_line_alpha(traces_src[i]);
+                 for (let j = 0; j < funcs_in_thread.length; j++){
+                   let func = funcs_in_thread[j];
+                   let alpha = legend_src.data['opacity'][legend_indices.get(func)];
+                   traces_src[i].data['alpha'][j] = alpha;
+                   traces_src[i].data['line_alpha'][j] = base_line_alpha[j];
+                 }
+                 traces_src[i].change.emit();
+               }
+           }
+    """,
+    )
+    legend_src.selected.js_on_change("indices", highlight_funcs)
+
+    func_names = list(func_to_color.keys())
+    function_search = AutocompleteInput(
+        title="Enter a function name:",
+        completions=func_names,
+        sizing_mode="stretch_width",
+    )
+
+    # The legend holds the threads of every function, since the callbacks
+    # that list the functions of threads cannot read the timelines until
+    # they are embedded, or their sidecars until they are loaded.
+    function_threads = dict()
+    for i in range(len(timelines)):
+        for func in timelines[i]["functions"]:
+            function_threads.setdefault(func, list()).append(i)
+
+    legend_src.data["threads"] = [
+        function_threads.get(func, list()) for func in legend_src.data["func"]
+    ]
+
+    thread_select.js_on_change(
+        "value",
+        CustomJS(
+            args=dict(
+                function_search=function_search,
+                legend_src=legend_src,
+                legend_filter=legend_filter,
+            ),
+            code=THREAD_MODELS_JS + """
+           const function_names = new Set();
+           const legend_indices = [];
+           const highlighted_indices = legend_src.selected.indices;
+           const indices_of_highlighted_funcs = [];
+           
+           legend_src.selected.indices = [];
+           
+           const selected_threads = new Set(this.value.map(Number));
+           for (let j = 0; j < plots.length; j++){
+             plots[j].visible = selected_threads.has(j);
+           }
+         
+           const function_threads = legend_src.data['threads'];
+           for (let i = 0; i < function_threads.length; i++){
+             if (Array.from(function_threads[i]).some(
+               (thread) => selected_threads.has(thread))){
+               function_names.add(legend_src.data['func'][i]);
+             }
+           }
+           
+           for (let i = 0; i < legend_src.data['func'].length; i++){
+             if (function_names.has(legend_src.data['func'][i])){
+               legend_indices.push(i);
+             }
+           }
+           
+           for (const index of highlighted_indices){
+             if (function_names.has(legend_src.data['func'][index])){
+               indices_of_highlighted_funcs.push(index);
+             }
+           }
+           
+           legend_filter.indices = legend_indices;
+           legend_src.change.emit();
+           legend_src.selected.indices = indices_of_highlighted_funcs;
+           
+           function_search.value = '';
+
+    """,
+        ),
+    )
+
+    function_search.js_on_change(
+        "value",
+        CustomJS(
+            args=dict(
+                thread_select=thread_select,
+                legend_src=legend_src,
+            ),
+            code="""
+      let selected_func = this.value;
+
+      const threads_to_display = [];
+      const function_threads = legend_src.data['threads'];
+      
+      if (selected_func != ''){
+        const index = legend_src.data['func'].indexOf(selected_func);
+        if (index != -1){
+          for (const thread of function_threads[index]){
+            threads_to_display.push(thread.toString());
+          }
+        }
+        thread_select.value = threads_to_display;
+        this.value = selected_func;
+      }
+ 
+    """,
+        ),
+    )
+
+    if sidecars:
+        thread_select.js_on_change(
+            "value",
+            CustomJS(code="""
+        for (const j of this.value){
+          window.nonsequitur_load_thread(Number(j));
+        }
+    """),
+        )
+
+    widget_layout = row(
+        thread_select,
+        column(function_search, legend, sizing_mode="stretch_width"),
+        sizing_mode="scale_width",
+    )
+    report_layout = [widget_layout, range_stats_panel]
+    if subtree_table != None:
+        report_layout.insert(1, subtree_table)
+
+    if outlier_table != None:
+        report_layout.insert(1, outlier_table)
+
+    if concurrency_panel != None:
+        report_layout.insert(0, concurrency_panel)
+
+    if heatmap != None:
+        report_layout.insert(0, heatmap)
+
+    if header != None:
+        report_layout.insert(0, header)
+
+    report = column(report_layout, sizing_mode="scale_width")
+
+    # The timelines are embedded below the report. The handlers that the
+    # timelines call into are installed once this document is ready.
+    document = Document()
+    document.add_root(report)
+    document.js_on_event(
+        "document_ready", create_interval_handlers(min_annotation_width)
+    )
+    document.js_on_event("document_ready", install_select_range)
+    if subtree_table != None:
+        document.js_on_event("document_ready", install_expand_subtree)
+    if sidecars:
+        document.js_on_event("document_ready", create_sidecar_loader(sidecar_paths))
+
+    # The offline bundle inlines the minified BokehJS, so the page needs no
+    # network. The callbacks are part of the documents and always inlined.
+    resources = CDN
+    if offline:
+        resources = INLINE
+
+    with open(title + ".html", "w") as f:
+        f.write(
+            file_html(
+                document,
+                resources,
+                title,
+                template=get_env().from_string(THREAD_PAGE_TEMPLATE),
+                template_variables=dict(
+                    num_of_threads=len(timelines),
+                    thread_items="["
+                    + ",".join(timeline["item"] for timeline in timelines)
+                    + "]",
+                    thread_embed_js=THREAD_EMBED_JS,
+                    source_names=json.dumps(THREAD_SOURCE_NAMES),
+                ),
+            )
+        )
+
+    if offline:
+        thread_payload_sizes = list()
+        for i in range(len(timelines)):
+            payload_sizes = dict(thread=thread_labels[i])
+            payload_sizes.update(timelines[i]["payload_sizes"])
+            thread_payload_sizes.append(payload_sizes)
+
+        write_payload_breakdown(
+            title,
+            get_bokehjs_size(report),
+            thread_payload_sizes,
+            sidecar_files,
+            executor,
+        )
@@ -13,38 +13,25 @@ from tqdm import tqdm
 CallDurationThresh = 0.005
 CallGapThresh = 0.001
 TotalTimeFractionThresh = 0.02
+CHUNK_SIZE_IN_EVENTS = 50000
+
 
 class CallStackTreeNode:
-    def __init__(self, function=None, callstack_depth=None, total_duration=0):
+    def __init__(
+        self, function=None, callstack_depth=None, total_duration=0, call_path=-1
+    ):
         self.function = function
         self.callstack_depth = callstack_depth
         self.total_duration = total_duration
-        self.childnode_to_index = dict()
-        self.childnode_to_duration = dict()
-
-    def has_child_node(self, trace_event):
-        has_child_node = False
-
-        function = trace_event["function"]
-        child_node_index = self.childnode_to_index.get(function, -1)
-        if child_node_index > -1:
-            has_child_node = True
-
-        return has_child_node
-
-    def get_index_to_child_node(self, trace_event):
-        function = trace_event["function"]
-        return self.childnode_to_index[function]
-
-    def add_child_node(self, trace_event, index):
-        function = trace_event["function"]
-        self.childnode_to_index[function] = index
+        self.call_path = call_path
+        self.child_node_indices = list()
 
 
 class RegTimeVisualEncoding:
     def __init__(self):
         self.index_to_node_at_level = [0]
         self.callstack_tree = [CallStackTreeNode()]
+        self.call_path_to_node = dict()
         self.callstack_depth = None
         self.start_time = None
         self.end_time = None
@@ -54,31 +41,26 @@ class RegTimeVisualEncoding:
             self.start_time = event["start_time"]
             self.callstack_depth = event["callstack_depth"]
 
-        index_to_current_node = self.index_to_node_at_level[-1]
-        current_callstack_tree_node = self.callstack_tree[index_to_current_node]
-
+        # Every event of an expression shares the callers above the
+        # expression's callstack depth, so a call path identifies its node.
         if event["event_type"] != EXIT_EVENTTYPE:
-            if current_callstack_tree_node.has_child_node(event):
-                index_to_child_node = (
-                    current_callstack_tree_node.get_index_to_child_node(event)
-                )
-                self.callstack_tree[index_to_child_node].total_duration += event[
-                    "duration"
-                ]
-
-            else:
-                callstack_tree_node = CallStackTreeNode(
-                    event["function"], event["callstack_depth"], event["duration"]
-                )
-
-                current_callstack_tree_node.add_child_node(
-                    event, len(self.callstack_tree)
+            index_to_child_node = self.call_path_to_node.get(event["call_path"])
+            if index_to_child_node == None:
+                index_to_child_node = len(self.callstack_tree)
+                self.call_path_to_node[event["call_path"]] = index_to_child_node
+                self.callstack_tree[
+                    self.index_to_node_at_level[-1]
+                ].child_node_indices.append(index_to_child_node)
+                self.callstack_tree.append(
+                    CallStackTreeNode(
+                        event["function"],
+                        event["callstack_depth"],
+                        0,
+                        event["call_path"],
+                    )
                 )
-                self.callstack_tree.append(callstack_tree_node)
 
-            index_to_child_node = current_callstack_tree_node.get_index_to_child_node(
-                event
-            )
+            self.callstack_tree[index_to_child_node].total_duration += event["duration"]
             if event["event_type"] == ENTER_EVENTTYPE:
                 self.index_to_node_at_level.append(index_to_child_node)
 
@@ -113,7 +95,7 @@ class RegTimeVisualEncoding:
                 if not is_root_node:
                     previous_level = current_level
 
-                num_of_childnodes = len(current_callstack_tree_node.childnode_to_index)
+                num_of_childnodes = len(current_callstack_tree_node.child_node_indices)
                 has_child_nodes = num_of_childnodes > 0
                 if has_child_nodes:
                     if not is_root_node:
@@ -125,21 +107,16 @@ class RegTimeVisualEncoding:
                             "callstack_depth": current_callstack_tree_node.callstack_depth,
                             "duration": current_callstack_tree_node.total_duration,
                             "parens": 0,
+                            "call_path": current_callstack_tree_node.call_path,
                         }
 
                         trace.append(event)
 
                     node_indices_at_level.append(list())
 
-                    sorted_callstack_tree_child_nodes = sorted(
-                        current_callstack_tree_node.childnode_to_index.items(),
-                        key=lambda x: x[1],
-                        reverse=True,
-                    )
-                    for (
-                        child_function,
-                        index_to_child_node,
-                    ) in sorted_callstack_tree_child_nodes:
+                    for index_to_child_node in reversed(
+                        current_callstack_tree_node.child_node_indices
+                    ):
                         node_indices_at_level[current_level + 1].append(
                             index_to_child_node
                         )
@@ -155,6 +132,7 @@ class RegTimeVisualEncoding:
                         "callstack_depth": current_callstack_tree_node.callstack_depth,
                         "duration": current_callstack_tree_node.total_duration,
                         "parens": 0,
+                        "call_path": current_callstack_tree_node.call_path,
                     }
 
                     trace.append(event)
@@ -181,6 +159,7 @@ class RegTimeVisualEncoding:
                             "callstack_depth": current_callstack_tree_node.callstack_depth,
                             "duration": current_callstack_tree_node.total_duration,
                             "parens": 0,
+                            "call_path": current_callstack_tree_node.call_path,
                         }
 
                         trace.append(event)
@@ -280,61 +259,174 @@ def output_sanity_check(input_trace, output_trace):
             regtime_vis_encoding = None
 
 
-def regtime(input_trace):
+def regtime_step(trace_event, regtime_vis_encoding, output_trace, thread_duration):
+    started_regtime_expr = regtime_vis_encoding != None
+    if started_regtime_expr:
+        callstack_depth_out_of_range = (
+            trace_event["callstack_depth"] < regtime_vis_encoding.callstack_depth
+        )
+
+        event_with_long_duration = (
+            trace_event["event_type"] != EXIT_EVENTTYPE
+            and trace_event["duration"] >= CallDurationThresh * thread_duration
+        )
+
+        reached_max_time_interval = (
+            regtime_vis_encoding.end_time - regtime_vis_encoding.start_time
+            >= TotalTimeFractionThresh * thread_duration
+        )
+
+        encountered_idle_time = (
+            trace_event["start_time"] - regtime_vis_encoding.end_time
+            >= CallGapThresh * thread_duration
+        )
+
+        stop_regtime_expr = (
+            trace_event["callstack_depth"] == regtime_vis_encoding.callstack_depth
+            and trace_event["event_type"] != EXIT_EVENTTYPE
+            and (
+                event_with_long_duration
+                or reached_max_time_interval
+                or encountered_idle_time
+            )
+        ) or callstack_depth_out_of_range
+
+        if stop_regtime_expr:
+            regtime_vis_encoding.write_out(output_trace)
+            regtime_vis_encoding = None
+
+        else:
+            regtime_vis_encoding.add_event(trace_event)
+
+    started_regtime_expr = regtime_vis_encoding != None
+    if (
+        not started_regtime_expr
+        and trace_event["event_type"] != EXIT_EVENTTYPE
+        and trace_event["duration"] < CallDurationThresh * thread_duration
+    ):
+        regtime_vis_encoding = RegTimeVisualEncoding()
+        regtime_vis_encoding.add_event(trace_event)
+
+    elif not started_regtime_expr:
+        output_trace.append(trace_event)
+
+    return regtime_vis_encoding
+
+
+def get_chunk_boundaries(input_trace, chunk_size=None):
+    if chunk_size == None:
+        chunk_size = CHUNK_SIZE_IN_EVENTS
+
+    chunk_boundaries = [0]
+
+    index = chunk_size
+    while index < len(input_trace):
+        trace_event = input_trace[index]
+        at_callstack_depth_0 = (
+            trace_event["callstack_depth"] == 0
+            and trace_event["event_type"] != EXIT_EVENTTYPE
+        )
+
+        if at_callstack_depth_0:
+            chunk_boundaries.append(index)
+            index += chunk_size
+
+        else:
+            index += 1
+
+    chunk_boundaries.append(len(input_trace))
+    return chunk_boundaries
+
+
+def regtime_chunk(input_chunk, thread_duration):
+    output_chunk = list()
+    regtime_vis_encoding = None
+    encoding_start = None
+    encoding_starts = list()
+    output_lengths = list()
+
+    for index in range(len(input_chunk)):
+        next_regtime_vis_encoding = regtime_step(
+            input_chunk[index], regtime_vis_encoding, output_chunk, thread_duration
+        )
+
+        if next_regtime_vis_encoding == None:
+            encoding_start = None
+        elif next_regtime_vis_encoding is not regtime_vis_encoding:
+            encoding_start = index
+
+        regtime_vis_encoding = next_regtime_vis_encoding
+        encoding_starts.append(encoding_start)
+        output_lengths.append(len(output_chunk))
+
+    return output_chunk, encoding_starts, output_lengths, regtime_vis_encoding
+
+
+def stitch_regtime_chunks(input_chunks, chunk_results, thread_duration):
     output_trace = list()
     regtime_vis_encoding = None
-    thread_duration = input_trace[-1]["end_time"] - input_trace[0]["start_time"]
 
-    for trace_event in tqdm(input_trace):
-        started_regtime_expr = regtime_vis_encoding != None
-        if started_regtime_expr:
-            callstack_depth_out_of_range = (
-                trace_event["callstack_depth"] < regtime_vis_encoding.callstack_depth
+    for input_chunk, chunk_result in zip(input_chunks, chunk_results):
+        output_chunk, encoding_starts, output_lengths, chunk_vis_encoding = chunk_result
+
+        # An expression carried over from the previous chunk is replayed
+        # serially until the state matches the chunk that started empty.
+        encoding_start = -1 if regtime_vis_encoding != None else None
+        index = 0
+        in_sync = regtime_vis_encoding == None
+        while not in_sync and index < len(input_chunk):
+            next_regtime_vis_encoding = regtime_step(
+                input_chunk[index], regtime_vis_encoding, output_trace, thread_duration
             )
 
-            event_with_long_duration = (
-                trace_event["event_type"] != EXIT_EVENTTYPE
-                and trace_event["duration"] >= CallDurationThresh * thread_duration
-            )
+            if next_regtime_vis_encoding == None:
+                encoding_start = None
+            elif next_regtime_vis_encoding is not regtime_vis_encoding:
+                encoding_start = index
 
-            reached_max_time_interval = (
-                regtime_vis_encoding.end_time - regtime_vis_encoding.start_time
-                >= TotalTimeFractionThresh * thread_duration
-            )
+            regtime_vis_encoding = next_regtime_vis_encoding
+            in_sync = encoding_start == encoding_starts[index]
+            index += 1
 
-            encountered_idle_time = (
-                trace_event["start_time"] - regtime_vis_encoding.end_time
-                >= CallGapThresh * thread_duration
-            )
+        if in_sync:
+            chunk_output_start = output_lengths[index - 1] if index > 0 else 0
+            output_trace.extend(output_chunk[chunk_output_start:])
+            regtime_vis_encoding = chunk_vis_encoding
 
-            stop_regtime_expr = (
-                trace_event["callstack_depth"] == regtime_vis_encoding.callstack_depth
-                and trace_event["event_type"] != EXIT_EVENTTYPE
-                and (
-                    event_with_long_duration
-                    or reached_max_time_interval
-                    or encountered_idle_time
-                )
-            ) or callstack_depth_out_of_range
+    return output_trace, regtime_vis_encoding
 
-            if stop_regtime_expr:
-                regtime_vis_encoding.write_out(output_trace)
-                regtime_vis_encoding = None
 
-            else:
-                regtime_vis_encoding.add_event(trace_event)
+def regtime(input_trace, executor=None):
+    output_trace = list()
+    regtime_vis_encoding = None
+    thread_duration = input_trace[-1]["end_time"] - input_trace[0]["start_time"]
 
-        started_regtime_expr = regtime_vis_encoding != None
-        if (
-            not started_regtime_expr
-            and trace_event["event_type"] != EXIT_EVENTTYPE
-            and trace_event["duration"] < CallDurationThresh * thread_duration
-        ):
-            regtime_vis_encoding = RegTimeVisualEncoding()
-            regtime_vis_encoding.add_event(trace_event)
+    chunk_boundaries = None
+    if executor != None:
+        chunk_boundaries = get_chunk_boundaries(input_trace)
 
-        elif not started_regtime_expr:
-            output_trace.append(trace_event)
+    split_into_chunks = chunk_boundaries != None and len(chunk_boundaries) > 2
+    if split_into_chunks:
+        input_chunks = [
+            input_trace[chunk_start:chunk_end]
+            for chunk_start, chunk_end in zip(
+                chunk_boundaries[:-1], chunk_boundaries[1:]
+            )
+        ]
+
+        chunk_results = executor.map(
+            regtime_chunk, input_chunks, [thread_duration] * len(input_chunks)
+        )
+
+        output_trace, regtime_vis_encoding = stitch_regtime_chunks(
+            input_chunks, chunk_results, thread_duration
+        )
+
+    else:
+        for trace_event in tqdm(input_trace):
+            regtime_vis_encoding = regtime_step(
+                trace_event, regtime_vis_encoding, output_trace, thread_duration
+            )
 
     started_regtime_expr = regtime_vis_encoding != None
     if started_regtime_expr:
@@ -343,3 +435,147 @@ def regtime(input_trace):
     output_sanity_check(input_trace, output_trace)
     #    print("Compressed Length:" + str(len(output_trace)))
     return output_trace
+
+
+def get_regtime_units(trace, thread_duration):
+    regtime_units = list()
+
+    index = 0
+    while index < len(trace):
+        trace_event = trace[index]
+
+        if trace_event["parens"] == AGGREGATION_LEFTBOUND:
+            unit_end = index
+            while trace[unit_end]["parens"] != AGGREGATION_RIGHTBOUND:
+                unit_end += 1
+
+            regtime_units.append((index, unit_end + 1, True))
+            index = unit_end + 1
+
+        else:
+            # Calls left outside of RegTime expressions are long, so only the
+            # short ones that RegTime would have grouped are folded.
+            is_short_execute_event = (
+                trace_event["event_type"] == EXECUTE_EVENTTYPE
+                and trace_event["duration"] < CallDurationThresh * thread_duration
+            )
+            regtime_units.append((index, index + 1, is_short_execute_event))
+            index += 1
+
+    return regtime_units
+
+
+def get_unit_structure(regtime_unit):
+    return tuple((event["event_type"], event["call_path"]) for event in regtime_unit)
+
+
+def fold_sanity_check(output_trace, thread_duration):
+    for unit_start, unit_end, is_foldable in get_regtime_units(
+        output_trace, thread_duration
+    ):
+        event = output_trace[unit_start]
+        if unit_end - unit_start > 1 or event["repeats"] == 1:
+            continue
+
+        assert (
+            event["max_duration"] < CallDurationThresh * thread_duration
+        ), "long call folded"
+
+        assert (
+            event["end_time"] - event["start_time"]
+            < event["repeats"] * event["max_duration"]
+            + (event["repeats"] - 1) * CallGapThresh * thread_duration
+        ), "calls folded across idle time"
+
+
+def fold_repeated_exprs(input_trace):
+    output_trace = list()
+    folded_unit = None
+    folded_unit_structure = None
+    thread_duration = input_trace[-1]["end_time"] - input_trace[0]["start_time"]
+
+    for unit_start, unit_end, is_foldable in get_regtime_units(
+        input_trace, thread_duration
+    ):
+        regtime_unit = input_trace[unit_start:unit_end]
+
+        unit_structure = None
+        if is_foldable:
+            unit_structure = get_unit_structure(regtime_unit)
+
+        # Like a RegTime expression, a folded record stops at idle time, so
+        # repeats separated by a gap are drawn separately.
+        repeats_folded_unit = (
+            unit_structure != None
+            and unit_structure == folded_unit_structure
+            and regtime_unit[0]["start_time"] - folded_unit[0]["end_time"]
+            < CallGapThresh * thread_duration
+        )
+        if repeats_folded_unit:
+            for folded_event, trace_event in zip(folded_unit, regtime_unit):
+                folded_event["end_time"] = trace_event["end_time"]
+                folded_event["duration"] += trace_event["duration"]
+                folded_event["repeats"] += 1
+                folded_event["min_duration"] = min(
+                    folded_event["min_duration"], trace_event["duration"]
+                )
+                folded_event["max_duration"] = max(
+                    folded_event["max_duration"], trace_event["duration"]
+                )
+
+        else:
+            folded_unit = list()
+            for trace_event in regtime_unit:
+                folded_event = dict(trace_event)
+                folded_event["repeats"] = 1
+                folded_event["min_duration"] = trace_event["duration"]
+                folded_event["max_duration"] = trace_event["duration"]
+                folded_unit.append(folded_event)
+
+            output_trace.extend(folded_unit)
+            folded_unit_structure = unit_structure
+
+    output_sanity_check(input_trace, output_trace)
+    fold_sanity_check(output_trace, thread_duration)
+    return output_trace
+
+
+def cap_callstack_depth(input_trace, max_depth):
+    output_trace = list()
+    folded_subtrees = list()
+    folded_event = None
+
+    for trace_event in input_trace:
+        callstack_depth = trace_event["callstack_depth"]
+
+        if callstack_depth > max_depth:
+            folded_subtrees[-1].append(trace_event)
+
+        elif callstack_depth < max_depth or (
+            trace_event["event_type"] == EXECUTE_EVENTTYPE
+        ):
+            output_event = dict(trace_event)
+            output_event["subtree"] = -1
+            output_trace.append(output_event)
+
+        elif trace_event["event_type"] == ENTER_EVENTTYPE:
+            # The call keeps its inclusive duration as a single rectangle and
+            # its callees are kept aside so they can be expanded later.
+            folded_event = dict(trace_event)
+            folded_event["event_type"] = EXECUTE_EVENTTYPE
+            folded_event["subtree"] = len(folded_subtrees)
+            folded_subtrees.append(list())
+            output_trace.append(folded_event)
+
+        else:
+            folded_event["end_time"] = trace_event["end_time"]
+
+            if trace_event["parens"] == AGGREGATION_RIGHTBOUND:
+                if folded_event["parens"] == AGGREGATION_LEFTBOUND:
+                    folded_event["parens"] = 0
+                else:
+                    folded_event["parens"] = AGGREGATION_RIGHTBOUND
+
+            folded_event = None
+
+    return output_trace, folded_subtrees
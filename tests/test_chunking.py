@@ -0,0 +1,47 @@
+from concurrent.futures import ThreadPoolExecutor
+from config import ENTER, EXIT
+from traceFilter import get_chunk_offsets
+
+
+def write_trace(path):
+    lines = list()
+    time = 0
+    for i in range(200):
+        for depth in range(i % 5 + 1):
+            lines.append("{} f{} {}".format(ENTER, depth, time))
+            time += 1
+
+        for depth in reversed(range(i % 5 + 1)):
+            lines.append("{} f{} {}".format(EXIT, depth, time))
+            time += 1
+
+    path.write_text("\n".join(lines) + "\n")
+
+
+def get_depth_0_offsets(path):
+    depth_0_offsets = {0}
+    callstack_depth = 0
+    offset = 0
+    for line in path.read_bytes().splitlines(keepends=True):
+        offset += len(line)
+        callstack_depth += 1 if line.startswith(ENTER.encode()) else -1
+        if callstack_depth == 0:
+            depth_0_offsets.add(offset)
+
+    return depth_0_offsets, offset
+
+
+def test_chunk_offsets_are_at_callstack_depth_0(tmp_path):
+    tracefile_path = tmp_path / "trace.txt"
+    write_trace(tracefile_path)
+    depth_0_offsets, file_size = get_depth_0_offsets(tracefile_path)
+
+    with ThreadPoolExecutor(2) as executor:
+        for chunk_size in [64, 1000, 1 << 20]:
+            chunk_offsets = get_chunk_offsets(tracefile_path, executor, chunk_size)
+
+            assert chunk_offsets[0] == 0 and chunk_offsets[-1] == file_size
+            assert chunk_offsets == sorted(set(chunk_offsets))
+            assert all(offset in depth_0_offsets for offset in chunk_offsets)
+
+        assert len(get_chunk_offsets(tracefile_path, executor, 64)) > 10
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+from nonsequitur_lib import get_thread_signatures
+
+
+def make_trace_stats(call_paths):
+    return {
+        "call_path_stats": {
+            "call_path": call_paths,
+            "function": [call_path.split(";")[-1] for call_path in call_paths],
+            "duration": [1] * len(call_paths),
+        }
+    }
+
+
+def test_minhash_estimates_jaccard_similarity():
+    call_paths = ["main;f" + str(i) for i in range(200)]
+    call_path_sets = [call_paths[:100], call_paths[50:150], call_paths[:100]]
+    traces = [pd.DataFrame() for call_path_set in call_path_sets]
+    trace_stats = [make_trace_stats(call_path_set) for call_path_set in call_path_sets]
+
+    function_time_fractions, minhashes = get_thread_signatures(
+        traces, trace_stats, num_of_permutations=512
+    )
+
+    for i, j in [(0, 1), (0, 2), (1, 2)]:
+        exact = len(set(call_path_sets[i]) & set(call_path_sets[j])) / len(
+            set(call_path_sets[i]) | set(call_path_sets[j])
+        )
+        estimate = (minhashes[i] == minhashes[j]).mean()
+        assert abs(estimate - exact) < 0.1
+
+    assert np.all(minhashes < (1 << 31) - 1)
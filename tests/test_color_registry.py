@@ -0,0 +1,59 @@
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from nonsequitur_lib import (
+    DEFAULT_FUNC_COLOR,
+    assign_colors_from_registry,
+    define_color_palette,
+    read_color_file,
+)
+
+
+def make_traces(functions):
+    return [
+        pd.DataFrame(
+            {
+                "function": functions,
+                "duration": [1000] * len(functions),
+                "event_type": [0] * len(functions),
+                "callstack_depth": [0] * len(functions),
+            }
+        )
+    ]
+
+
+def assign_registry_colors(registry_file, prefix):
+    functions = [prefix + str(i) for i in range(5)]
+    return assign_colors_from_registry(make_traces(functions), registry_file)
+
+
+def test_fallback_colors_are_not_registered(tmp_path):
+    registry_file = str(tmp_path / "registry.txt")
+    num_of_colors = len(define_color_palette())
+    functions = ["f" + str(i) for i in range(num_of_colors + 5)]
+
+    func_to_color = assign_colors_from_registry(make_traces(functions), registry_file)
+
+    registered = read_color_file(registry_file)
+    assert len(registered) == num_of_colors
+    assert DEFAULT_FUNC_COLOR not in [color for color, alpha in registered.values()]
+    assert len(func_to_color) == len(functions)
+
+
+def test_concurrent_runs_share_the_registry(tmp_path):
+    registry_file = str(tmp_path / "registry.txt")
+
+    with ProcessPoolExecutor(4) as executor:
+        results = list(
+            executor.map(
+                assign_registry_colors,
+                [registry_file] * 4,
+                ["a", "b", "c", "d"],
+            )
+        )
+
+    registered = read_color_file(registry_file)
+    assert len(registered) == 20
+    assert len(set(registered.values())) == 20
+    for func_to_color in results:
+        for func, color in func_to_color.items():
+            assert registered[func] == color
@@ -0,0 +1,51 @@
+import pandas as pd
+from config import EXECUTE_EVENTTYPE
+from nonsequitur_lib import group_identical_traces, get_trace_group_time_deviation
+
+EXECUTION_TIME = 1000000
+
+
+def make_trace(offset):
+    events = [
+        {
+            "event_type": EXECUTE_EVENTTYPE,
+            "function": "f",
+            "callstack_depth": 0,
+            "parens": 0,
+            "start_time": start_time + offset,
+            "end_time": start_time + 1000 + offset,
+            "duration": 1000,
+        }
+        for start_time in range(0, EXECUTION_TIME, 100000)
+    ]
+    return pd.DataFrame(events)
+
+
+def test_threads_within_tolerance_are_grouped():
+    tolerance = 0.001
+    traces = [make_trace(0), make_trace(tolerance * EXECUTION_TIME)]
+
+    trace_groups = group_identical_traces(traces, 0, EXECUTION_TIME, tolerance)
+
+    assert trace_groups == [[0, 1]]
+    assert get_trace_group_time_deviation(traces, trace_groups[0]) == 1000
+
+
+def test_threads_just_outside_tolerance_are_not_grouped():
+    tolerance = 0.001
+    traces = [make_trace(0), make_trace(tolerance * EXECUTION_TIME + 1)]
+
+    trace_groups = group_identical_traces(traces, 0, EXECUTION_TIME, tolerance)
+
+    assert trace_groups == [[0], [1]]
+
+
+def test_threads_with_different_structure_are_not_grouped():
+    other_trace = make_trace(0)
+    other_trace.loc[0, "function"] = "g"
+
+    trace_groups = group_identical_traces(
+        [make_trace(0), other_trace], 0, EXECUTION_TIME
+    )
+
+    assert trace_groups == [[0], [1]]
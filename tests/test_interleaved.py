@@ -0,0 +1,81 @@
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from config import ENTER, EXIT
+import traceProcessing
+from nonsequitur_lib import compress_interleaved_trace_file, compress_trace_file
+
+THREAD_IDS = ["1", "2", "10"]
+
+
+def get_thread_calls(thread, num_of_calls):
+    calls = list()
+    time = thread
+    for i in range(num_of_calls):
+        lines = list()
+        for depth in range((i + thread) % 4 + 1):
+            lines.append("{} f{} {}".format(ENTER, depth, time))
+            time += 3
+
+        # g never takes any time, so it is dropped as a small function
+        lines.append("{} g {}".format(ENTER, time))
+        lines.append("{} g {}".format(EXIT, time))
+
+        for depth in reversed(range((i + thread) % 4 + 1)):
+            lines.append("{} f{} {}".format(EXIT, depth, time))
+            time += 2 + thread
+
+        calls.append(lines)
+
+    return calls
+
+
+def write_traces(tmp_path):
+    calls_in_threads = [
+        get_thread_calls(thread, 40 + 7 * thread) for thread in range(len(THREAD_IDS))
+    ]
+
+    interleaved_lines = list()
+    for i in range(max(len(calls) for calls in calls_in_threads)):
+        for thread_id, calls in zip(THREAD_IDS, calls_in_threads):
+            if i < len(calls):
+                interleaved_lines.extend(line + " " + thread_id for line in calls[i])
+
+    (tmp_path / "interleaved").mkdir()
+    interleaved_path = tmp_path / "interleaved" / "capture.txt"
+    interleaved_path.write_text("\n".join(interleaved_lines) + "\n")
+
+    tracefile_paths = list()
+    for thread_id, calls in zip(THREAD_IDS, calls_in_threads):
+        tracefile_path = tmp_path / ("capture.txt." + thread_id)
+        tracefile_path.write_text(
+            "\n".join(line for lines in calls for line in lines) + "\n"
+        )
+        tracefile_paths.append(str(tracefile_path))
+
+    return str(interleaved_path), tracefile_paths
+
+
+def test_interleaved_threads_match_their_own_files(tmp_path, monkeypatch):
+    interleaved_path, tracefile_paths = write_traces(tmp_path)
+    expected = [
+        ("capture.txt." + thread_id, compress_trace_file(tracefile_path))
+        for thread_id, tracefile_path in zip(THREAD_IDS, tracefile_paths)
+    ]
+    assert all(
+        "g" not in [event["function"] for event in trace]
+        for thread_name, (trace, trace_stats) in expected
+    )
+
+    # Small batches and buffers split every thread into many batches, cut both
+    # when a thread's batch is full and when the calls of all threads are
+    # flushed.
+    monkeypatch.setattr(traceProcessing, "INTERLEAVED_BATCH_LINES", 30)
+    monkeypatch.setattr(traceProcessing, "INTERLEAVED_BUFFER_LINES", 100)
+
+    assert pickle.dumps(compress_interleaved_trace_file(interleaved_path)) == (
+        pickle.dumps(expected)
+    )
+    with ThreadPoolExecutor(2) as executor:
+        assert pickle.dumps(
+            compress_interleaved_trace_file(interleaved_path, executor)
+        ) == pickle.dumps(expected)
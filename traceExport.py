@@ -0,0 +1,421 @@
+from config import (
+    ENTER,
+    ENTER_EVENTTYPE,
+    EXIT_EVENTTYPE,
+    AGGREGATION_LEFTBOUND,
+    AGGREGATION_RIGHTBOUND,
+)
+import json
+import os
+import pickle
+import struct
+from nonsequitur_lib import (
+    compress_trace_file,
+    compress_interleaved_trace_file,
+    format_duration,
+    get_trace_sources,
+    get_tracefilenames_in_directory,
+    is_compressed_trace_directory,
+)
+from traceFilter import apply_event_filter
+from traceProcessing import read_interleaved_batches
+
+CHROME_TRACE_FORMAT = "chrome"
+PERFETTO_TRACE_FORMAT = "perfetto"
+EXPORT_FORMATS = [CHROME_TRACE_FORMAT, PERFETTO_TRACE_FORMAT]
+EXPORT_PID = 1
+NS_PER_US = 1000
+
+# Field numbers of the Perfetto trace protos (protos/perfetto/trace/) that
+# the encoder below writes. Only the fields needed for thread tracks and
+# their slices are used, so no protobuf dependency is required.
+TRACE_PACKET = 1
+PACKET_TIMESTAMP = 8
+PACKET_SEQUENCE_ID = 10
+PACKET_TRACK_EVENT = 11
+PACKET_SEQUENCE_FLAGS = 13
+PACKET_TRACK_DESCRIPTOR = 60
+TRACK_UUID = 1
+TRACK_NAME = 2
+TRACK_PROCESS = 3
+TRACK_THREAD = 4
+PROCESS_PID = 1
+PROCESS_NAME = 6
+THREAD_PID = 1
+THREAD_TID = 2
+THREAD_NAME = 5
+EVENT_DEBUG_ANNOTATIONS = 4
+EVENT_TYPE = 9
+EVENT_TRACK_UUID = 11
+EVENT_NAME = 23
+EVENT_TYPE_SLICE_BEGIN = 1
+EVENT_TYPE_SLICE_END = 2
+ANNOTATION_INT_VALUE = 4
+ANNOTATION_DOUBLE_VALUE = 5
+ANNOTATION_STRING_VALUE = 6
+ANNOTATION_NAME = 10
+PROCESS_TRACK_UUID = 1
+SEQUENCE_ID = 1
+SEQ_INCREMENTAL_STATE_CLEARED = 1
+
+
+def encode_varint(value):
+    encoded = bytearray()
+    value &= (1 << 64) - 1
+    while value > 0x7F:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def encode_varint_field(field_number, value):
+    return encode_varint(field_number << 3) + encode_varint(value)
+
+
+def encode_bytes_field(field_number, value):
+    if isinstance(value, str):
+        value = value.encode()
+
+    return encode_varint(field_number << 3 | 2) + encode_varint(len(value)) + value
+
+
+def encode_double_field(field_number, value):
+    return encode_varint(field_number << 3 | 1) + struct.pack("<d", value)
+
+
+class ChromeTraceWriter:
+    def __init__(self, output_path):
+        self.output_file = open(output_path, "w")
+        self.output_file.write('{"displayTimeUnit":"ns","traceEvents":[\n')
+        self.num_of_events = 0
+
+    def write_event(self, event):
+        if self.num_of_events > 0:
+            self.output_file.write(",\n")
+
+        self.output_file.write(json.dumps(event, separators=(",", ":")))
+        self.num_of_events += 1
+
+    def add_process(self, process_name):
+        self.write_event(
+            {
+                "ph": "M",
+                "name": "process_name",
+                "pid": EXPORT_PID,
+                "args": {"name": process_name},
+            }
+        )
+
+    def add_thread(self, thread_id, thread_name):
+        self.write_event(
+            {
+                "ph": "M",
+                "name": "thread_name",
+                "pid": EXPORT_PID,
+                "tid": thread_id,
+                "args": {"name": thread_name},
+            }
+        )
+
+    def add_slice_event(self, thread_id, phase, time, name, args=None):
+        event = {
+            "ph": phase,
+            "name": name,
+            "pid": EXPORT_PID,
+            "tid": thread_id,
+            "ts": time / NS_PER_US,
+        }
+        if args != None:
+            event["args"] = args
+
+        self.write_event(event)
+
+    def begin_slice(self, thread_id, time, name, args=None):
+        self.add_slice_event(thread_id, "B", time, name, args)
+
+    def end_slice(self, thread_id, time, name):
+        self.add_slice_event(thread_id, "E", time, name)
+
+    def add_slice(self, thread_id, start_time, end_time, name, args=None):
+        event = {
+            "ph": "X",
+            "name": name,
+            "pid": EXPORT_PID,
+            "tid": thread_id,
+            "ts": start_time / NS_PER_US,
+            "dur": (end_time - start_time) / NS_PER_US,
+        }
+        if args != None:
+            event["args"] = args
+
+        self.write_event(event)
+
+    def close(self):
+        self.output_file.write("\n]}\n")
+        self.output_file.close()
+
+
+class PerfettoTraceWriter:
+    def __init__(self, output_path):
+        self.output_file = open(output_path, "wb")
+        self.num_of_packets = 0
+
+    def write_packet(self, packet):
+        packet += encode_varint_field(PACKET_SEQUENCE_ID, SEQUENCE_ID)
+        if self.num_of_packets == 0:
+            packet += encode_varint_field(
+                PACKET_SEQUENCE_FLAGS, SEQ_INCREMENTAL_STATE_CLEARED
+            )
+
+        self.num_of_packets += 1
+        self.output_file.write(encode_bytes_field(TRACE_PACKET, packet))
+
+    def add_process(self, process_name):
+        process = encode_varint_field(PROCESS_PID, EXPORT_PID) + encode_bytes_field(
+            PROCESS_NAME, process_name
+        )
+        track = encode_varint_field(
+            TRACK_UUID, PROCESS_TRACK_UUID
+        ) + encode_bytes_field(TRACK_PROCESS, process)
+        self.write_packet(encode_bytes_field(PACKET_TRACK_DESCRIPTOR, track))
+
+    def add_thread(self, thread_id, thread_name):
+        thread = (
+            encode_varint_field(THREAD_PID, EXPORT_PID)
+            + encode_varint_field(THREAD_TID, thread_id)
+            + encode_bytes_field(THREAD_NAME, thread_name)
+        )
+        track = (
+            encode_varint_field(TRACK_UUID, self.get_track_uuid(thread_id))
+            + encode_bytes_field(TRACK_NAME, thread_name)
+            + encode_bytes_field(TRACK_THREAD, thread)
+        )
+        self.write_packet(encode_bytes_field(PACKET_TRACK_DESCRIPTOR, track))
+
+    def get_track_uuid(self, thread_id):
+        return PROCESS_TRACK_UUID + thread_id
+
+    def encode_debug_annotation(self, name, value):
+        annotation = encode_bytes_field(ANNOTATION_NAME, name)
+        if isinstance(value, bool) or isinstance(value, int):
+            annotation += encode_varint_field(ANNOTATION_INT_VALUE, int(value))
+        elif isinstance(value, float):
+            annotation += encode_double_field(ANNOTATION_DOUBLE_VALUE, value)
+        else:
+            annotation += encode_bytes_field(ANNOTATION_STRING_VALUE, str(value))
+
+        return encode_bytes_field(EVENT_DEBUG_ANNOTATIONS, annotation)
+
+    def add_track_event(self, thread_id, time, event_type, name=None, args=None):
+        track_event = encode_varint_field(EVENT_TYPE, event_type) + encode_varint_field(
+            EVENT_TRACK_UUID, self.get_track_uuid(thread_id)
+        )
+        if name != None:
+            track_event += encode_bytes_field(EVENT_NAME, name)
+
+        if args != None:
+            for arg_name, value in args.items():
+                track_event += self.encode_debug_annotation(arg_name, value)
+
+        self.write_packet(
+            encode_varint_field(PACKET_TIMESTAMP, int(time))
+            + encode_bytes_field(PACKET_TRACK_EVENT, track_event)
+        )
+
+    def begin_slice(self, thread_id, time, name, args=None):
+        self.add_track_event(thread_id, time, EVENT_TYPE_SLICE_BEGIN, name, args)
+
+    def end_slice(self, thread_id, time, name):
+        self.add_track_event(thread_id, time, EVENT_TYPE_SLICE_END)
+
+    def add_slice(self, thread_id, start_time, end_time, name, args=None):
+        self.begin_slice(thread_id, start_time, name, args)
+        self.end_slice(thread_id, end_time, name)
+
+    def close(self):
+        self.output_file.close()
+
+
+def create_trace_writer(output_path, export_format):
+    if export_format == PERFETTO_TRACE_FORMAT:
+        return PerfettoTraceWriter(output_path)
+
+    return ChromeTraceWriter(output_path)
+
+
+def get_repeat_args(trace_event, args):
+    if trace_event.get("repeats", 1) > 1:
+        args["repeats"] = int(trace_event["repeats"])
+        args["min_duration"] = int(trace_event["min_duration"])
+        args["max_duration"] = int(trace_event["max_duration"])
+
+    return args
+
+
+def get_regtime_expr_slice(regtime_expr):
+    # Every event of a RegTime expression spans the whole expression and
+    # carries the total duration of its node in the expression's call tree,
+    # so the expression is exported as one aggregated slice whose arguments
+    # list that tree.
+    base_callstack_depth = min(event["callstack_depth"] for event in regtime_expr)
+    base_functions = list()
+    total_duration = 0
+    call_tree = list()
+
+    for event in regtime_expr:
+        if event["event_type"] == EXIT_EVENTTYPE:
+            continue
+
+        indent = event["callstack_depth"] - base_callstack_depth
+        call_tree.append(
+            "  " * indent
+            + event["function"]
+            + ": "
+            + format_duration(event["duration"])
+        )
+
+        if event["callstack_depth"] == base_callstack_depth:
+            total_duration += event["duration"]
+            if event["function"] not in base_functions:
+                base_functions.append(event["function"])
+
+    args = get_repeat_args(
+        regtime_expr[0],
+        {"total_duration": int(total_duration), "call_tree": "\n".join(call_tree)},
+    )
+    return (
+        regtime_expr[0]["start_time"],
+        regtime_expr[0]["end_time"],
+        "RegTime " + " | ".join(base_functions),
+        args,
+    )
+
+
+def export_compressed_trace(writer, thread_id, trace):
+    regtime_expr = None
+
+    for trace_event in trace:
+        if trace_event["parens"] == AGGREGATION_LEFTBOUND:
+            regtime_expr = list()
+
+        if regtime_expr != None:
+            regtime_expr.append(trace_event)
+
+            if trace_event["parens"] == AGGREGATION_RIGHTBOUND:
+                writer.add_slice(thread_id, *get_regtime_expr_slice(regtime_expr))
+                regtime_expr = None
+
+        elif trace_event["event_type"] == ENTER_EVENTTYPE:
+            writer.begin_slice(
+                thread_id, trace_event["start_time"], trace_event["function"]
+            )
+
+        elif trace_event["event_type"] == EXIT_EVENTTYPE:
+            writer.end_slice(
+                thread_id, trace_event["end_time"], trace_event["function"]
+            )
+
+        elif (
+            trace_event["end_time"] - trace_event["start_time"]
+            > trace_event["duration"]
+        ):
+            writer.add_slice(thread_id, *get_regtime_expr_slice([trace_event]))
+
+        else:
+            writer.add_slice(
+                thread_id,
+                trace_event["start_time"],
+                trace_event["end_time"],
+                trace_event["function"],
+                get_repeat_args(trace_event, dict()) or None,
+            )
+
+
+def export_raw_trace(writer, thread_id, lines, event_filter=None):
+    # Raw events are written as they are read, so only one line of the
+    # thread is held in memory.
+    for line in apply_event_filter(lines, event_filter):
+        direction, function, time = line.split(" ", 2)
+        if direction == ENTER:
+            writer.begin_slice(thread_id, int(time), function)
+        else:
+            writer.end_slice(thread_id, int(time), function)
+
+
+def export_trace_directory(
+    dir,
+    output_path,
+    export_format=CHROME_TRACE_FORMAT,
+    raw=False,
+    executor=None,
+    fold=False,
+    event_filter=None,
+):
+    writer = create_trace_writer(output_path, export_format)
+    writer.add_process(os.path.basename(os.path.normpath(dir)))
+
+    # Threads are exported one at a time, so at most one compressed thread
+    # is in memory while the output is written, or the threads of one
+    # interleaved file, which are compressed together.
+    if is_compressed_trace_directory(dir):
+        assert not raw, "Compressed traces do not keep the raw events"
+        tracefile_names = get_tracefilenames_in_directory(dir, event_filter)
+
+        for thread_id in range(1, len(tracefile_names) + 1):
+            with open(os.path.join(dir, tracefile_names[thread_id - 1]), "rb") as f:
+                compressed_trace = pickle.load(f)
+
+            writer.add_thread(thread_id, compressed_trace["tracefile_name"])
+            export_compressed_trace(writer, thread_id, compressed_trace["trace"])
+
+    else:
+        thread_id = 0
+        for tracefile_path, interleaved in get_trace_sources(dir, event_filter):
+            tracefile_name = os.path.basename(tracefile_path)
+
+            if not interleaved:
+                thread_id += 1
+                writer.add_thread(thread_id, tracefile_name)
+
+                if raw:
+                    with open(tracefile_path, "r") as f:
+                        export_raw_trace(writer, thread_id, f, event_filter)
+
+                else:
+                    trace, trace_stats = compress_trace_file(
+                        tracefile_path, executor, fold, event_filter
+                    )
+                    export_compressed_trace(writer, thread_id, trace)
+
+            elif raw:
+                # The file is streamed once in batches of whole calls, so its
+                # threads are numbered in the order they first appear.
+                thread_ids = dict()
+                for interleaved_thread_id, stratum, lines in read_interleaved_batches(
+                    tracefile_path, event_filter
+                ):
+                    if interleaved_thread_id not in thread_ids:
+                        thread_id += 1
+                        thread_ids[interleaved_thread_id] = thread_id
+                        writer.add_thread(
+                            thread_id, tracefile_name + "." + interleaved_thread_id
+                        )
+
+                    export_raw_trace(
+                        writer, thread_ids[interleaved_thread_id], lines, event_filter
+                    )
+
+            else:
+                for thread_name, (
+                    trace,
+                    trace_stats,
+                ) in compress_interleaved_trace_file(
+                    tracefile_path, executor, fold, event_filter
+                ):
+                    thread_id += 1
+                    writer.add_thread(thread_id, thread_name)
+                    export_compressed_trace(writer, thread_id, trace)
+
+    writer.close()
@@ -1,63 +1,320 @@
 import argparse
+import bisect
+from collections import deque
 from config import ENTER, EXIT, ENTER_EVENTTYPE, EXECUTE_EVENTTYPE, EXIT_EVENTTYPE
 import copy
+import heapq
+import math
 import os
 from os.path import dirname, join
-import pandas as pd
 import pickle
 import re
-from traceProcessing import process_line_from_trace, get_file_size
+from traceProcessing import (
+    process_line_from_trace,
+    get_file_size,
+    get_interleaved_thread_sort_key,
+    read_interleaved_batches,
+    CallPathTrie,
+)
 from tqdm import tqdm
 
 THRESHOLD = 0
+CHUNK_SIZE_IN_BYTES = 1 << 22
+TOP_K_SLOWEST_INVOCATIONS = 10
+DEPTH_INDEX_BLOCK_SIZE_IN_BYTES = 1 << 16
+PREVIEW_NUM_OF_STRATA = 1000
+PREVIEW_MIN_STRATUM_SIZE_IN_BYTES = 1 << 12
+MAX_PENDING_BATCHES = 64
+
+
+def get_chunk_depth_changes(tracefile_path, start_offset, end_offset):
+    # The callstack depth at start_offset is not known here, so the depth is
+    # tracked relative to it. The first offset where the relative depth
+    # reaches each new minimum -k is where the absolute depth is 0 if the
+    # chunk starts at depth k.
+    depth_change = 0
+    minimum_offsets = [start_offset]
+    offset = start_offset
+    enter_direction = ENTER.encode()
+
+    with open(tracefile_path, "rb") as f:
+        f.seek(start_offset)
+        lines = f.read(end_offset - start_offset).splitlines(keepends=True)
+
+    for line in lines:
+        offset += len(line)
+
+        if line.startswith(enter_direction):
+            depth_change += 1
+        else:
+            depth_change -= 1
+
+            if -depth_change == len(minimum_offsets):
+                minimum_offsets.append(offset)
+
+    return depth_change, minimum_offsets
+
+
+def get_chunk_offsets(tracefile_path, executor, chunk_size=None):
+    if chunk_size == None:
+        chunk_size = CHUNK_SIZE_IN_BYTES
+
+    # The file is cut at evenly spaced line starts, found with one seek each,
+    # and the workers scan the pieces for their depth changes. Summing the
+    # changes gives the depth at every cut, so each chunk boundary moves to
+    # the first point at callstack depth 0 in its piece without a serial
+    # pass over the file.
+    file_size = get_file_size(tracefile_path)
+    line_offsets = [0]
+    with open(tracefile_path, "rb") as f:
+        for offset in range(chunk_size, file_size, chunk_size):
+            f.seek(offset - 1)
+            f.readline()
+            if f.tell() > line_offsets[-1] and f.tell() < file_size:
+                line_offsets.append(f.tell())
+
+    line_offsets.append(file_size)
+
+    num_of_pieces = len(line_offsets) - 1
+    piece_results = executor.map(
+        get_chunk_depth_changes,
+        [tracefile_path] * num_of_pieces,
+        line_offsets[:-1],
+        line_offsets[1:],
+    )
+
+    chunk_offsets = [0]
+    callstack_depth = 0
+    for depth_change, minimum_offsets in piece_results:
+        if callstack_depth < len(minimum_offsets):
+            chunk_offset = minimum_offsets[callstack_depth]
+            if chunk_offset > chunk_offsets[-1] and chunk_offset < file_size:
+                chunk_offsets.append(chunk_offset)
+
+        callstack_depth += depth_change
+
+    chunk_offsets.append(file_size)
+    return chunk_offsets
+
+
+def get_depth_index(tracefile_path, block_size=DEPTH_INDEX_BLOCK_SIZE_IN_BYTES):
+    # Blocks are extended to the end of their last line, so that the lines of
+    # a block are counted without parsing them and the callstack depth at
+    # the start of every block is known after one pass over the bytes.
+    block_offsets = list()
+    block_depths = list()
+    callstack_depth = 0
+    offset = 0
+    enter_line_start = ("\n" + ENTER + " ").encode()
+    enter_file_start = (ENTER + " ").encode()
+
+    with open(tracefile_path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if len(block) == 0:
+                break
+
+            block += f.readline()
+            block_offsets.append(offset)
+            block_depths.append(callstack_depth)
+
+            num_of_lines = block.count(b"\n") + (not block.endswith(b"\n"))
+            num_of_enters = block.count(enter_line_start) + block.startswith(
+                enter_file_start
+            )
+            callstack_depth += 2 * num_of_enters - num_of_lines
+            offset += len(block)
+
+    return block_offsets, block_depths, offset
+
+
+def get_preview_strata(size_in_bytes, sample_rate):
+    stratum_size = max(
+        size_in_bytes / PREVIEW_NUM_OF_STRATA, PREVIEW_MIN_STRATUM_SIZE_IN_BYTES
+    )
+    num_of_strata = max(math.ceil(size_in_bytes / stratum_size), 1)
+    num_of_samples = min(max(round(sample_rate * num_of_strata), 2), num_of_strata)
+
+    # The strata are sampled at even steps so that the preview covers the
+    # whole execution and the same strata are picked on every run.
+    step = num_of_strata / num_of_samples
+    sampled_strata = sorted(
+        set(int(step * i + step / 2) for i in range(num_of_samples))
+    )
+
+    return num_of_strata, [
+        (
+            round(stratum * size_in_bytes / num_of_strata),
+            round((stratum + 1) * size_in_bytes / num_of_strata),
+        )
+        for stratum in sampled_strata
+    ]
+
+
+def read_top_level_calls(tracefile_path, depth_index, start_offset, end_offset):
+    # Returns the lines of the calls at callstack depth 0 whose first line
+    # starts within [start_offset, end_offset), so that every top-level call
+    # belongs to exactly one stratum.
+    block_offsets, block_depths = depth_index[:2]
+    if len(block_offsets) == 0:
+        return list()
+
+    block = bisect.bisect_right(block_offsets, start_offset) - 1
+    offset = block_offsets[block]
+    callstack_depth = block_depths[block]
+    enter_direction = ENTER.encode()
+    in_stratum = False
+    lines = list()
+
+    with open(tracefile_path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if callstack_depth == 0 and offset >= end_offset:
+                break
+
+            if callstack_depth == 0 and offset >= start_offset:
+                in_stratum = True
+
+            if in_stratum:
+                lines.append(line.decode().rstrip("\r\n"))
+
+            offset += len(line)
+            if line.startswith(enter_direction):
+                callstack_depth += 1
+            else:
+                callstack_depth -= 1
+
+    return lines
+
+
+def read_trace_chunk(tracefile_path, start_offset, end_offset):
+    with open(tracefile_path, "rb") as f:
+        f.seek(start_offset)
+        chunk = f.read(end_offset - start_offset)
+
+    return chunk.decode().splitlines()
+
 
+def apply_event_filter(lines, event_filter):
+    if event_filter == None or event_filter.is_empty():
+        return lines
 
-def get_small_functions(tracefile_path):
+    return event_filter.filter_lines(lines)
+
+
+def get_function_durations(lines):
     firstStartTime = None
     finalEndTime = None
     totalDurationForFunction = dict()
     start_timeAtCallStackDepth = list()
     callstack_depth = 0
+
+    for line in lines:
+        traceEvent = process_line_from_trace(line)
+        if firstStartTime == None:
+            firstStartTime = traceEvent["time"]
+
+        if traceEvent["direction"] == ENTER:
+            start_time = traceEvent["time"]
+            if callstack_depth == len(start_timeAtCallStackDepth):
+                start_timeAtCallStackDepth.append(start_time)
+            else:
+                assert callstack_depth < len(start_timeAtCallStackDepth)
+                start_timeAtCallStackDepth[callstack_depth] = start_time
+
+            callstack_depth += 1
+
+        else:
+            callstack_depth -= 1
+            function = traceEvent["function"]
+            end_time = traceEvent["time"]
+            start_time = start_timeAtCallStackDepth[callstack_depth]
+            duration = end_time - start_time
+            totalDurationForFunction[function] = (
+                totalDurationForFunction.get(function, 0) + duration
+            )
+            assert callstack_depth == len(start_timeAtCallStackDepth) - 1
+            del start_timeAtCallStackDepth[-1]
+
+    if firstStartTime != None:
+        finalEndTime = traceEvent["time"]
+
+    return totalDurationForFunction, firstStartTime, finalEndTime
+
+
+def get_function_durations_in_chunk(
+    tracefile_path, start_offset, end_offset, event_filter=None
+):
+    lines = read_trace_chunk(tracefile_path, start_offset, end_offset)
+    return get_function_durations(apply_event_filter(lines, event_filter))
+
+
+def select_small_functions(totalDurationForFunction, firstStartTime, finalEndTime):
     smallFunctions = list()
 
+    for function in totalDurationForFunction:
+        totalDuration = totalDurationForFunction[function]
+        if (totalDuration / (finalEndTime - firstStartTime)) <= THRESHOLD / 100:
+            smallFunctions.append(function)
+
+    return smallFunctions
+
+
+def get_small_functions(tracefile_path, event_filter=None):
     fileSize = get_file_size(tracefile_path)
 
     with open(tracefile_path, "r") as f:
-        for line in tqdm(f):
-            traceEvent = process_line_from_trace(line)
-            if firstStartTime == None:
-                firstStartTime = traceEvent["time"]
-
-            if traceEvent["direction"] == ENTER:
-                start_time = traceEvent["time"]
-                if callstack_depth == len(start_timeAtCallStackDepth):
-                    start_timeAtCallStackDepth.append(start_time)
-                else:
-                    assert callstack_depth < len(start_timeAtCallStackDepth)
-                    start_timeAtCallStackDepth[callstack_depth] = start_time
+        totalDurationForFunction, firstStartTime, finalEndTime = get_function_durations(
+            apply_event_filter(tqdm(f), event_filter)
+        )
 
-                callstack_depth += 1
+    return select_small_functions(
+        totalDurationForFunction, firstStartTime, finalEndTime
+    )
 
-            else:
-                callstack_depth -= 1
-                function = traceEvent["function"]
-                end_time = traceEvent["time"]
-                start_time = start_timeAtCallStackDepth[callstack_depth]
-                duration = end_time - start_time
-                totalDurationForFunction[function] = (
-                    totalDurationForFunction.get(function, 0) + duration
-                )
-                assert callstack_depth == len(start_timeAtCallStackDepth) - 1
-                del start_timeAtCallStackDepth[-1]
 
-        finalEndTime = traceEvent["time"]
+def get_small_functions_in_chunks(
+    tracefile_path, chunk_offsets, executor, event_filter=None
+):
+    totalDurationForFunction = dict()
+
+    num_of_chunks = len(chunk_offsets) - 1
+    chunk_results = executor.map(
+        get_function_durations_in_chunk,
+        [tracefile_path] * num_of_chunks,
+        chunk_offsets[:-1],
+        chunk_offsets[1:],
+        [event_filter] * num_of_chunks,
+    )
+
+    chunk_start_times = list()
+    chunk_end_times = list()
+    for chunk_durations, chunk_start_time, chunk_end_time in chunk_results:
+        for function, duration in chunk_durations.items():
+            totalDurationForFunction[function] = (
+                totalDurationForFunction.get(function, 0) + duration
+            )
+
+        if chunk_start_time != None:
+            chunk_start_times.append(chunk_start_time)
+            chunk_end_times.append(chunk_end_time)
+
+    if len(chunk_start_times) == 0:
+        return list()
+
+    return select_small_functions(
+        totalDurationForFunction, chunk_start_times[0], chunk_end_times[-1]
+    )
+
 
-        for function in totalDurationForFunction:
-            totalDuration = totalDurationForFunction[function]
-            if (totalDuration / (finalEndTime - firstStartTime)) <= THRESHOLD / 100:
-                smallFunctions.append(function)
+def add_slowest_invocation(slowest_invocations, function, invocation):
+    invocations = slowest_invocations.setdefault(function, list())
 
-        return smallFunctions
+    if len(invocations) < TOP_K_SLOWEST_INVOCATIONS:
+        heapq.heappush(invocations, invocation)
+
+    elif invocation > invocations[0]:
+        heapq.heapreplace(invocations, invocation)
 
 
 def output_sanity_check(filtered_trace, totalFuncDurationBefore):
@@ -88,102 +345,327 @@ def output_sanity_check(filtered_trace, totalFuncDurationBefore):
         assert total_duration_for_func[function] == totalFuncDurationBefore[function]
 
 
-def filter_trace_file(tracefile_path):
+def filter_trace_lines(lines, functions_to_remove):
+    call_paths = CallPathTrie()
+    call_path = -1
     lastFuncEntered = {"name": None, "time": None}
     nonLeafFuncEntered = list()
     lastEnterTime = None
     callstack_depth = 0
     filtered_trace = list()
     totalFuncDurationBefore = dict()
+    slowest_invocations = dict()
 
-    functions_to_remove = get_small_functions(tracefile_path)
-    fileSize = get_file_size(tracefile_path)
+    functions_to_remove = set(functions_to_remove)
 
-    with open(tracefile_path, "r") as f:
-        for line in tqdm(f):
-            filtered_trace_event = None
-            trace_event = process_line_from_trace(line)
-
-            if trace_event["function"] in functions_to_remove:
-                continue
-
-            if trace_event["direction"] == ENTER:
-                if lastFuncEntered["name"] != None:
-                    filtered_trace_event = {
-                        "event_type": ENTER_EVENTTYPE,
-                        "function": lastFuncEntered["name"],
-                        "start_time": lastFuncEntered["time"],
-                        "end_time": lastFuncEntered["time"],
-                        "time_first_entered": -1,
-                        "time_last_exited": -1,
-                        "duration": 0,
-                        "parens": 0,
-                        "callstack_depth": callstack_depth,
-                    }
-
-                    filtered_trace.append(filtered_trace_event)
-
-                    nonLeafFuncEntered.append(dict())
-                    nonLeafFuncEntered[-1]["name"] = lastFuncEntered["name"]
-                    nonLeafFuncEntered[-1]["time"] = lastFuncEntered["time"]
-                    nonLeafFuncEntered[-1]["index"] = len(filtered_trace) - 1
-
-                    callstack_depth += 1
-
-                lastFuncEntered["name"] = trace_event["function"]
-                lastFuncEntered["time"] = trace_event["time"]
-
-            elif trace_event["function"] == lastFuncEntered["name"]:
-                duration = trace_event["time"] - lastFuncEntered["time"]
-                totalFuncDurationBefore[trace_event["function"]] = (
-                    totalFuncDurationBefore.get(trace_event["function"], 0) + duration
-                )
+    for line in lines:
+        filtered_trace_event = None
+        trace_event = process_line_from_trace(line)
 
+        if trace_event["function"] in functions_to_remove:
+            continue
+
+        if trace_event["direction"] == ENTER:
+            if lastFuncEntered["name"] != None:
+                call_path = call_paths.get_child(call_path, lastFuncEntered["name"])
                 filtered_trace_event = {
-                    "event_type": EXECUTE_EVENTTYPE,
-                    "function": trace_event["function"],
+                    "event_type": ENTER_EVENTTYPE,
+                    "function": lastFuncEntered["name"],
                     "start_time": lastFuncEntered["time"],
-                    "end_time": trace_event["time"],
+                    "end_time": lastFuncEntered["time"],
                     "time_first_entered": -1,
                     "time_last_exited": -1,
-                    "duration": duration,
+                    "duration": 0,
                     "parens": 0,
                     "callstack_depth": callstack_depth,
+                    "call_path": call_path,
                 }
 
                 filtered_trace.append(filtered_trace_event)
 
-                lastFuncEntered = {"name": None, "time": None}
+                nonLeafFuncEntered.append(dict())
+                nonLeafFuncEntered[-1]["name"] = lastFuncEntered["name"]
+                nonLeafFuncEntered[-1]["time"] = lastFuncEntered["time"]
+                nonLeafFuncEntered[-1]["index"] = len(filtered_trace) - 1
 
-            else:
-                lastNonLeafFuncEntered = nonLeafFuncEntered.pop()
-                assert trace_event["function"] == lastNonLeafFuncEntered["name"]
+                callstack_depth += 1
 
-                duration = trace_event["time"] - lastNonLeafFuncEntered["time"]
+            lastFuncEntered["name"] = trace_event["function"]
+            lastFuncEntered["time"] = trace_event["time"]
 
-                totalFuncDurationBefore[trace_event["function"]] = (
-                    totalFuncDurationBefore.get(trace_event["function"], 0) + duration
-                )
+        elif trace_event["function"] == lastFuncEntered["name"]:
+            duration = trace_event["time"] - lastFuncEntered["time"]
+            totalFuncDurationBefore[trace_event["function"]] = (
+                totalFuncDurationBefore.get(trace_event["function"], 0) + duration
+            )
 
-                indexOfEnterEvent = lastNonLeafFuncEntered["index"]
-                filtered_trace[indexOfEnterEvent]["duration"] = duration
+            filtered_trace_event = {
+                "event_type": EXECUTE_EVENTTYPE,
+                "function": trace_event["function"],
+                "start_time": lastFuncEntered["time"],
+                "end_time": trace_event["time"],
+                "time_first_entered": -1,
+                "time_last_exited": -1,
+                "duration": duration,
+                "parens": 0,
+                "callstack_depth": callstack_depth,
+                "call_path": call_paths.get_child(call_path, trace_event["function"]),
+            }
+
+            filtered_trace.append(filtered_trace_event)
+
+            add_slowest_invocation(
+                slowest_invocations,
+                trace_event["function"],
+                (
+                    duration,
+                    lastFuncEntered["time"],
+                    trace_event["time"],
+                    callstack_depth,
+                ),
+            )
 
-                callstack_depth -= 1
+            lastFuncEntered = {"name": None, "time": None}
 
-                filtered_trace_event = {
-                    "event_type": EXIT_EVENTTYPE,
-                    "function": trace_event["function"],
-                    "start_time": trace_event["time"],
-                    "end_time": trace_event["time"],
-                    "time_first_entered": -1,
-                    "time_last_exited": -1,
-                    "duration": duration,
-                    "parens": 0,
-                    "callstack_depth": callstack_depth,
-                }
+        else:
+            lastNonLeafFuncEntered = nonLeafFuncEntered.pop()
+            assert trace_event["function"] == lastNonLeafFuncEntered["name"]
 
-                filtered_trace.append(filtered_trace_event)
+            duration = trace_event["time"] - lastNonLeafFuncEntered["time"]
+
+            totalFuncDurationBefore[trace_event["function"]] = (
+                totalFuncDurationBefore.get(trace_event["function"], 0) + duration
+            )
+
+            indexOfEnterEvent = lastNonLeafFuncEntered["index"]
+            filtered_trace[indexOfEnterEvent]["duration"] = duration
+
+            callstack_depth -= 1
+
+            filtered_trace_event = {
+                "event_type": EXIT_EVENTTYPE,
+                "function": trace_event["function"],
+                "start_time": trace_event["time"],
+                "end_time": trace_event["time"],
+                "time_first_entered": -1,
+                "time_last_exited": -1,
+                "duration": duration,
+                "parens": 0,
+                "callstack_depth": callstack_depth,
+                "call_path": call_path,
+            }
+
+            filtered_trace.append(filtered_trace_event)
+            call_path = call_paths.parents[call_path]
+
+            add_slowest_invocation(
+                slowest_invocations,
+                trace_event["function"],
+                (
+                    duration,
+                    lastNonLeafFuncEntered["time"],
+                    trace_event["time"],
+                    callstack_depth,
+                ),
+            )
+
+    return filtered_trace, totalFuncDurationBefore, slowest_invocations, call_paths
+
+
+def filter_trace_chunk(
+    tracefile_path, start_offset, end_offset, functions_to_remove, event_filter=None
+):
+    lines = read_trace_chunk(tracefile_path, start_offset, end_offset)
+    return filter_trace_lines(
+        apply_event_filter(lines, event_filter), functions_to_remove
+    )
+
+
+def merge_filtered_chunks(chunk_results):
+    filtered_trace = list()
+    totalFuncDurationBefore = dict()
+    slowest_invocations = dict()
+    call_paths = CallPathTrie()
+
+    for (
+        filtered_chunk,
+        chunkFuncDurationBefore,
+        chunk_invocations,
+        chunk_call_paths,
+    ) in chunk_results:
+        # Every chunk starts at callstack depth 0, so its call paths are
+        # added to the thread's trie and its events renumbered in one pass.
+        call_path_map = call_paths.merge(chunk_call_paths)
+        for filtered_trace_event in filtered_chunk:
+            filtered_trace_event["call_path"] = call_path_map[
+                filtered_trace_event["call_path"]
+            ]
+
+        filtered_trace.extend(filtered_chunk)
+
+        for function, duration in chunkFuncDurationBefore.items():
+            totalFuncDurationBefore[function] = (
+                totalFuncDurationBefore.get(function, 0) + duration
+            )
+
+        for function, invocations in chunk_invocations.items():
+            for invocation in invocations:
+                add_slowest_invocation(slowest_invocations, function, invocation)
+
+    return filtered_trace, totalFuncDurationBefore, slowest_invocations, call_paths
+
+
+def filter_trace_file_in_chunks(
+    tracefile_path, chunk_offsets, executor, event_filter=None
+):
+    functions_to_remove = get_small_functions_in_chunks(
+        tracefile_path, chunk_offsets, executor, event_filter
+    )
+
+    num_of_chunks = len(chunk_offsets) - 1
+    chunk_results = executor.map(
+        filter_trace_chunk,
+        [tracefile_path] * num_of_chunks,
+        chunk_offsets[:-1],
+        chunk_offsets[1:],
+        [functions_to_remove] * num_of_chunks,
+        [event_filter] * num_of_chunks,
+    )
+
+    return merge_filtered_chunks(chunk_results)
+
+
+def filter_trace_batch(lines, event_filter=None):
+    # The small functions of a thread are only known once all of its batches
+    # are read, so nothing is removed here.
+    return filter_trace_lines(apply_event_filter(lines, event_filter), ())
+
+
+def get_trace_lines(filtered_trace):
+    # Events are appended in the order of the lines they were made from, so
+    # the lines are written back from them in order.
+    for filtered_trace_event in filtered_trace:
+        function = filtered_trace_event["function"]
+        event_type = filtered_trace_event["event_type"]
+
+        if event_type != EXIT_EVENTTYPE:
+            yield ENTER + " " + function + " " + str(filtered_trace_event["start_time"])
+
+        if event_type != ENTER_EVENTTYPE:
+            yield EXIT + " " + function + " " + str(filtered_trace_event["end_time"])
+
+
+def merge_filtered_batches(batch_results):
+    filtered_trace, totalFuncDurationBefore, slowest_invocations, call_paths = (
+        merge_filtered_chunks(batch_results)
+    )
+
+    # The batches kept every function, so the thread is filtered again from
+    # its events in the rare case that it has small functions to remove.
+    if len(filtered_trace) > 0:
+        functions_to_remove = select_small_functions(
+            totalFuncDurationBefore,
+            filtered_trace[0]["start_time"],
+            filtered_trace[-1]["end_time"],
+        )
+        if len(functions_to_remove) > 0:
+            (
+                filtered_trace,
+                totalFuncDurationBefore,
+                slowest_invocations,
+                call_paths,
+            ) = filter_trace_lines(get_trace_lines(filtered_trace), functions_to_remove)
 
     output_sanity_check(filtered_trace, totalFuncDurationBefore)
 
-    return filtered_trace
+    for function in slowest_invocations:
+        slowest_invocations[function].sort(reverse=True)
+
+    return filtered_trace, slowest_invocations, call_paths
+
+
+def filter_interleaved_trace_file(
+    tracefile_path, executor=None, event_filter=None, strata=None, units=None
+):
+    # The file is read once and every batch of a thread is filtered as it is
+    # read, on the pool when there is one. Only MAX_PENDING_BATCHES batches
+    # wait for the pool at a time, so the lines in memory stay bounded.
+    thread_batches = dict()
+    pending_batches = deque()
+
+    for thread_id, stratum, lines in read_interleaved_batches(
+        tracefile_path, event_filter, strata, units
+    ):
+        if executor == None:
+            batch = [stratum, filter_trace_batch(lines, event_filter)]
+        else:
+            batch = [stratum, executor.submit(filter_trace_batch, lines, event_filter)]
+            pending_batches.append(batch)
+
+        thread_batches.setdefault(thread_id, list()).append(batch)
+
+        if len(pending_batches) > MAX_PENDING_BATCHES:
+            batch = pending_batches.popleft()
+            batch[1] = batch[1].result()
+
+    for batch in pending_batches:
+        batch[1] = batch[1].result()
+
+    return {
+        thread_id: [tuple(batch) for batch in thread_batches[thread_id]]
+        for thread_id in sorted(thread_batches, key=get_interleaved_thread_sort_key)
+    }
+
+
+def filter_thread_lines(lines, event_filter=None):
+    lines = list(apply_event_filter(lines, event_filter))
+
+    totalDurationForFunction, firstStartTime, finalEndTime = get_function_durations(
+        lines
+    )
+    functions_to_remove = select_small_functions(
+        totalDurationForFunction, firstStartTime, finalEndTime
+    )
+
+    filtered_trace, totalFuncDurationBefore, slowest_invocations, call_paths = (
+        filter_trace_lines(lines, functions_to_remove)
+    )
+
+    output_sanity_check(filtered_trace, totalFuncDurationBefore)
+
+    for function in slowest_invocations:
+        slowest_invocations[function].sort(reverse=True)
+
+    return filtered_trace, slowest_invocations, call_paths
+
+
+def filter_trace_file(tracefile_path, executor=None, event_filter=None):
+    chunk_offsets = None
+    if executor != None:
+        chunk_offsets = get_chunk_offsets(tracefile_path, executor)
+
+    split_into_chunks = chunk_offsets != None and len(chunk_offsets) > 2
+    if split_into_chunks:
+        filtered_trace, totalFuncDurationBefore, slowest_invocations, call_paths = (
+            filter_trace_file_in_chunks(
+                tracefile_path, chunk_offsets, executor, event_filter
+            )
+        )
+
+    else:
+        functions_to_remove = get_small_functions(tracefile_path, event_filter)
+        fileSize = get_file_size(tracefile_path)
+
+        with open(tracefile_path, "r") as f:
+            filtered_trace, totalFuncDurationBefore, slowest_invocations, call_paths = (
+                filter_trace_lines(
+                    apply_event_filter(tqdm(f), event_filter), functions_to_remove
+                )
+            )
+
+    output_sanity_check(filtered_trace, totalFuncDurationBefore)
+
+    for function in slowest_invocations:
+        slowest_invocations[function].sort(reverse=True)
+
+    return filtered_trace, slowest_invocations, call_paths
@@ -0,0 +1,347 @@
+from datetime import datetime, timezone
+import os
+import sqlite3
+from nonsequitur_lib import (
+    CALL_PATH_SEPARATOR,
+    LATENCY_PERCENTILES,
+    get_execution_time_range,
+    merge_latency_percentiles,
+)
+
+PERCENTILE_COLUMNS = ["p" + str(percentile) for percentile in LATENCY_PERCENTILES]
+FUNCTION_STAT_COLUMNS = ["count", "inclusive_time", "self_time"] + PERCENTILE_COLUMNS
+FUNCTION_STAT_COLUMN_TYPES = ["INTEGER", "INTEGER", "INTEGER"] + ["REAL"] * len(
+    PERCENTILE_COLUMNS
+)
+DEFAULT_HISTORY_ROWS = 20
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    title TEXT,
+    input_folder TEXT,
+    recorded_at TEXT NOT NULL,
+    execution_start_time INTEGER,
+    execution_end_time INTEGER,
+    threads INTEGER NOT NULL,
+    filtered_events INTEGER,
+    compressed_events INTEGER NOT NULL,
+    compression_ratio REAL,
+    preview INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_by_name ON runs (name, run_id);
+CREATE TABLE IF NOT EXISTS thread_stats (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    thread INTEGER NOT NULL,
+    filtered_events INTEGER,
+    compressed_events INTEGER NOT NULL,
+    compression_ratio REAL,
+    PRIMARY KEY (run_id, thread)
+);
+CREATE TABLE IF NOT EXISTS thread_function_stats (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    thread INTEGER NOT NULL,
+    function TEXT NOT NULL,
+    {function_stat_columns},
+    PRIMARY KEY (run_id, thread, function)
+);
+CREATE TABLE IF NOT EXISTS function_stats (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    function TEXT NOT NULL,
+    threads INTEGER NOT NULL,
+    {function_stat_columns},
+    PRIMARY KEY (run_id, function)
+);
+CREATE INDEX IF NOT EXISTS function_stats_by_function
+    ON function_stats (function, run_id);
+""".format(
+    function_stat_columns=",\n    ".join(
+        column + " " + column_type
+        for column, column_type in zip(
+            FUNCTION_STAT_COLUMNS, FUNCTION_STAT_COLUMN_TYPES
+        )
+    )
+)
+
+
+def open_history(history_path):
+    connection = sqlite3.connect(history_path)
+    connection.executescript(HISTORY_SCHEMA)
+    return connection
+
+
+def get_function_times(call_path_stats):
+    # A call path's self time is its duration minus the durations of the
+    # call paths one call deeper, and a function's times are summed over the
+    # call paths that end in it.
+    call_path_to_self_time = dict(
+        zip(call_path_stats["call_path"], call_path_stats["duration"])
+    )
+    for call_path, duration in zip(
+        call_path_stats["call_path"], call_path_stats["duration"]
+    ):
+        caller_call_path = call_path.rpartition(CALL_PATH_SEPARATOR)[0]
+        if caller_call_path in call_path_to_self_time:
+            call_path_to_self_time[caller_call_path] -= duration
+
+    function_times = dict()
+    for call_path, function, count, duration in zip(
+        call_path_stats["call_path"],
+        call_path_stats["function"],
+        call_path_stats["count"],
+        call_path_stats["duration"],
+    ):
+        times = function_times.setdefault(function, [0, 0, 0])
+        times[0] += count
+        times[1] += duration
+        times[2] += call_path_to_self_time[call_path]
+
+    return function_times
+
+
+def get_function_stat_rows(function_times, latency_percentiles):
+    function_to_percentiles = dict()
+    for i in range(len(latency_percentiles["function"])):
+        function_to_percentiles[latency_percentiles["function"][i]] = [
+            latency_percentiles[column][i] for column in PERCENTILE_COLUMNS
+        ]
+
+    return [
+        [function]
+        + times
+        + function_to_percentiles.get(function, [None] * len(PERCENTILE_COLUMNS))
+        for function, times in function_times.items()
+    ]
+
+
+def get_compression_ratio(filtered_events, compressed_events):
+    if filtered_events == None or compressed_events == 0:
+        return None
+
+    return filtered_events / compressed_events
+
+
+def insert_run(connection, name, title, input_folder, traces, trace_stats, manifest):
+    execution_start_time, execution_end_time = get_execution_time_range(traces)
+    if manifest != None and manifest["execution_start_time"] != None:
+        execution_start_time = manifest["execution_start_time"]
+        execution_end_time = manifest["execution_end_time"]
+
+    thread_rows = list()
+    thread_function_rows = list()
+    run_function_times = dict()
+    function_to_threads = dict()
+    for thread in range(len(traces)):
+        stats = trace_stats[thread]
+        filtered_events = stats.get("filtered_events")
+        compressed_events = len(traces[thread])
+        thread_rows.append(
+            [
+                thread,
+                filtered_events,
+                compressed_events,
+                get_compression_ratio(filtered_events, compressed_events),
+            ]
+        )
+
+        if "call_path_stats" not in stats:
+            continue
+
+        function_times = get_function_times(stats["call_path_stats"])
+        for row in get_function_stat_rows(function_times, stats["latency_percentiles"]):
+            thread_function_rows.append([thread] + row)
+
+        for function, times in function_times.items():
+            run_times = run_function_times.setdefault(function, [0, 0, 0])
+            for i in range(len(times)):
+                run_times[i] += times[i]
+
+            function_to_threads[function] = function_to_threads.get(function, 0) + 1
+
+    filtered_events = None
+    if all(row[1] != None for row in thread_rows):
+        filtered_events = sum(row[1] for row in thread_rows)
+
+    compressed_events = sum(row[2] for row in thread_rows)
+    cursor = connection.execute(
+        "INSERT INTO runs (name, title, input_folder, recorded_at, "
+        "execution_start_time, execution_end_time, threads, filtered_events, "
+        "compressed_events, compression_ratio, preview) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            name,
+            title,
+            os.path.abspath(input_folder),
+            datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            None if execution_start_time == None else int(execution_start_time),
+            None if execution_end_time == None else int(execution_end_time),
+            len(traces),
+            filtered_events,
+            compressed_events,
+            get_compression_ratio(filtered_events, compressed_events),
+            any("preview" in stats for stats in trace_stats),
+        ],
+    )
+    run_id = cursor.lastrowid
+
+    # Percentiles cannot be combined exactly, so the run's percentiles are
+    # the call-weighted mean of its threads' percentiles.
+    run_latency_percentiles = merge_latency_percentiles(
+        [
+            stats["latency_percentiles"]
+            for stats in trace_stats
+            if "call_path_stats" in stats
+        ]
+    )
+    function_rows = [
+        [row[0], function_to_threads[row[0]]] + row[1:]
+        for row in get_function_stat_rows(run_function_times, run_latency_percentiles)
+    ]
+
+    placeholders = ", ".join(["?"] * (len(FUNCTION_STAT_COLUMNS) + 3))
+    connection.executemany(
+        "INSERT INTO thread_stats VALUES (?, ?, ?, ?, ?)",
+        [[run_id] + row for row in thread_rows],
+    )
+    connection.executemany(
+        "INSERT INTO thread_function_stats VALUES (" + placeholders + ")",
+        [[run_id] + row for row in thread_function_rows],
+    )
+    connection.executemany(
+        "INSERT INTO function_stats VALUES (" + placeholders + ")",
+        [[run_id] + row for row in function_rows],
+    )
+
+    return run_id
+
+
+def record_runs(history_path, runs):
+    connection = open_history(history_path)
+
+    # All runs of a batch are written in one transaction, so a failed batch
+    # leaves no partial runs behind.
+    with connection:
+        run_ids = [insert_run(connection, *run) for run in runs]
+
+    connection.close()
+    return run_ids
+
+
+def get_latest_run_id(connection, name=None, before_run_id=None):
+    # Previews only sample the calls, so they are not picked as defaults.
+    query = "SELECT MAX(run_id) FROM runs WHERE preview = 0"
+    parameters = list()
+    if name != None:
+        query += " AND name = ?"
+        parameters.append(name)
+
+    if before_run_id != None:
+        query += " AND run_id < ?"
+        parameters.append(before_run_id)
+
+    return connection.execute(query, parameters).fetchone()[0]
+
+
+def query_runs(connection, name=None, last=DEFAULT_HISTORY_ROWS):
+    columns = [
+        "run_id",
+        "name",
+        "recorded_at",
+        "threads",
+        "filtered_events",
+        "compressed_events",
+        "compression_ratio",
+        "preview",
+    ]
+    query = "SELECT " + ", ".join(columns) + " FROM runs"
+    parameters = list()
+    if name != None:
+        query += " WHERE name = ?"
+        parameters.append(name)
+
+    query += " ORDER BY run_id DESC LIMIT ?"
+    parameters.append(last)
+
+    return columns, connection.execute(query, parameters).fetchall()[::-1]
+
+
+def query_trend(connection, function, name=None, last=DEFAULT_HISTORY_ROWS):
+    columns = ["run_id", "name", "recorded_at", "threads"] + FUNCTION_STAT_COLUMNS
+    query = (
+        "SELECT runs.run_id, runs.name, runs.recorded_at, function_stats.threads, "
+        + ", ".join("function_stats." + column for column in FUNCTION_STAT_COLUMNS)
+        + " FROM function_stats JOIN runs ON runs.run_id = function_stats.run_id"
+        " WHERE function_stats.function = ?"
+    )
+    parameters = [function]
+    if name != None:
+        query += " AND runs.name = ?"
+        parameters.append(name)
+
+    query += " ORDER BY runs.run_id DESC LIMIT ?"
+    parameters.append(last)
+
+    return columns, connection.execute(query, parameters).fetchall()[::-1]
+
+
+def query_regressions(connection, run_id, baseline_run_id, top=DEFAULT_HISTORY_ROWS):
+    # Functions missing from one of the runs count as zero there, so new and
+    # vanished functions are ranked along with the others.
+    columns = [
+        "function",
+        "inclusive_time_baseline",
+        "inclusive_time",
+        "inclusive_time_delta",
+        "self_time_delta",
+        "count_delta",
+    ]
+    query = """
+    WITH pairs AS (
+        SELECT function, inclusive_time, self_time, count,
+            0 AS inclusive_time_baseline, 0 AS self_time_baseline,
+            0 AS count_baseline
+        FROM function_stats WHERE run_id = ?
+        UNION ALL
+        SELECT function, 0, 0, 0, inclusive_time, self_time, count
+        FROM function_stats WHERE run_id = ?
+    )
+    SELECT function,
+        SUM(inclusive_time_baseline),
+        SUM(inclusive_time),
+        SUM(inclusive_time) - SUM(inclusive_time_baseline) AS inclusive_time_delta,
+        SUM(self_time) - SUM(self_time_baseline),
+        SUM(count) - SUM(count_baseline)
+    FROM pairs
+    GROUP BY function
+    ORDER BY inclusive_time_delta DESC
+    LIMIT ?
+    """
+
+    return (
+        columns,
+        connection.execute(query, [run_id, baseline_run_id, top]).fetchall(),
+    )
+
+
+def format_history_value(value):
+    if isinstance(value, float):
+        if value.is_integer():
+            return str(int(value))
+
+        return "{:.2f}".format(value)
+
+    if value == None:
+        return "-"
+
+    return str(value)
+
+
+def format_history_table(columns, rows):
+    cells = [columns] + [[format_history_value(value) for value in row] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(columns))]
+
+    return "\n".join(
+        "  ".join(cell.rjust(width) for cell, width in zip(row, widths))
+        for row in cells
+    )
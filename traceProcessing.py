@@ -1,6 +1,13 @@
+import bisect
+from config import ENTER
+from fnmatch import fnmatch
 import os
 import re
 
+MANIFEST_SAMPLE_BYTES = 1 << 16
+INTERLEAVED_BATCH_LINES = 1 << 16
+INTERLEAVED_BUFFER_LINES = 1 << 18
+
 
 def process_line_from_trace(line):
     traceEventTuple = {}
@@ -14,3 +21,339 @@ def process_line_from_trace(line):
 
 def get_file_size(filepath):
     return os.path.getsize(filepath)
+
+
+class TraceEventFilter:
+    def __init__(
+        self,
+        include=None,
+        include_regex=None,
+        exclude=None,
+        exclude_regex=None,
+        max_depth=None,
+        tracefile_glob=None,
+    ):
+        self.include = None if include == None else set(include)
+        self.include_regex = (
+            None if include_regex == None else re.compile(include_regex)
+        )
+        self.exclude = set() if exclude == None else set(exclude)
+        self.exclude_regex = (
+            None if exclude_regex == None else re.compile(exclude_regex)
+        )
+        self.max_depth = max_depth
+        self.tracefile_glob = tracefile_glob
+        self.keeps_function_cache = dict()
+
+    def is_empty(self):
+        return (
+            self.include == None
+            and self.include_regex == None
+            and len(self.exclude) == 0
+            and self.exclude_regex == None
+            and self.max_depth == None
+        )
+
+    def keeps_tracefile(self, tracefile_name):
+        return self.tracefile_glob == None or fnmatch(
+            tracefile_name, self.tracefile_glob
+        )
+
+    def keeps_function(self, function):
+        keeps_function = self.keeps_function_cache.get(function)
+        if keeps_function != None:
+            return keeps_function
+
+        is_included = self.include == None and self.include_regex == None
+        if self.include != None and function in self.include:
+            is_included = True
+
+        if self.include_regex != None and self.include_regex.match(function):
+            is_included = True
+
+        is_excluded = function in self.exclude or (
+            self.exclude_regex != None and self.exclude_regex.match(function) != None
+        )
+
+        keeps_function = is_included and not is_excluded
+        self.keeps_function_cache[function] = keeps_function
+        return keeps_function
+
+    def filter_lines(self, lines):
+        # Lines are dropped before they are parsed into events. A function's
+        # ENTER and EXIT lines share the same name and raw callstack depth, so
+        # both are either kept or dropped and the remaining lines still pair up.
+        callstack_depth = 0
+
+        for line in lines:
+            direction, function, _ = line.split(" ", 2)
+
+            if direction == ENTER:
+                line_depth = callstack_depth
+                callstack_depth += 1
+            else:
+                callstack_depth -= 1
+                line_depth = callstack_depth
+
+            if self.max_depth != None and line_depth > self.max_depth:
+                continue
+
+            if self.keeps_function(function):
+                yield line
+
+
+class CallPathTrie:
+    def __init__(self):
+        # A call path is identified by the index of its last call, which
+        # points to its caller's index, so the function and the callstack
+        # depth of every call path are looked up by index.
+        self.parents = list()
+        self.functions = list()
+        self.callstack_depths = list()
+        self.call_path_for_child = dict()
+
+    def __len__(self):
+        return len(self.parents)
+
+    def get_child(self, parent, function):
+        call_path = self.call_path_for_child.get((parent, function))
+        if call_path == None:
+            call_path = len(self.parents)
+            self.call_path_for_child[(parent, function)] = call_path
+            self.parents.append(parent)
+            self.functions.append(function)
+            self.callstack_depths.append(
+                0 if parent < 0 else self.callstack_depths[parent] + 1
+            )
+
+        return call_path
+
+    def get_functions(self, call_path):
+        functions = list()
+        while call_path >= 0:
+            functions.append(self.functions[call_path])
+            call_path = self.parents[call_path]
+
+        functions.reverse()
+        return functions
+
+    def find(self, functions):
+        call_path = -1
+        for function in functions:
+            call_path = self.call_path_for_child.get((call_path, function), -1)
+            if call_path < 0:
+                break
+
+        return call_path
+
+    def merge(self, other):
+        # Callers are always added before their callees, so one pass maps
+        # every call path of the other trie to this one.
+        call_path_map = list()
+        for parent, function in zip(other.parents, other.functions):
+            if parent >= 0:
+                parent = call_path_map[parent]
+
+            call_path_map.append(self.get_child(parent, function))
+
+        return call_path_map
+
+    def get_columns(self):
+        return {"parent": list(self.parents), "function": list(self.functions)}
+
+    @classmethod
+    def from_columns(cls, columns):
+        call_paths = cls()
+        for parent, function in zip(columns["parent"], columns["function"]):
+            call_paths.get_child(parent, function)
+
+        return call_paths
+
+
+def is_interleaved_trace_file(filepath):
+    with open(filepath, "r") as f:
+        first_line = f.readline()
+
+    return len(first_line.split()) == 4
+
+
+def get_interleaved_thread_sort_key(thread_id):
+    return (not thread_id.isdigit(), len(thread_id), thread_id)
+
+
+def get_interleaved_thread_ids(filepath, event_filter=None):
+    # Only the last column is looked at, so listing the threads costs one
+    # read of the file and no parsing.
+    tracefile_name = os.path.basename(filepath)
+    thread_ids = set()
+
+    with open(filepath, "rb") as f:
+        for line in f:
+            thread_ids.add(line.rsplit(None, 1)[-1])
+
+    thread_ids = [thread_id.decode() for thread_id in thread_ids]
+    return sorted(
+        (
+            thread_id
+            for thread_id in thread_ids
+            if event_filter == None
+            or event_filter.keeps_tracefile(tracefile_name + "." + thread_id)
+        ),
+        key=get_interleaved_thread_sort_key,
+    )
+
+
+class InterleavedThread:
+    def __init__(self, thread_id):
+        self.thread_id = thread_id
+        self.callstack_depth = 0
+        self.stratum = None
+        self.keeps_call = False
+        self.lines = list()
+        self.num_of_complete_lines = 0
+
+
+def read_interleaved_batches(filepath, event_filter=None, strata=None, units=None):
+    # Interleaved files carry the thread ID as a fourth column. The file is
+    # streamed once and each thread's lines are yielded without it, in
+    # batches of whole top-level calls, as (thread ID, stratum, lines). Every
+    # batch starts at callstack depth 0, like a chunk of a thread's file.
+    #
+    # With strata, a list of [start, end) byte ranges of the file, a
+    # top-level call belongs to the stratum its first line starts in, and
+    # calls outside every stratum are skipped. Without them, every call is in
+    # stratum 0. units optionally limits the (thread ID, stratum) pairs that
+    # are read.
+    tracefile_name = os.path.basename(filepath)
+    stratum_starts = None if strata == None else [start for start, end in strata]
+    enter_direction = ENTER.encode()
+    threads = dict()
+    skipped_thread_ids = set()
+    num_of_buffered_lines = 0
+    flush_limit = INTERLEAVED_BUFFER_LINES
+    offset = 0
+
+    with open(filepath, "rb") as f:
+        for line in f:
+            line_offset = offset
+            offset += len(line)
+            line, thread_id = line.rsplit(None, 1)
+
+            thread = threads.get(thread_id)
+            if thread == None:
+                if thread_id in skipped_thread_ids:
+                    continue
+
+                thread_name = tracefile_name + "." + thread_id.decode()
+                if event_filter != None and not event_filter.keeps_tracefile(
+                    thread_name
+                ):
+                    skipped_thread_ids.add(thread_id)
+                    continue
+
+                thread = InterleavedThread(thread_id.decode())
+                threads[thread_id] = thread
+
+            if thread.callstack_depth == 0:
+                stratum = 0
+                if strata != None:
+                    stratum = bisect.bisect_right(stratum_starts, line_offset) - 1
+                    if stratum < 0 or line_offset >= strata[stratum][1]:
+                        stratum = None
+
+                # A batch holds the calls of one stratum, so it is cut when
+                # the stratum changes or when it is full.
+                if len(thread.lines) > 0 and (
+                    stratum != thread.stratum
+                    or len(thread.lines) >= INTERLEAVED_BATCH_LINES
+                ):
+                    yield thread.thread_id, thread.stratum, thread.lines
+                    num_of_buffered_lines -= len(thread.lines)
+                    thread.lines = list()
+                    thread.num_of_complete_lines = 0
+                    flush_limit = min(
+                        flush_limit, num_of_buffered_lines + INTERLEAVED_BUFFER_LINES
+                    )
+
+                thread.stratum = stratum
+                thread.keeps_call = stratum != None and (
+                    units == None or (thread.thread_id, stratum) in units
+                )
+
+            if line.startswith(enter_direction):
+                thread.callstack_depth += 1
+            else:
+                thread.callstack_depth -= 1
+
+            if thread.keeps_call:
+                thread.lines.append(line.decode())
+                num_of_buffered_lines += 1
+
+            if thread.callstack_depth == 0:
+                thread.num_of_complete_lines = len(thread.lines)
+
+            # The buffered lines of all threads are bounded by yielding the
+            # complete calls of every thread, so only the calls that are still
+            # open stay in memory. Open calls longer than the limit raise it
+            # until they are yielded.
+            if num_of_buffered_lines >= flush_limit:
+                for buffered_thread in threads.values():
+                    num_of_complete_lines = buffered_thread.num_of_complete_lines
+                    if num_of_complete_lines > 0:
+                        yield (
+                            buffered_thread.thread_id,
+                            buffered_thread.stratum,
+                            buffered_thread.lines[:num_of_complete_lines],
+                        )
+                        num_of_buffered_lines -= num_of_complete_lines
+                        del buffered_thread.lines[:num_of_complete_lines]
+                        buffered_thread.num_of_complete_lines = 0
+
+                flush_limit = num_of_buffered_lines + INTERLEAVED_BUFFER_LINES
+
+    for thread in threads.values():
+        if len(thread.lines) > 0:
+            yield thread.thread_id, thread.stratum, thread.lines
+
+
+def get_tracefile_summary(filepath):
+    # Only the head and the tail of the file are read: the first and last
+    # timestamps bound the thread and the head lines give the average line
+    # length that the number of events is estimated from.
+    file_size = get_file_size(filepath)
+
+    with open(filepath, "rb") as f:
+        head = f.read(MANIFEST_SAMPLE_BYTES)
+        head_lines = head.splitlines()
+        if len(head) < file_size:
+            head_lines = head_lines[:-1]
+
+        tail_size = MANIFEST_SAMPLE_BYTES
+        tail_lines = list()
+        while len(tail_lines) < 2 and tail_size < 2 * file_size:
+            f.seek(max(0, file_size - tail_size))
+            tail_lines = f.read(tail_size).splitlines()
+            tail_size *= 2
+
+    head_lines = [line for line in head_lines if len(line.strip()) > 0]
+    tail_lines = [line for line in tail_lines if len(line.strip()) > 0]
+
+    tracefile_summary = {
+        "size_in_bytes": file_size,
+        "first_time": None,
+        "last_time": None,
+        "estimated_events": 0,
+        "interleaved": False,
+    }
+
+    if len(head_lines) > 0:
+        first_line = head_lines[0].decode().split()
+        last_line = tail_lines[-1].decode().split()
+        average_line_size = sum(len(line) + 1 for line in head_lines) / len(head_lines)
+
+        tracefile_summary["first_time"] = int(first_line[2])
+        tracefile_summary["last_time"] = int(last_line[2])
+        tracefile_summary["estimated_events"] = round(file_size / average_line_size)
+        tracefile_summary["interleaved"] = len(first_line) == 4
+
+    return tracefile_summary
@@ -0,0 +1,223 @@
+from config import (
+    ENTER_EVENTTYPE,
+    EXECUTE_EVENTTYPE,
+    EXIT_EVENTTYPE,
+    AGGREGATION_LEFTBOUND,
+    AGGREGATION_RIGHTBOUND,
+)
+from nonsequitur_lib import load_compressed_trace_events
+import numpy as np
+
+CALL_COLUMNS = [
+    "start_time",
+    "end_time",
+    "duration",
+    "callstack_depth",
+    "function",
+    "aggregated",
+]
+
+
+def get_call_intervals(trace):
+    calls = {column: list() for column in CALL_COLUMNS}
+    enter_indices = list()
+    in_regtime_expr = False
+
+    for event in trace:
+        if event["parens"] == AGGREGATION_LEFTBOUND:
+            in_regtime_expr = True
+
+        if event["event_type"] == EXIT_EVENTTYPE:
+            calls["end_time"][enter_indices.pop()] = event["end_time"]
+
+        else:
+            if event["event_type"] == ENTER_EVENTTYPE:
+                enter_indices.append(len(calls["start_time"]))
+
+            repeating_one_event = (
+                event["event_type"] == EXECUTE_EVENTTYPE
+                and event["end_time"] - event["start_time"] > event["duration"]
+            )
+
+            calls["start_time"].append(event["start_time"])
+            calls["end_time"].append(event["end_time"])
+            calls["duration"].append(event["duration"])
+            calls["callstack_depth"].append(event["callstack_depth"])
+            calls["function"].append(event["function"])
+            calls["aggregated"].append(in_regtime_expr or repeating_one_event)
+
+        if event["parens"] == AGGREGATION_RIGHTBOUND:
+            in_regtime_expr = False
+
+    return calls
+
+
+class ThreadCalls:
+    def __init__(self, calls, function_to_code):
+        function_codes = np.array(
+            [function_to_code[function] for function in calls["function"]],
+            dtype=np.int32,
+        )
+        callstack_depths = np.array(calls["callstack_depth"], dtype=np.int32)
+        start_times = np.array(calls["start_time"], dtype=np.int64)
+
+        # Calls at the same callstack depth never overlap, so within every
+        # (depth, function) group both start and end times are sorted and an
+        # overlap query is two binary searches that select a contiguous slice.
+        order = np.lexsort((start_times, function_codes, callstack_depths))
+
+        self.columns = {
+            "start_time": start_times[order],
+            "end_time": np.array(calls["end_time"], dtype=np.int64)[order],
+            "duration": np.array(calls["duration"], dtype=np.int64)[order],
+            "callstack_depth": callstack_depths[order],
+            "function": function_codes[order],
+            "aggregated": np.array(calls["aggregated"], dtype=bool)[order],
+        }
+
+        group_keys = np.stack(
+            (self.columns["callstack_depth"], self.columns["function"])
+        )
+        is_group_start = np.ones(len(order), dtype=bool)
+        is_group_start[1:] = np.any(group_keys[:, 1:] != group_keys[:, :-1], axis=0)
+
+        self.group_starts = np.flatnonzero(is_group_start)
+        self.group_ends = np.append(self.group_starts[1:], len(order))
+        self.group_depths = self.columns["callstack_depth"][self.group_starts]
+        self.group_functions = self.columns["function"][self.group_starts]
+
+    def find_call_slices(
+        self, function_code=None, start_time=None, end_time=None, callstack_depth=None
+    ):
+        call_slices = list()
+
+        is_selected_group = np.ones(len(self.group_starts), dtype=bool)
+        if function_code != None:
+            is_selected_group &= self.group_functions == function_code
+
+        if callstack_depth != None:
+            is_selected_group &= self.group_depths == callstack_depth
+
+        for group in np.flatnonzero(is_selected_group):
+            group_start = self.group_starts[group]
+            group_end = self.group_ends[group]
+
+            slice_start = group_start
+            if start_time != None:
+                slice_start += np.searchsorted(
+                    self.columns["end_time"][group_start:group_end], start_time, "left"
+                )
+
+            slice_end = group_end
+            if end_time != None:
+                slice_end = group_start + np.searchsorted(
+                    self.columns["start_time"][group_start:group_end], end_time, "right"
+                )
+
+            if slice_start < slice_end:
+                call_slices.append(slice(slice_start, slice_end))
+
+        return call_slices
+
+
+class TraceStore:
+    def __init__(self, traces, thread_ids=None):
+        if thread_ids == None:
+            thread_ids = list(range(1, len(traces) + 1))
+
+        calls_in_threads = list()
+        for trace in traces:
+            if hasattr(trace, "to_dict"):
+                trace = trace.to_dict("records")
+
+            calls_in_threads.append(get_call_intervals(trace))
+
+        function_names = sorted(
+            set(
+                function for calls in calls_in_threads for function in calls["function"]
+            )
+        )
+        self.functions = np.array(function_names, dtype=object)
+        self.function_to_code = {
+            function: code for code, function in enumerate(function_names)
+        }
+
+        self.thread_ids = list(thread_ids)
+        self.threads = {
+            thread_id: ThreadCalls(calls, self.function_to_code)
+            for thread_id, calls in zip(self.thread_ids, calls_in_threads)
+        }
+
+    @classmethod
+    def from_compressed_traces(cls, dir):
+        return cls(load_compressed_trace_events(dir))
+
+    def thread_columns(self, thread_id):
+        return self.threads[thread_id].columns
+
+    def function_code(self, function):
+        return self.function_to_code.get(function, -1)
+
+    def find_call_slices(
+        self,
+        function=None,
+        start_time=None,
+        end_time=None,
+        threads=None,
+        callstack_depth=None,
+    ):
+        if threads == None:
+            threads = self.thread_ids
+
+        function_code = None
+        if function != None:
+            function_code = self.function_code(function)
+
+        thread_call_slices = list()
+        for thread_id in threads:
+            thread_calls = self.threads.get(thread_id)
+            if thread_calls == None:
+                continue
+
+            for call_slice in thread_calls.find_call_slices(
+                function_code, start_time, end_time, callstack_depth
+            ):
+                columns = {
+                    column: values[call_slice]
+                    for column, values in thread_calls.columns.items()
+                }
+                thread_call_slices.append((thread_id, columns))
+
+        return thread_call_slices
+
+    def query(
+        self,
+        function=None,
+        start_time=None,
+        end_time=None,
+        threads=None,
+        callstack_depth=None,
+    ):
+        import pandas as pd
+
+        thread_call_slices = self.find_call_slices(
+            function, start_time, end_time, threads, callstack_depth
+        )
+
+        calls = {column: list() for column in ["thread"] + CALL_COLUMNS}
+        for thread_id, columns in thread_call_slices:
+            calls["thread"].append(np.full(len(columns["start_time"]), thread_id))
+            for column in CALL_COLUMNS:
+                calls[column].append(columns[column])
+
+        if len(thread_call_slices) == 0:
+            return pd.DataFrame(columns=calls.keys())
+
+        calls = {column: np.concatenate(values) for column, values in calls.items()}
+        calls["function"] = self.functions[calls["function"]]
+
+        return (
+            pd.DataFrame(calls)
+            .sort_values(["thread", "start_time", "callstack_depth"], kind="stable")
+            .reset_index(drop=True)
+        )